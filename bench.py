@@ -0,0 +1,773 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from bot import VisualizationManager
+from src.analyzer import PriceAnalyzer
+from src.core import INTERVAL_TIME_STEPS, MONGO_URL
+from src.dispatcher import Dispatcher
+from src.metrics import metrics
+from src.synthetic import generate_klines
+from src.trader import Trader
+from utils import get_unix_timestamp, prepare_plot_data
+
+BENCH_DB_NAME = "crypto_data_bench"
+BENCH_SYMBOL = "BENCHUSDT"
+BENCH_PING_URL = "https://api.binance.com/api/v3/ping"
+BENCH_START_TIME = get_unix_timestamp(datetime(2023, 1, 1))
+SAVE_PAGE_SIZE = 1000  # klines per save, as one binance request
+STARTUP_MODULES = ("bot", "bot_config", "fetch_klines_script", "src.analyzer", "src.kline_manager", "src.dispatcher")
+HEAVY_MODULES = ("matplotlib", "pymongo", "requests", "numpy", "yaml")
+# measures the import in a new interpreter, prints its time and the heavy modules it loaded
+STARTUP_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - start_time
+print(json.dumps([import_time, [name for name in {heavy_modules!r} if name in sys.modules]]))
+"""
+
+
+class StageTimer:
+    """Accumulates the wall time of benchmark stages."""
+
+    def __init__(self):
+        self.stages = defaultdict(float)
+
+    def measure(self, stage, function, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.stages[stage] += time.perf_counter() - start
+
+    def wrap(self, obj, method_name, stage):
+        """Replace the method of this object with a timed one."""
+        method = getattr(obj, method_name)
+
+        def timed_method(*args, **kwargs):
+            return self.measure(stage, method, *args, **kwargs)
+
+        setattr(obj, method_name, timed_method)
+
+
+def create_kline_manager(mongo_url, interval):
+    if mongo_url:
+        from src.kline_manager import KlineManager
+
+        kline_manager = KlineManager(mongo_url, BENCH_DB_NAME, BENCH_SYMBOL, interval)
+        kline_manager.collection.drop()
+        kline_manager.metadata.clear()
+        kline_manager.collection.create_index("startTime")
+        return kline_manager
+
+    from src.kline_manager import InMemoryKlineManager
+
+    return InMemoryKlineManager(BENCH_SYMBOL, interval)
+
+
+def run_engine_benchmark(days, time_window, args):
+    """Time the stages of one historical run over synthetic klines."""
+    timer = StageTimer()
+    metrics.reset()
+    time_step = INTERVAL_TIME_STEPS[args.interval]
+    analysis_start_time = BENCH_START_TIME + time_window * 60 * 60 * 1000
+    analysis_end_time = analysis_start_time + days * 24 * 60 * 60 * 1000
+
+    kline_manager = create_kline_manager(args.mongo_url, args.interval)
+    klines_count = (analysis_end_time - BENCH_START_TIME) // kline_manager.storage_time_step
+    raw_klines = timer.measure(
+        "generate",
+        generate_klines,
+        BENCH_START_TIME,
+        klines_count,
+        args.seed,
+        time_step=kline_manager.storage_time_step,
+    )
+    for page_start in range(0, len(raw_klines), SAVE_PAGE_SIZE):
+        timer.measure("save", kline_manager.save_klines, raw_klines[page_start:page_start + SAVE_PAGE_SIZE])
+
+    analyzer = PriceAnalyzer(time_window, args.growth_percent, args.drop_percent, time_step)
+    trader = Trader()
+    dispatcher = Dispatcher(analyzer, trader, kline_manager)
+    dispatcher.set_time_interval(analysis_start_time, analysis_end_time)
+
+    timer.wrap(kline_manager, "find_klines_in_range", "kline_load")
+    # the covered ranges are not checked kline by kline, the missing klines are looked for only in the others
+    timer.wrap(kline_manager.metadata, "get_uncovered_ranges", "gap_detection")
+    timer.wrap(kline_manager, "find_missing_klines_time", "gap_detection")
+    timer.wrap(analyzer, "_analyze_kline", "analyzer_loop")
+    timer.wrap(trader, "update_orders", "trader_update")
+    analyzed_klines, orders = timer.measure("dispatcher_total", dispatcher.run_for_historical_data)
+
+    with tempfile.TemporaryDirectory() as output_directory:
+        visualization_manager = VisualizationManager(output_directory)
+        output_file = os.path.join(output_directory, "bench.json")
+        timer.measure(
+            "json_write",
+            visualization_manager.save_to_json_file,
+            {"klines": analyzed_klines, "orders": orders},
+            output_file,
+        )
+        output_file_size = os.path.getsize(output_file)
+
+    timer.measure("plot_preparation", prepare_plot_data, analyzed_klines)
+
+    stages = dict(timer.stages)
+    # the dispatcher time not spent in the measured stages: rolling min prices, plot points, loop
+    stages["dispatcher_other"] = stages["dispatcher_total"] - sum(
+        stages.get(stage, 0) for stage in ("kline_load", "gap_detection", "analyzer_loop", "trader_update")
+    )
+    return {
+        "days": days,
+        "time_window": time_window,
+        "klines": len(analyzed_klines),
+        "orders": trader.total_orders_count,
+        "output_file_bytes": output_file_size,
+        "klines_per_second": len(analyzed_klines) / stages["dispatcher_total"] if stages["dispatcher_total"] else None,
+        "stages": {stage: round(seconds, 6) for stage, seconds in sorted(stages.items())},
+        "metrics": metrics.to_dict(),
+    }
+
+
+def engine_benchmark(args):
+    runs = []
+    for days in args.days:
+        for time_window in args.time_window:
+            runs.append(run_engine_benchmark(days, time_window, args))
+    return {
+        "benchmark": "engine",
+        "store": "mongo" if args.mongo_url else "memory",
+        "interval": args.interval,
+        "seed": args.seed,
+        "growth_percent": args.growth_percent,
+        "drop_percent": args.drop_percent,
+        "runs": runs,
+    }
+
+
+def ingest_benchmark(args):
+    """Run the ingest pipeline over synthetic binance pages returned after a simulated request latency."""
+    import src.ingest
+    from src.ingest import IngestPipeline
+
+    kline_manager = create_kline_manager(args.mongo_url, "1m")
+    end_time = BENCH_START_TIME + args.days * 24 * 60 * 60 * 1000
+    raw_klines = generate_klines(BENCH_START_TIME, (end_time - BENCH_START_TIME) // kline_manager.storage_time_step)
+    page_starts = [kline[0] for kline in raw_klines[::SAVE_PAGE_SIZE]]
+
+    def get_klines(start_time, end_time, symbol, interval):
+        time.sleep(args.latency)
+        page_start = (start_time - BENCH_START_TIME) // kline_manager.storage_time_step
+        return raw_klines[page_start:page_start + SAVE_PAGE_SIZE] if start_time < end_time else []
+
+    src.ingest.get_klines = get_klines
+    return {
+        "benchmark": "ingest",
+        "store": "mongo" if args.mongo_url else "memory",
+        "days": args.days,
+        "pages": len(page_starts),
+        "latency_seconds": args.latency,
+        "stats": IngestPipeline(kline_manager, args.queue_size, args.write_batch_size).run(BENCH_START_TIME, end_time),
+    }
+
+
+def measure_per_coin(coins, setup_coin):
+    times = []
+    for coin_index in range(coins):
+        start_time = time.perf_counter()
+        setup_coin(coin_index)
+        times.append(time.perf_counter() - start_time)
+    return {"total_seconds": round(sum(times), 6), "per_coin_seconds": round(statistics.mean(times), 6)}
+
+
+def setup_benchmark(args):
+    """Per-coin setup cost with a client per coin, as before the shared clients, and with the shared clients."""
+    import requests
+    from src.clients import close_clients, ensure_index, get_http_session, get_mongo_client
+
+    def http_requests_new_connection(coin_index):
+        for _ in range(args.requests):
+            requests.get(args.url).raise_for_status()
+
+    def http_requests_shared_session(coin_index):
+        for _ in range(args.requests):
+            get_http_session().get(args.url).raise_for_status()
+
+    results = {
+        "benchmark": "setup",
+        "coins": args.coins,
+        "requests_per_coin": args.requests,
+        "http": {
+            "new_connection": measure_per_coin(args.coins, http_requests_new_connection),
+            "shared_session": measure_per_coin(args.coins, http_requests_shared_session),
+        },
+    }
+
+    if args.mongo_url:
+        from pymongo import MongoClient
+
+        def mongo_new_client(coin_index):
+            mongo_client = MongoClient(args.mongo_url)
+            mongo_client[BENCH_DB_NAME][f"bench{coin_index}_klines"].create_index("startTime")
+            mongo_client.close()
+
+        def mongo_shared_client(coin_index):
+            mongo_client = get_mongo_client(args.mongo_url)
+            ensure_index(mongo_client[BENCH_DB_NAME][f"bench{coin_index % args.distinct_coins}_klines"], "startTime")
+
+        results["distinct_coins"] = args.distinct_coins
+        results["mongo"] = {
+            "new_client": measure_per_coin(args.coins, mongo_new_client),
+            "shared_client": measure_per_coin(args.coins, mongo_shared_client),
+        }
+
+    close_clients()
+    return results
+
+
+def rows_match(rows, expected_rows):
+    return len(rows) == len(expected_rows) and all(
+        len(row) == len(expected_row) and all(
+            value == expected_value or (
+                isinstance(value, float) and abs(value - expected_value) <= 1e-9 * max(1, abs(expected_value))
+            )
+            for value, expected_value in zip(row, expected_row)
+        )
+        for row, expected_row in zip(rows, expected_rows)
+    )
+
+
+def pushdown_benchmark(args):
+    """Aggregates computed by MongoDB pipelines against the same aggregates computed from all loaded klines."""
+    import bson
+    from src import kline_aggregates
+
+    kline_manager = create_kline_manager(args.mongo_url, "1m")
+    end_time = BENCH_START_TIME + args.days * 24 * 60 * 60 * 1000
+    raw_klines = generate_klines(BENCH_START_TIME, (end_time - BENCH_START_TIME) // kline_manager.storage_time_step, args.seed)
+    for page_start in range(0, len(raw_klines), SAVE_PAGE_SIZE):
+        kline_manager.save_klines(raw_klines[page_start:page_start + SAVE_PAGE_SIZE])
+
+    bucket_time = args.bucket_minutes * 60 * 1000
+    window_klines_count = args.time_window * 60 * 60 * 1000 // kline_manager.storage_time_step
+    analyzer = PriceAnalyzer(args.time_window, args.growth_percent, args.drop_percent, kline_manager.storage_time_step)
+    window_start_time = BENCH_START_TIME + window_klines_count * kline_manager.storage_time_step
+
+    def load_klines(start_time=BENCH_START_TIME):
+        return kline_manager.find_klines_in_range(start_time, end_time)
+
+    def get_screening(rows):
+        return analyzer.get_candidate_blocks_from_aggregates(
+            [row[2] for row in rows], [row[3] for row in rows], [row[6] for row in rows]
+        )
+
+    queries = {
+        "buckets": (
+            lambda klines: kline_aggregates.get_bucket_rows(klines, bucket_time),
+            lambda: kline_manager.find_bucket_rows(BENCH_START_TIME, end_time, bucket_time),
+        ),
+        "coverage": (
+            lambda klines: kline_aggregates.get_coverage_rows(klines, bucket_time),
+            lambda: kline_manager.find_coverage_rows(BENCH_START_TIME, end_time, bucket_time),
+        ),
+        "screening": (
+            lambda klines: get_screening(kline_aggregates.get_bucket_rows(klines, bucket_time)),
+            lambda: get_screening(kline_manager.find_bucket_rows(BENCH_START_TIME, end_time, bucket_time)),
+        ),
+        "rolling_extremes": (
+            lambda klines: kline_aggregates.get_rolling_extremes_rows(klines, window_start_time, window_klines_count),
+            lambda: kline_manager.find_rolling_extremes_rows(window_start_time, end_time, window_klines_count),
+        ),
+    }
+    runs = []
+    for query, (compute_client_side, compute_pushdown) in queries.items():
+        client_start_time = time.perf_counter()
+        klines = load_klines()
+        client_result = compute_client_side(klines)
+        client_seconds = time.perf_counter() - client_start_time
+        client_bytes = sum(len(bson.encode(kline)) for kline in klines)
+
+        pushdown_start_time = time.perf_counter()
+        pushdown_result = compute_pushdown()
+        pushdown_seconds = time.perf_counter() - pushdown_start_time
+        if query == "screening":
+            pushdown_bytes = sum(len(bson.encode({"row": row})) for row in queries["buckets"][1]())
+            matches = pushdown_result == client_result
+        else:
+            pushdown_bytes = sum(len(bson.encode({"row": row})) for row in pushdown_result)
+            matches = rows_match(pushdown_result, client_result)
+        runs.append({
+            "query": query,
+            "client_seconds": round(client_seconds, 4),
+            "pushdown_seconds": round(pushdown_seconds, 4),
+            "client_bytes": client_bytes,
+            "pushdown_bytes": pushdown_bytes,
+            "bytes_ratio": round(pushdown_bytes / client_bytes, 5) if client_bytes else None,
+            "matches": matches,
+        })
+    return {
+        "benchmark": "pushdown",
+        "days": args.days,
+        "klines": len(raw_klines),
+        "bucket_minutes": args.bucket_minutes,
+        "time_window": args.time_window,
+        "runs": runs,
+    }
+
+
+def get_trade_klines(trades, time_step):
+    """Klines of the trades, as the kline path of the real time monitoring sees them."""
+    klines = []
+    for trade_time, price in trades:
+        start_time = trade_time - trade_time % time_step
+        if klines and klines[-1]["startTime"] == start_time:
+            kline = klines[-1]
+            kline["high"] = max(kline["high"], price)
+            kline["low"] = min(kline["low"], price)
+            kline["close"] = price
+        else:
+            klines.append({
+                "startTime": start_time,
+                "open": price,
+                "high": price,
+                "low": price,
+                "close": price,
+                "closeTime": start_time + time_step - 1,
+            })
+    return klines
+
+
+def ticks_benchmark(args):
+    """Replay synthetic trades through the trigger index and compare with the orders evaluated on closed klines."""
+    from src.kline_manager import InMemoryKlineManager
+    from src.trigger_index import TRIGGER_LATENCY, TickMonitor
+    from src.synthetic import generate_trades
+
+    time_step = INTERVAL_TIME_STEPS["1m"]
+    trades_count = int(args.days * 24 * 60 * 60 * 1000 / args.trade_interval)
+    trades = generate_trades(
+        BENCH_START_TIME, trades_count, args.seed, args.trade_interval, volatility=args.volatility,
+        patterns_per_day=args.patterns_per_day,
+    )
+    klines = get_trade_klines(trades, time_step)
+
+    def create_dispatcher(kline_manager):
+        analyzer = PriceAnalyzer(args.time_window, args.growth_percent, args.drop_percent, time_step)
+        return Dispatcher(analyzer, Trader(), kline_manager)
+
+    kline_dispatcher = create_dispatcher(InMemoryKlineManager.from_klines(BENCH_SYMBOL, klines))
+    kline_dispatcher.set_time_interval(
+        klines[0]["startTime"] + args.time_window * 60 * 60 * 1000, klines[-1]["closeTime"] + 1
+    )
+    kline_start_time = time.perf_counter()
+    kline_dispatcher.run_for_historical_data()
+    kline_seconds = time.perf_counter() - kline_start_time
+
+    monitor = TickMonitor(create_dispatcher(None), time_step)
+    TRIGGER_LATENCY.reset()
+    tick_start_time = time.perf_counter()
+    monitor.run(trades)
+    tick_seconds = time.perf_counter() - tick_start_time
+
+    def summarize_trader(trader, seconds):
+        return {
+            "seconds": round(seconds, 3),
+            "orders": trader.total_orders_count,
+            "profit": round(trader.total_profit, 2),
+            "successful_orders": trader.successful_orders_count,
+            "failed_orders": trader.failed_orders_count,
+        }
+
+    return {
+        "benchmark": "ticks",
+        "days": args.days,
+        "trades": len(trades),
+        "klines": len(klines),
+        "seed": args.seed,
+        "kline_orders": summarize_trader(kline_dispatcher.trader, kline_seconds),
+        "tick_orders": {
+            **summarize_trader(monitor.trader, tick_seconds),
+            "trades_per_second": round(len(trades) / tick_seconds),
+            "trigger_action_seconds": TRIGGER_LATENCY.to_dict(),
+        },
+    }
+
+
+BENCH_JOB_RUNS_COLLECTION_NAME = "bench_job_runs"
+
+
+def run_bench_job(parameters, heartbeat, mongo_url, db_name):
+    """Backtest of the jobs benchmark: records the run, waits and fails if the job says so."""
+    from src.clients import get_mongo_client
+
+    get_mongo_client(mongo_url)[db_name][BENCH_JOB_RUNS_COLLECTION_NAME].insert_one({"job": parameters["index"]})
+    time.sleep(parameters["seconds"])
+    if parameters.get("fail"):
+        raise Exception(f"Failing job {parameters['index']}")
+    return {"profit": parameters["index"]}
+
+
+def start_bench_worker(mongo_url, lease_time):
+    from utils import configure_logging
+    from worker import run_worker
+
+    configure_logging(log_to_file=False, level=logging.WARNING)
+    run_worker(mongo_url, BENCH_DB_NAME, lease_time, poll_interval=0.1, exit_when_empty=True, backtest=run_bench_job)
+
+
+def jobs_benchmark(args):
+    """Several workers over the queue of a local MongoDB, with checks of the queue semantics."""
+    from multiprocessing import Process
+
+    from src.clients import get_mongo_client
+    from src.job_queue import MAX_ATTEMPTS, JobQueue, JobStatus
+
+    lease_time = args.lease_seconds * 1000
+    job_queue = JobQueue(args.mongo_url, BENCH_DB_NAME, lease_time)
+    job_queue.clear()
+    runs = get_mongo_client(args.mongo_url)[BENCH_DB_NAME][BENCH_JOB_RUNS_COLLECTION_NAME]
+    runs.delete_many({})
+
+    jobs = [
+        {"index": index, "seconds": args.job_seconds, "fail": index < args.failing_jobs}
+        for index in range(args.jobs)
+    ]
+    submitted_count = job_queue.submit_many(jobs)
+    resubmitted_count = job_queue.submit_many(jobs)
+
+    workers_start_time = time.perf_counter()
+    processes = [Process(target=start_bench_worker, args=(args.mongo_url, lease_time)) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    workers_seconds = time.perf_counter() - workers_start_time
+
+    runs_count = defaultdict(int)
+    for run in runs.find({}, {"job": 1}):
+        runs_count[run["job"]] += 1
+    statuses = {job["parameters"]["index"]: job for job in job_queue.jobs.find({})}
+    passing_jobs = [job["index"] for job in jobs if not job["fail"]]
+    failing_jobs = [job["index"] for job in jobs if job["fail"]]
+
+    # a lease expires while its worker is still running: the job is claimed again, the late result is dropped
+    job_queue.clear()
+    expiring_queue = JobQueue(args.mongo_url, BENCH_DB_NAME, lease_time=100)
+    expiring_job_id, _ = expiring_queue.submit({"index": "expiring"})
+    first_claim = expiring_queue.claim("first-worker")
+    time.sleep(0.2)
+    second_claim = expiring_queue.claim("second-worker")
+    late_result_saved = expiring_queue.complete(expiring_job_id, "first-worker", {"profit": 1})
+    result_saved = expiring_queue.complete(expiring_job_id, "second-worker", {"profit": 2})
+    expiring_job = expiring_queue.jobs.find_one({"_id": expiring_job_id})
+    job_queue.clear()
+
+    checks = {
+        "duplicate_submit_ignored": submitted_count == len(jobs) and resubmitted_count == 0,
+        "jobs_done_once": all(
+            statuses[index]["status"] == JobStatus.DONE.value and runs_count[index] == 1 for index in passing_jobs
+        ),
+        "failed_jobs_retried": all(
+            statuses[index]["status"] == JobStatus.FAILED.value
+            and statuses[index]["attempts"] == MAX_ATTEMPTS
+            and runs_count[index] == MAX_ATTEMPTS
+            for index in failing_jobs
+        ),
+        "expired_lease_claimed": (
+            first_claim is not None and second_claim is not None
+            and second_claim["_id"] == expiring_job_id and second_claim["attempts"] == 2
+        ),
+        "late_result_dropped": (
+            not late_result_saved and result_saved and expiring_job["result"] == {"profit": 2}
+        ),
+    }
+    return {
+        "benchmark": "jobs",
+        "jobs": args.jobs,
+        "failing_jobs": args.failing_jobs,
+        "workers": args.workers,
+        "workers_seconds": round(workers_seconds, 3),
+        "jobs_per_second": round(len(jobs) / workers_seconds, 2),
+        "checks": checks,
+        "passed": all(checks.values()),
+    }
+
+
+BENCH_FETCH_REQUESTS_COLLECTION_NAME = "bench_fetch_requests"
+
+
+def run_bench_fetch(mongo_url, start_time, end_time, latency, lock_seconds, seed):
+    """Process of the fetches benchmark: loads the range from binance pages answered after the latency."""
+    import src.ingest
+    from src.clients import get_mongo_client
+    from src.kline_manager import KlineManager
+    from utils import configure_logging
+
+    configure_logging(log_to_file=False, level=logging.WARNING)
+    kline_manager = KlineManager(mongo_url, BENCH_DB_NAME, BENCH_SYMBOL)
+    kline_manager.fetches.fetch_lock.lock_seconds = lock_seconds
+    time_step = kline_manager.storage_time_step
+    raw_klines = generate_klines(BENCH_START_TIME, (end_time - BENCH_START_TIME) // time_step, seed)
+    requests = get_mongo_client(mongo_url)[BENCH_DB_NAME][BENCH_FETCH_REQUESTS_COLLECTION_NAME]
+
+    def get_klines(request_start_time, request_end_time, symbol, interval):
+        time.sleep(latency)
+        page_start = -(-(request_start_time - BENCH_START_TIME) // time_step)  # rounded up
+        # binance includes the kline starting at the end time
+        page = [kline for kline in raw_klines[page_start:page_start + SAVE_PAGE_SIZE] if kline[0] <= request_end_time]
+        requests.insert_one({"start": request_start_time, "klines": len(page)})
+        return page
+
+    src.ingest.get_klines = get_klines
+    kline_manager.find_or_fetch_klines_in_range(start_time, end_time)
+
+
+def fetches_benchmark(args):
+    """Processes loading overlapping missing ranges from a local MongoDB, with checks of the fetch locks."""
+    from multiprocessing import Process
+
+    from src.clients import get_mongo_client
+    from src.single_flight import FETCH_LOCKS_COLLECTION_NAME, FetchLock, FetchLockHeartbeat
+
+    kline_manager = create_kline_manager(args.mongo_url, "1m")
+    db = get_mongo_client(args.mongo_url)[BENCH_DB_NAME]
+    requests = db[BENCH_FETCH_REQUESTS_COLLECTION_NAME]
+    requests.delete_many({})
+    db[FETCH_LOCKS_COLLECTION_NAME].delete_many({})
+
+    day_time = 24 * 60 * 60 * 1000
+    end_time = BENCH_START_TIME + args.days * day_time
+    # every process starts a day later than the previous one, all of them need the last days
+    processes = [
+        Process(target=run_bench_fetch, args=(
+            args.mongo_url, BENCH_START_TIME + process_index * day_time, end_time,
+            args.latency, args.lock_seconds, args.seed,
+        ))
+        for process_index in range(args.processes)
+    ]
+    fetch_start_time = time.perf_counter()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    fetch_seconds = time.perf_counter() - fetch_start_time
+
+    klines_count = (end_time - BENCH_START_TIME) // kline_manager.storage_time_step
+    stored_times = [kline["startTime"] for kline in kline_manager.collection.find({}, {"startTime": 1})]
+    fetched_klines_count = sum(request["klines"] for request in requests.find({}))
+    locks_document = db[FETCH_LOCKS_COLLECTION_NAME].find_one({}) or {}
+
+    # a lock kept by its heartbeat longer than its expiration is not given to another process,
+    # the lock of a process that stopped extending it expires
+    lock_seconds = 0.3
+    fetch_lock = FetchLock(db[FETCH_LOCKS_COLLECTION_NAME], "bench_heartbeat", lock_seconds)
+    other_fetch_lock = FetchLock(db[FETCH_LOCKS_COLLECTION_NAME], "bench_heartbeat", lock_seconds)
+    acquired_ranges = fetch_lock.acquire(0, 100)
+    with FetchLockHeartbeat(fetch_lock, 0, 100):
+        time.sleep(lock_seconds * 3)
+        extended_lock_acquired_ranges = other_fetch_lock.acquire(0, 100)
+    time.sleep(lock_seconds * 2)
+    expired_lock_acquired_ranges = other_fetch_lock.acquire(0, 100)
+    db[FETCH_LOCKS_COLLECTION_NAME].delete_many({})
+    requests.delete_many({})
+
+    checks = {
+        "klines_stored_once": len(stored_times) == len(set(stored_times)) == klines_count,
+        "klines_fetched_once": fetched_klines_count == klines_count,
+        "locks_released": not locks_document.get("ranges"),
+        "extended_lock_kept": acquired_ranges == [(0, 100)] and extended_lock_acquired_ranges == [],
+        "stopped_lock_expired": expired_lock_acquired_ranges == [(0, 100)],
+    }
+    return {
+        "benchmark": "fetches",
+        "days": args.days,
+        "processes": args.processes,
+        "klines": klines_count,
+        "fetched_klines": fetched_klines_count,
+        "fetch_seconds": round(fetch_seconds, 3),
+        "checks": checks,
+        "passed": all(checks.values()),
+    }
+
+
+def measure_startup(module, repeat):
+    import_times = []
+    wall_times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        wall_times.append(time.perf_counter() - start_time)
+        import_time, heavy_modules = json.loads(output)
+        import_times.append(import_time)
+    return {
+        "module": module,
+        "import_seconds": round(statistics.median(import_times), 6),
+        "process_seconds": round(statistics.median(wall_times), 6),
+        "heavy_modules": heavy_modules,
+    }
+
+
+def startup_benchmark(args):
+    return {
+        "benchmark": "startup",
+        "repeat": args.repeat,
+        "runs": [measure_startup(module, args.repeat) for module in args.modules],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the bot engine, results are printed as JSON.")
+    parser.add_argument("--output", type=str, help="Also write the JSON results to this file")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    engine_parser = subparsers.add_parser(
+        "engine", help="Time the stages of historical runs over synthetic klines"
+    )
+    engine_parser.add_argument("--days", type=int, nargs="+", default=[30], help="Analysis range lengths in days")
+    engine_parser.add_argument(
+        "--time-window", type=int, nargs="+", default=[24], help="Analyzer time windows in hours"
+    )
+    engine_parser.add_argument("--growth-percent", type=float, default=10, help="Percentage rised threshold")
+    engine_parser.add_argument("--drop-percent", type=float, default=5, help="Percentage drop threshold")
+    engine_parser.add_argument(
+        "--interval", type=str, default="1m", choices=INTERVAL_TIME_STEPS.keys(), help="Analyzed klines interval"
+    )
+    engine_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic klines")
+    engine_parser.add_argument(
+        "--mongo-url",
+        type=str,
+        nargs="?",
+        const=MONGO_URL,
+        help=f"Use a local MongoDB (database {BENCH_DB_NAME}) instead of the in-memory store",
+    )
+    engine_parser.set_defaults(run=engine_benchmark)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="Throughput of the fetch, parse and write stages over simulated binance responses"
+    )
+    ingest_parser.add_argument("--days", type=int, default=30, help="Ingested range length in days")
+    ingest_parser.add_argument("--latency", type=float, default=0.05, help="Simulated request latency in seconds")
+    ingest_parser.add_argument("--queue-size", type=int, default=4, help="Pages waiting between two stages")
+    ingest_parser.add_argument("--write-batch-size", type=int, default=5000, help="Klines per insert")
+    ingest_parser.add_argument(
+        "--mongo-url",
+        type=str,
+        nargs="?",
+        const=MONGO_URL,
+        help=f"Use a local MongoDB (database {BENCH_DB_NAME}) instead of the in-memory store",
+    )
+    ingest_parser.set_defaults(run=ingest_benchmark)
+
+    setup_parser = subparsers.add_parser(
+        "setup", help="Per-coin MongoDB and HTTP setup cost with new and with shared clients"
+    )
+    setup_parser.add_argument("--coins", type=int, default=10, help="Coins set up one after another")
+    setup_parser.add_argument(
+        "--distinct-coins", type=int, default=2, help="Different collections among the coins, as runs of a config"
+    )
+    setup_parser.add_argument("--requests", type=int, default=3, help="HTTP requests per coin")
+    setup_parser.add_argument("--url", type=str, default=BENCH_PING_URL, help="Requested URL")
+    setup_parser.add_argument(
+        "--mongo-url",
+        type=str,
+        nargs="?",
+        const=MONGO_URL,
+        help=f"Also measure the MongoDB client setup (database {BENCH_DB_NAME})",
+    )
+    setup_parser.set_defaults(run=setup_benchmark)
+
+    pushdown_parser = subparsers.add_parser(
+        "pushdown", help="MongoDB aggregation pipelines against client-side aggregates of the loaded klines"
+    )
+    pushdown_parser.add_argument("--days", type=int, default=365, help="Stored range length in days")
+    pushdown_parser.add_argument("--bucket-minutes", type=int, default=60, help="Bucket of the aggregates")
+    pushdown_parser.add_argument("--time-window", type=int, default=24, help="Rolling window in hours")
+    pushdown_parser.add_argument("--growth-percent", type=float, default=10, help="Growth threshold of the screening")
+    pushdown_parser.add_argument("--drop-percent", type=float, default=5, help="Percentage drop threshold")
+    pushdown_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic klines")
+    pushdown_parser.add_argument(
+        "--mongo-url", type=str, default=MONGO_URL, help=f"Local MongoDB, the klines are saved to {BENCH_DB_NAME}"
+    )
+    pushdown_parser.set_defaults(run=pushdown_benchmark)
+
+    ticks_parser = subparsers.add_parser(
+        "ticks", help="Order triggers on synthetic trades compared with the orders evaluated on closed klines"
+    )
+    ticks_parser.add_argument("--days", type=float, default=3, help="Length of the trade stream in days")
+    ticks_parser.add_argument("--trade-interval", type=int, default=200, help="Mean time between trades in ms")
+    ticks_parser.add_argument("--volatility", type=float, default=0.0002, help="Standard deviation of a trade return")
+    ticks_parser.add_argument("--patterns-per-day", type=float, default=2, help="Pumps, dumps and sideways per day")
+    ticks_parser.add_argument("--time-window", type=int, default=6, help="Analyzer time window in hours")
+    ticks_parser.add_argument("--growth-percent", type=float, default=5, help="Percentage rised threshold")
+    ticks_parser.add_argument("--drop-percent", type=float, default=2, help="Percentage drop threshold")
+    ticks_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic trades")
+    ticks_parser.set_defaults(run=ticks_benchmark)
+
+    jobs_parser = subparsers.add_parser(
+        "jobs", help="Worker processes over the job queue of a local MongoDB, with checks of the queue semantics"
+    )
+    jobs_parser.add_argument("--jobs", type=int, default=40, help="Queued jobs")
+    jobs_parser.add_argument("--failing-jobs", type=int, default=2, help="Jobs raising on every attempt")
+    jobs_parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+    jobs_parser.add_argument("--job-seconds", type=float, default=0.05, help="Duration of a job")
+    jobs_parser.add_argument("--lease-seconds", type=int, default=10, help="Lease of a claimed job")
+    jobs_parser.add_argument(
+        "--mongo-url", type=str, default=MONGO_URL, help=f"Local MongoDB, the jobs are queued in {BENCH_DB_NAME}"
+    )
+    jobs_parser.set_defaults(run=jobs_benchmark)
+
+    fetches_parser = subparsers.add_parser(
+        "fetches", help="Processes fetching overlapping missing klines, with checks of the fetch locks"
+    )
+    fetches_parser.add_argument("--days", type=int, default=5, help="Days of 1m klines missing in the database")
+    fetches_parser.add_argument("--processes", type=int, default=4, help="Processes loading the range")
+    fetches_parser.add_argument("--latency", type=float, default=0.2, help="Seconds before a binance page is returned")
+    fetches_parser.add_argument(
+        "--lock-seconds", type=float, default=0.5, help="Expiration of the fetch locks, shorter than a fetch"
+    )
+    fetches_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic klines")
+    fetches_parser.add_argument(
+        "--mongo-url", type=str, default=MONGO_URL, help=f"Local MongoDB, the klines are saved in {BENCH_DB_NAME}"
+    )
+    fetches_parser.set_defaults(run=fetches_benchmark)
+
+    startup_parser = subparsers.add_parser(
+        "startup", help="Time the cold import of the entry points and the modules used by workers"
+    )
+    startup_parser.add_argument("--modules", type=str, nargs="+", default=STARTUP_MODULES, help="Modules to import")
+    startup_parser.add_argument("--repeat", type=int, default=5, help="Imports per module, the median is reported")
+    startup_parser.set_defaults(run=startup_benchmark)
+
+    args = parser.parse_args()
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        **args.run(args),
+    }
+
+    output = json.dumps(results, indent=4)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+
+
+if __name__ == "__main__":
+    main()
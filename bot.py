@@ -1,56 +1,106 @@
 import os
 import argparse
+import cProfile
 import json
+import logging
+import time
 from datetime import datetime
-from draw_graph import create_graph
 from src.analyzer import PriceAnalyzer
-from src.dispatcher import Dispatcher
+from src.dispatcher import Dispatcher, MultiStrategyDispatcher
+from src.core import INTERVAL_TIME_STEPS, MONGO_URL, DB_NAME, OUTPUT_DIRECTORY
+from src.metrics import metrics, start_metrics_server
 from src.trader import Trader
 from utils import (
+    configure_logging,
     get_unix_timestamp,
     determine_analysis_start_time,
     convert_unix_to_date_only_str,
     get_next_file_number,
     parse_date,
-    serialize_object, )
+    serialize_object,
+    logger, )
 
 
-TIME_STEP = 1 * 60 * 1000  # one minute in unix
-MONGO_URL = "mongodb://localhost:27017/"
-DB_NAME = "crypto_data"
-DEVIATION = 0.04
-OUTPUT_DIRECTORY = "analyzed_data"
+def get_analysis_start_time(config, kline_manager):
+    if config.get('analysis_start_time'):
+        return config.get('analysis_start_time')
+    # find start time for analysis
+    return determine_analysis_start_time(kline_manager, config.get('time_window'))
 
 
-def process_coin(config):
+def create_second_kline_cache(config):
+    """1s klines of the coin for the drill-down of ambiguous candles, fetched and stored on demand."""
+    from src.drilldown import SecondKlineCache
     from src.kline_manager import KlineManager
 
-    kline_manager = KlineManager(MONGO_URL, DB_NAME, config.get('coin_symbol'))
+    return SecondKlineCache(KlineManager(MONGO_URL, DB_NAME, config.get('coin_symbol'), "1s"))
+
+
+def create_performance_tracker(config, **labels):
+    from src.performance import EQUITY_RESOLUTION, PerformanceTracker
+
+    resolution = config['equity_resolution'] * 60 * 1000 if config.get('equity_resolution') else EQUITY_RESOLUTION
+    return PerformanceTracker(resolution, symbol=config.get('coin_symbol'), **labels)
+
+
+def get_results_summary(trader):
+    summary = {"performance": trader.performance.to_dict()}
+    drill_down = trader.drill_down
+    if drill_down is not None:
+        logger.info(f"Drill-down with 1s klines: {drill_down.candles_count} candles, {drill_down.orders_count} orders")
+        summary["drill_down"] = drill_down.to_dict()
+    return summary
+
+
+def process_coin(config, kline_manager=None):
+    if kline_manager is None:
+        from src.kline_manager import KlineManager
+
+        kline_manager = KlineManager(MONGO_URL, DB_NAME, config.get('coin_symbol'), config.get('interval') or "1m")
+    if config.get('strategies'):
+        if config.get('real_time') or config.get('replay'):
+            raise Exception(
+                f"Strategies of {config.get('coin_symbol')} run only on historical data, not in real time or replay"
+            )
+        process_coin_strategies(config, kline_manager)
+        return
+
     analyzer = PriceAnalyzer(
         config.get('time_window'),
         config.get('growth_percent'),
         config.get('drop_percent'),
+        kline_manager.time_step,
     )
-    trader = Trader()
+    drill_down = None
+    if config.get('drill_down') and not config.get('real_time'):
+        from src.drilldown import DrillDown
+
+        drill_down = DrillDown(create_second_kline_cache(config))
+    trader = Trader(drill_down, create_performance_tracker(config))
     dispatcher = Dispatcher(
         analyzer,
         trader,
         kline_manager,
     )
 
+    if config.get('replay'):
+        replay_coin(config, kline_manager)
+        return
+
     if config.get('real_time'):
+        if config.get('metrics_port'):
+            start_metrics_server(config.get('metrics_port'))
         dispatcher.real_time_monitoring()
     else:
         analysis_end_time = config.get('analysis_end_time')
-        if not config.get('analysis_start_time'):
-            # find start time for analysis
-            analysis_start_time = determine_analysis_start_time(analysis_end_time,  config.get('time_window'), config.get('coin_symbol'))
-        else:
-            analysis_start_time = config.get('analysis_start_time')
+        analysis_start_time = get_analysis_start_time(config, kline_manager)
 
         dispatcher.set_time_interval(analysis_start_time, analysis_end_time)
 
-        analyzed_klines, orders = dispatcher.run_for_historical_data()
+        if config.get('two_pass'):
+            analyzed_klines, orders = dispatcher.run_two_pass_for_historical_data()
+        else:
+            analyzed_klines, orders = dispatcher.run_for_historical_data()
 
         visualization_manager = VisualizationManager(OUTPUT_DIRECTORY)
         visualization_manager.save_and_visualize(
@@ -60,26 +110,140 @@ def process_coin(config):
             symbol=config.get('coin_symbol'),
             start_time=analysis_start_time,
             end_time=analysis_end_time,
-            draw_graph=config.get('draw_graph')
+            draw_graph=config.get('draw_graph'),
+            summary=get_results_summary(trader),
         )
+        visualization_manager.save_metrics_summary(config.get('coin_symbol'), analysis_start_time, analysis_end_time)
+        if config.get('store_results'):
+            store_run(config, trader, analyzed_klines, analysis_start_time, analysis_end_time)
+
+
+def store_run(config, trader, analyzed_klines, analysis_start_time, analysis_end_time):
+    from src.results_store import ResultsStore
+
+    ResultsStore(MONGO_URL, DB_NAME).save_run(
+        symbol=config.get('coin_symbol'),
+        interval=config.get('interval') or "1m",
+        parameters={
+            'time_window': config.get('time_window'),
+            'growth_percent': config.get('growth_percent'),
+            'drop_percent': config.get('drop_percent'),
+        },
+        start_time=analysis_start_time,
+        end_time=analysis_end_time,
+        trader=trader,
+        analyzed_klines=analyzed_klines,
+    )
+
+
+def replay_coin(config, kline_manager):
+    """Replay the stored klines of the analysis period through the real time path and check it against the historical run."""
+    from src.replay import check_replay, load_replay_klines
+
+    analysis_end_time = config.get('analysis_end_time')
+    analysis_start_time = get_analysis_start_time(config, kline_manager)
+    replay_kline_manager = load_replay_klines(
+        kline_manager, analysis_start_time - config.get('time_window') * 60 * 60 * 1000, analysis_end_time
+    )
+    analyzed_klines, orders, replay_stats = check_replay(
+        config, replay_kline_manager, analysis_start_time, analysis_end_time, config.get('replay_speed')
+    )
+
+    visualization_manager = VisualizationManager(OUTPUT_DIRECTORY)
+    visualization_manager.save_and_visualize(
+        analyzed_klines=analyzed_klines,
+        orders=orders,
+        file_prefix="replay_data",
+        symbol=config.get('coin_symbol'),
+        start_time=analysis_start_time,
+        end_time=analysis_end_time,
+        draw_graph=config.get('draw_graph')
+    )
+    replay_stats_file = visualization_manager.generate_output_file_path(
+        file_prefix="replay_stats",
+        symbol=config.get('coin_symbol'),
+        start_time=analysis_start_time,
+        end_time=analysis_end_time,
+    )
+    visualization_manager.save_to_json_file(replay_stats, replay_stats_file)
+    logger.info(f"Replay stats saved to {replay_stats_file}")
+
+
+def get_strategy_name(strategy_config):
+    return (
+        f"g{strategy_config.get('growth_percent')}"
+        f"_d{strategy_config.get('drop_percent')}_w{strategy_config.get('time_window')}"
+    )
+
+
+def process_coin_strategies(config, kline_manager):
+    """
+    Run several analyzer configurations over one read of the coin klines.
+    Each item of config['strategies'] has its own time_window, growth_percent and drop_percent,
+    missing values are taken from the coin config.
+    With config['order_book'] the orders of all strategies are evaluated together by one OrderBook.
+    """
+    strategies_config = [{**config, **strategy_config} for strategy_config in config.get('strategies')]
+    order_book = None
+    if config.get('order_book'):
+        from src.order_book import OrderBook, BookTrader
 
-def prepare_kline_plot_data(kline):
-    kline = {  # save only data needed for plotting
-            "status": "",
-            "time": kline["closeTime"],  # save the closeTime as x coordinate to show the kline
-            "price": kline["close"] # save close price as y coordinate
-        }
-    return kline
+        order_book = OrderBook()
+    second_kline_cache = None
+    if config.get('drill_down'):
+        from src.drilldown import DrillDown
 
+        # the strategies share the 1s klines, each trader counts its own drill-downs
+        second_kline_cache = create_second_kline_cache(config)
 
-def get_min_price(
-    klines, start_index, last_index
-):  # optimization of the search for the minimum value
-    min_price = klines[start_index]["low"]
-    for j in range(start_index + 1, last_index):
-        if klines[j]["low"] < min_price:
-            min_price = klines[j]["low"]
-    return min_price
+    def create_trader(strategy_config):
+        drill_down = DrillDown(second_kline_cache) if second_kline_cache else None
+        performance = create_performance_tracker(config, strategy=get_strategy_name(strategy_config))
+        return BookTrader(order_book, drill_down, performance) if order_book else Trader(drill_down, performance)
+
+    strategies = [
+        (
+            PriceAnalyzer(
+                strategy_config.get('time_window'),
+                strategy_config.get('growth_percent'),
+                strategy_config.get('drop_percent'),
+                kline_manager.time_step,
+            ),
+            create_trader(strategy_config),
+        )
+        for strategy_config in strategies_config
+    ]
+    dispatcher = MultiStrategyDispatcher.from_strategies(strategies, kline_manager, order_book)
+
+    analysis_end_time = config.get('analysis_end_time')
+    # the longest window defines the start time when it is determined by the coin listing
+    analysis_start_time = get_analysis_start_time(
+        {**config, 'time_window': max(strategy_config.get('time_window') for strategy_config in strategies_config)},
+        kline_manager,
+    )
+    dispatcher.set_time_interval(analysis_start_time, analysis_end_time)
+
+    results = dispatcher.run_for_historical_data()
+
+    visualization_manager = VisualizationManager(OUTPUT_DIRECTORY)
+    for strategy_config, (_, trader), (analyzed_klines, orders) in zip(strategies_config, strategies, results):
+        if config.get('store_results'):
+            store_run(strategy_config, trader, analyzed_klines, analysis_start_time, analysis_end_time)
+        visualization_manager.save_and_visualize(
+            analyzed_klines=analyzed_klines,
+            orders=orders,
+            file_prefix=f"analyzed_data_{get_strategy_name(strategy_config)}",
+            symbol=config.get('coin_symbol'),
+            start_time=analysis_start_time,
+            end_time=analysis_end_time,
+            draw_graph=config.get('draw_graph'),
+            summary=get_results_summary(trader),
+        )
+    visualization_manager.save_metrics_summary(config.get('coin_symbol'), analysis_start_time, analysis_end_time)
+
+
+JSON_WRITE_LATENCY = metrics.histogram("json_write_seconds", "Duration of saving the results to a JSON file")
+GRAPH_LATENCY = metrics.histogram("graph_seconds", "Duration of drawing a graph")
 
 
 class VisualizationManager:
@@ -91,17 +255,43 @@ class VisualizationManager:
     def generate_output_file_path(self, file_prefix, symbol, start_time, end_time, file_format=".json"):
         str_start_time = convert_unix_to_date_only_str(start_time)
         str_end_time = convert_unix_to_date_only_str(end_time)
-        file_number = get_next_file_number(directory=self.output_directory, format=file_format)
-        return f"{self.output_directory}/{file_number}_{file_prefix}_{symbol}_{str_start_time}_{str_end_time}{file_format}"
+        while True:
+            file_number = get_next_file_number(directory=self.output_directory, format=file_format)
+            file_path = f"{self.output_directory}/{file_number}_{file_prefix}_{symbol}_{str_start_time}_{str_end_time}{file_format}"
+            try:
+                # the file is created here, a parallel run getting the same number takes the next one
+                open(file_path, "x").close()
+                return file_path
+            except FileExistsError:
+                pass
 
     def save_to_json_file(self, data, file_path):
+        write_start_time = time.perf_counter()
         with open(file_path, "w") as file:
             json.dump(data, file, default=serialize_object, indent=4)
+        JSON_WRITE_LATENCY.observe(time.perf_counter() - write_start_time)
 
     def visualize_data(self, file_path):
+        from draw_graph import create_graph  # matplotlib is loaded only to draw a graph
+
+        graph_start_time = time.perf_counter()
         create_graph(file_path)
+        GRAPH_LATENCY.observe(time.perf_counter() - graph_start_time)
+
+    def save_metrics_summary(self, symbol, start_time, end_time):
+        """Save the metrics collected during the run next to the results."""
+        output_file = self.generate_output_file_path(
+            file_prefix="metrics",
+            symbol=symbol,
+            start_time=start_time,
+            end_time=end_time,
+        )
+        self.save_to_json_file(metrics.to_dict(), output_file)
+        logger.info(f"Metrics summary saved to {output_file}")
 
-    def save_and_visualize(self, analyzed_klines, orders, file_prefix, symbol, start_time, end_time, draw_graph=False):
+    def save_and_visualize(
+        self, analyzed_klines, orders, file_prefix, symbol, start_time, end_time, draw_graph=False, summary=None
+    ):
         """
         Save the results to a file, and optionally visualize the data.
         """
@@ -112,7 +302,10 @@ class VisualizationManager:
             end_time=end_time,
         )
 
-        self.save_to_json_file({"klines": analyzed_klines, "orders": orders}, output_file)
+        results = {"klines": analyzed_klines, "orders": orders}
+        if summary:
+            results["summary"] = summary
+        self.save_to_json_file(results, output_file)
 
         if draw_graph:
             self.visualize_data(output_file)
@@ -151,14 +344,87 @@ def main():
         default=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         help="End time in format YYYY-MM-DD HH:MM:SS or YYYY-MM-DD",
     )
+    parser.add_argument(
+        "--interval",
+        type=str,
+        default="1m",
+        choices=INTERVAL_TIME_STEPS.keys(),
+        help="Klines interval, 5m, 15m and 1h klines are resampled from stored 1m klines",
+    )
     parser.add_argument("--real-time", action="store_true", help="Real time monitoring")
     parser.add_argument("--draw-graph", action="store_true", help="Draw graph")
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Replay the stored klines of the analysis period through the real time path with a simulated clock",
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        help="Replay speed relative to real time, unthrottled by default",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Serve Prometheus metrics on this port in real time mode",
+    )
+    parser.add_argument(
+        "--log-level",
+        type=str,
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Logging level, DEBUG logs every high, low and mid kline",
+    )
+    parser.add_argument(
+        "--event-log",
+        type=str,
+        help="Write analyzer and order events to this file as JSON lines",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=f"Profile the run with cProfile, the stats file is saved to {OUTPUT_DIRECTORY}",
+    )
+    parser.add_argument(
+        "--store-results",
+        action="store_true",
+        help="Save the run, its orders and events to the MongoDB results store",
+    )
+    parser.add_argument(
+        "--equity-resolution",
+        type=int,
+        help="Minutes between the points of the equity curve saved with the results, 60 by default",
+    )
+    parser.add_argument(
+        "--drill-down",
+        action="store_true",
+        help="Replay the candles reaching two prices of an order with its 1s klines, fetched on demand",
+    )
+    parser.add_argument(
+        "--two-pass",
+        action="store_true",
+        help="Screen hourly blocks first and analyze only where the growth percent can be reached",
+    )
 
     args = parser.parse_args()
+    configure_logging(level=getattr(logging, args.log_level), event_log_path=args.event_log)
 
     args.analysis_end_time = get_unix_timestamp(args.analysis_end_time)
-    args.analysis_start_time = get_unix_timestamp(args.analysis_start_time)
-    process_coin(vars(args))
+    if args.analysis_start_time:
+        args.analysis_start_time = get_unix_timestamp(args.analysis_start_time)
+    if not args.profile:
+        process_coin(vars(args))
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(process_coin, vars(args))
+    finally:
+        if not os.path.exists(OUTPUT_DIRECTORY):
+            os.makedirs(OUTPUT_DIRECTORY)
+        stats_file = f"{OUTPUT_DIRECTORY}/profile_{args.coin_symbol}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.prof"
+        profiler.dump_stats(stats_file)
+        logger.info(f"Profile stats saved to {stats_file}")
 
 
 if __name__ == "__main__":
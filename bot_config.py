@@ -1,11 +1,14 @@
+import argparse
 import yaml
 
 from datetime import datetime
 import os
 import logging
 
-from binance_bot.utils import get_unix_timestamp
 from bot import process_coin
+from src.clients import configure_clients
+from src.core import DB_NAME, MONGO_URL
+from utils import configure_logging, get_unix_timestamp
 
 
 def load_config(file_path="config.yaml"):
@@ -15,21 +18,115 @@ def load_config(file_path="config.yaml"):
     else:
         return {}
 
+
+def get_max_time_window(coin_config):
+    time_windows = [coin_config.get('time_window')]
+    time_windows += [strategy_config.get('time_window') for strategy_config in coin_config.get('strategies') or []]
+    return max(time_window for time_window in time_windows if time_window is not None)
+
+
+def publish_klines(coin_configs):
+    """
+    Load the klines of every (symbol, interval) once, over the union of the time ranges of its coins,
+    and publish them to shared memory. Returns the shared klines by (symbol, interval).
+    """
+    from src.kline_manager import KlineManager
+    from src.shared_klines import SharedKlines
+
+    coin_configs_by_symbol = {}
+    for coin_config in coin_configs:
+        key = (coin_config['coin_symbol'], coin_config.get('interval') or "1m")
+        coin_configs_by_symbol.setdefault(key, []).append(coin_config)
+
+    shared_klines_by_symbol = {}
+    for (symbol, interval), symbol_configs in coin_configs_by_symbol.items():
+        start_time = min(
+            coin_config['analysis_start_time'] - get_max_time_window(coin_config) * 60 * 60 * 1000
+            for coin_config in symbol_configs
+        )
+        end_time = max(coin_config['analysis_end_time'] for coin_config in symbol_configs)
+        kline_manager = KlineManager(MONGO_URL, DB_NAME, symbol, interval)
+        klines = kline_manager.find_or_fetch_stored_klines_in_range(start_time, end_time)
+        shared_klines_by_symbol[(symbol, interval)] = SharedKlines.publish(klines, (start_time, end_time))
+        logging.getLogger("root").info(f"Published {len(klines)} klines of {symbol} {interval} to shared memory")
+    return shared_klines_by_symbol
+
+
+def init_worker():
+    configure_logging(log_to_file=False)
+
+
+def process_shared_coin(task):
+    """Run a coin in a worker over the published klines, without reading them from MongoDB."""
+    from src.shared_klines import SharedKlineManager
+
+    coin_config, descriptor = task
+    kline_manager = SharedKlineManager.attach(coin_config['coin_symbol'], descriptor, coin_config.get('interval') or "1m")
+    try:
+        process_coin(coin_config, kline_manager)
+    finally:
+        kline_manager.close()
+    return coin_config['coin_symbol']
+
+
+def process_coins_in_workers(coin_configs, workers):
+    """
+    Run the historical coins in a process pool. The klines of each symbol are read once in this process
+    and shared with the workers, real time coins still run here one after another.
+    """
+    from multiprocessing import Pool
+
+    historical_configs = [coin_config for coin_config in coin_configs if not coin_config.get('real_time')]
+    shared_klines_by_symbol = publish_klines(historical_configs)
+    tasks = [
+        (coin_config, shared_klines_by_symbol[(coin_config['coin_symbol'], coin_config.get('interval') or "1m")].descriptor)
+        for coin_config in historical_configs
+    ]
+    try:
+        with Pool(workers, initializer=init_worker) as pool:
+            for symbol in pool.imap_unordered(process_shared_coin, tasks):
+                logging.getLogger("root").info(f"Processed {symbol}")
+    finally:
+        for shared_klines in shared_klines_by_symbol.values():
+            shared_klines.close()
+
+    for coin_config in coin_configs:
+        if coin_config.get('real_time'):
+            process_coin(coin_config)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Run the coins of config.yaml.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Run the historical coins in this many processes, the klines of each symbol are loaded once",
+    )
+    args = parser.parse_args()
+
+    configure_logging()
     logger = logging.getLogger("root")
     config_path = os.path.join(os.path.dirname(__file__), 'config.yaml')
     config_data = load_config(config_path)
+    configure_clients(config_data.get("mongo_max_pool_size"), config_data.get("http_pool_size"))
 
-    for coin_config in config_data.get("coins", []):
-        
-        logger.info(f"Processing {coin_config['coin_symbol']}...")
-
+    coin_configs = config_data.get("coins", [])
+    for coin_config in coin_configs:
+        if coin_config.get('strategies') and (coin_config.get('real_time') or coin_config.get('replay')):
+            # the strategies of a coin run only over historical data
+            parser.error(f"{coin_config['coin_symbol']}: strategies can't be combined with real_time or replay")
         coin_config['analysis_start_time'] = get_unix_timestamp(datetime.strptime(coin_config['analysis_start_time'], '%Y-%m-%d'))
         if coin_config['analysis_end_time']:
             coin_config['analysis_end_time'] = get_unix_timestamp(datetime.strptime(coin_config['analysis_end_time'], '%Y-%m-%d'))
         else:
             coin_config['analysis_end_time'] = get_unix_timestamp(datetime.now())
-                    
+
+    if args.workers:
+        process_coins_in_workers(coin_configs, args.workers)
+        return
+
+    for coin_config in coin_configs:
+        logger.info(f"Processing {coin_config['coin_symbol']}...")
         process_coin(coin_config)
 
 
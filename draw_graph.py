@@ -1,8 +1,10 @@
 import json
 import argparse
-from src.graphic import Graphic
+
 
 def create_graph(json_file):
+    from src.graphic import Graphic
+
     graphic = Graphic()
     # Load data from the JSON file
     with open(json_file, "r") as file:
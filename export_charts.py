@@ -0,0 +1,48 @@
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+from src.chart_export import EXPORT_FORMATS, POINTS_PER_PAGE, export_chart_task, init_worker
+from utils import configure_logging, logger
+
+EXPORT_TASKS_PER_WORKER = 20  # a worker is replaced after this many files, the memory of matplotlib is released
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the charts of results files without a window.")
+    parser.add_argument("json_files", metavar="json-file", type=str, nargs="+", help="Results files of the bot")
+    parser.add_argument("--output-directory", type=str, default="charts", help="Directory of the charts")
+    parser.add_argument(
+        "--format", type=str, nargs="+", choices=EXPORT_FORMATS, default=["png"], help="PNG and SVG per page, one HTML"
+    )
+    parser.add_argument("--points-per-page", type=int, default=POINTS_PER_PAGE, help="Klines per page")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Export processes")
+    args = parser.parse_args()
+    configure_logging(log_to_file=False)
+    os.makedirs(args.output_directory, exist_ok=True)
+
+    export_start_time = time.perf_counter()
+    tasks = [(json_file, args.output_directory, args.format, args.points_per_page) for json_file in args.json_files]
+    exported_count = 0
+    skipped_count = 0
+    failed_count = 0
+    with Pool(args.processes, initializer=init_worker, maxtasksperchild=EXPORT_TASKS_PER_WORKER) as pool:
+        for json_file, output_paths, error in pool.imap_unordered(export_chart_task, tasks):
+            if error:
+                failed_count += 1
+                logger.error(f"Export of {json_file} failed: {error}")
+            elif not output_paths:
+                skipped_count += 1
+            else:
+                exported_count += 1
+                logger.info(f"{json_file}: {len(output_paths)} files")
+    logger.info(
+        f"Exported {exported_count} results files to {args.output_directory}, {skipped_count} without klines, "
+        f"{failed_count} failed, "
+        f"in {time.perf_counter() - export_start_time:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
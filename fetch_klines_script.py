@@ -1,8 +1,8 @@
 import argparse
 import time
+from src.core import MONGO_URL, DB_NAME
 from src.kline_manager import KlineManager
-from utils import get_unix_timestamp, parse_date
-from bot import MONGO_URL, DB_NAME
+from utils import configure_logging, get_unix_timestamp, parse_date
 
 
 def main():
@@ -13,27 +13,32 @@ def main():
         "--coin", type=str, default="BTCUSDT", help="Coin symbol"
     )
     parser.add_argument(
-        "start-time",
+        "start_time",
+        metavar="start-time",
         type=parse_date,
         help="Start time in format YYYY-MM-DD HH:MM:SS or YYYY-MM-DD",
     )
     parser.add_argument(
-        "end-time",
+        "end_time",
+        metavar="end-time",
         type=parse_date,
         help="End time in format YYYY-MM-DD HH:MM:SS or YYYY-MM-DD",
     )
     args = parser.parse_args()
+    configure_logging()
 
     start_timestamp = get_unix_timestamp(args.start_time)
     end_timestamp = get_unix_timestamp(args.end_time)
 
-    kline_manager = KlineManager(MONGO_URL, DB_NAME, args.coin_symbol)
+    kline_manager = KlineManager(MONGO_URL, DB_NAME, args.coin)
 
     print(f"Fetching klines from {args.start_time} to {args.end_time}...")
     klines_start_time = time.time()
-    kline_manager.get_and_save_all_klines(start_timestamp, end_timestamp)
+    stats = kline_manager.get_and_save_all_klines(start_timestamp, end_timestamp)
     klines_end_time = time.time()
     print(f"Time for getting klines: {klines_end_time - klines_start_time} s")
+    for stage in ("fetch", "parse", "write"):
+        print(f"{stage}: {stats[stage]['klines']} klines, {stats[stage]['klines_per_second']} klines/s")
     print("Klines fetched and saved successfully.")
 
 
@@ -0,0 +1,85 @@
+import argparse
+import itertools
+import json
+from datetime import datetime
+
+from src.core import INTERVAL_TIME_STEPS, get_db_name, get_mongo_url
+from src.job_queue import JobQueue
+from utils import configure_logging, get_unix_timestamp, logger, parse_date, serialize_object
+
+
+def get_grid_jobs(args):
+    """A job per symbol and parameter set of the grid."""
+    start_time = get_unix_timestamp(args.analysis_start_time)
+    end_time = get_unix_timestamp(args.analysis_end_time)
+    return [
+        {
+            "symbol": symbol,
+            "interval": args.interval,
+            "start_time": start_time,
+            "end_time": end_time,
+            "time_window": time_window,
+            "growth_percent": growth_percent,
+            "drop_percent": drop_percent,
+            "two_pass": args.two_pass,
+        }
+        for symbol, time_window, growth_percent, drop_percent in itertools.product(
+            args.coin_symbol, args.time_window, args.growth_percent, args.drop_percent
+        )
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue backtest jobs for worker.py and follow their progress.")
+    parser.add_argument("--mongo-url", type=str, default=get_mongo_url(), help="MongoDB of the queue (MONGO_URL)")
+    parser.add_argument("--db-name", type=str, default=get_db_name(), help="Database of the queue (DB_NAME)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    submit_parser = subparsers.add_parser("submit", help="Queue a job per symbol and parameter set")
+    submit_parser.add_argument("--coin-symbol", type=str, nargs="+", default=["BTCUSDT"], help="Coin symbols")
+    submit_parser.add_argument("--growth-percent", type=float, nargs="+", default=[30], help="Growth thresholds")
+    submit_parser.add_argument("--drop-percent", type=float, nargs="+", default=[10], help="Drop thresholds")
+    submit_parser.add_argument("--time-window", type=int, nargs="+", default=[24], help="Time windows in hours")
+    submit_parser.add_argument(
+        "--analysis-start-time",
+        type=parse_date,
+        required=True,
+        help="Start time in format YYYY-MM-DD HH:MM:SS or YYYY-MM-DD",
+    )
+    submit_parser.add_argument(
+        "--analysis-end-time",
+        type=parse_date,
+        default=datetime.now().strftime("%Y-%m-%d"),
+        help="End time in format YYYY-MM-DD HH:MM:SS or YYYY-MM-DD",
+    )
+    submit_parser.add_argument(
+        "--interval", type=str, default="1m", choices=INTERVAL_TIME_STEPS.keys(), help="Klines interval"
+    )
+    submit_parser.add_argument("--two-pass", action="store_true", help="Two-pass historical analysis")
+
+    subparsers.add_parser("progress", help="Jobs by status and the progress of the running ones")
+    results_parser = subparsers.add_parser("results", help="Finished jobs by profit")
+    results_parser.add_argument("--coin-symbol", type=str, help="Coin symbol")
+    results_parser.add_argument("--limit", type=int, default=20, help="Number of results")
+    subparsers.add_parser("failed", help="Failed jobs with their errors")
+    subparsers.add_parser("clear", help="Remove all jobs")
+    args = parser.parse_args()
+    configure_logging(log_to_file=False)
+
+    job_queue = JobQueue(args.mongo_url, args.db_name)
+    if args.command == "submit":
+        jobs = get_grid_jobs(args)
+        new_jobs_count = job_queue.submit_many(jobs)
+        logger.info(f"Queued {new_jobs_count} jobs, {len(jobs) - new_jobs_count} were already queued")
+    elif args.command == "progress":
+        print(json.dumps(job_queue.get_progress(), default=serialize_object, indent=4))
+    elif args.command == "results":
+        print(json.dumps(job_queue.get_results(args.coin_symbol, args.limit), default=serialize_object, indent=4))
+    elif args.command == "failed":
+        print(json.dumps(job_queue.get_failed(), default=serialize_object, indent=4))
+    elif args.command == "clear":
+        job_queue.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import json
+import time
+from datetime import datetime
+
+from src.core import DB_NAME, MONGO_URL
+from src.results_store import ResultsStore
+from utils import configure_logging, get_unix_timestamp, parse_date, serialize_object
+
+
+def get_time_range(args):
+    if args.year:
+        return get_unix_timestamp(datetime(args.year, 1, 1)), get_unix_timestamp(datetime(args.year + 1, 1, 1))
+    start_time = get_unix_timestamp(args.start_time) if args.start_time else None
+    end_time = get_unix_timestamp(args.end_time) if args.end_time else None
+    return start_time, end_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the runs saved with --store-results.")
+    subparsers = parser.add_subparsers(dest="query", required=True)
+    for query, query_help in (("top-runs", "Most profitable runs"), ("top-configs", "Parameter sets by their best run")):
+        query_parser = subparsers.add_parser(query, help=query_help)
+        query_parser.add_argument("--coin-symbol", type=str, default="BTCUSDT", help="Coin symbol")
+        query_parser.add_argument("--year", type=int, help="Runs inside this year")
+        query_parser.add_argument("--start-time", type=parse_date, help="Runs starting from this time")
+        query_parser.add_argument("--end-time", type=parse_date, help="Runs ending before this time")
+        query_parser.add_argument("--limit", type=int, default=20, help="Number of results")
+    run_parser = subparsers.add_parser("run", help="A run with its orders and events")
+    run_parser.add_argument("run_id", metavar="run-id", type=int, help="Run id")
+    args = parser.parse_args()
+    configure_logging(log_to_file=False)
+
+    results_store = ResultsStore(MONGO_URL, DB_NAME)
+    query_start_time = time.perf_counter()
+    if args.query == "run":
+        results = results_store.get_run(args.run_id)
+    else:
+        start_time, end_time = get_time_range(args)
+        query = results_store.top_runs if args.query == "top-runs" else results_store.top_configs
+        results = query(args.coin_symbol, start_time, end_time, args.limit)
+    query_time = time.perf_counter() - query_start_time
+
+    print(json.dumps(results, default=serialize_object, indent=4))
+    print(f"Query time: {query_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
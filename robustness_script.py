@@ -0,0 +1,97 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from datetime import datetime
+
+from src.core import DB_NAME, INTERVAL_TIME_STEPS, MONGO_URL, OUTPUT_DIRECTORY
+from src.robustness import HOUR_TIME, RobustnessEngine, shuffle_orders
+from utils import configure_logging, get_unix_timestamp, logger, parse_date
+
+
+def load_klines(symbol, interval, start_time, end_time):
+    """Stored klines of the range, read once and sent to the workers."""
+    from src.kline_manager import KlineManager
+
+    kline_manager = KlineManager(MONGO_URL, DB_NAME, symbol, interval)
+    return kline_manager.find_or_fetch_stored_klines_in_range(start_time, end_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Walk-forward and Monte Carlo robustness of a grid of strategy parameters."
+    )
+    parser.add_argument("--coin-symbol", type=str, default="BTCUSDT", help="Coin symbol")
+    parser.add_argument("--growth-percent", type=float, nargs="+", default=[30], help="Growth thresholds of the grid")
+    parser.add_argument("--drop-percent", type=float, nargs="+", default=[10], help="Drop thresholds of the grid")
+    parser.add_argument("--time-window", type=int, nargs="+", default=[24], help="Time windows of the grid in hours")
+    parser.add_argument(
+        "--analysis-start-time",
+        type=parse_date,
+        required=True,
+        help="Start time in format YYYY-MM-DD HH:MM:SS or YYYY-MM-DD",
+    )
+    parser.add_argument(
+        "--analysis-end-time",
+        type=parse_date,
+        default=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        help="End time in format YYYY-MM-DD HH:MM:SS or YYYY-MM-DD",
+    )
+    parser.add_argument(
+        "--interval", type=str, default="1m", choices=INTERVAL_TIME_STEPS.keys(), help="Klines interval"
+    )
+    parser.add_argument("--train-months", type=int, default=3, help="Walk-forward optimization period")
+    parser.add_argument("--test-months", type=int, default=1, help="Walk-forward test period")
+    parser.add_argument("--samples", type=int, default=100, help="Block bootstrap samples")
+    parser.add_argument("--block-hours", type=int, default=24, help="Length of the bootstrapped blocks")
+    parser.add_argument("--shuffles", type=int, default=1000, help="Order sequence shuffles per parameter set")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the bootstrap and the shuffles")
+    parser.add_argument("--processes", type=int, help="Worker processes, all cores by default")
+    args = parser.parse_args()
+    configure_logging()
+
+    start_time = get_unix_timestamp(args.analysis_start_time)
+    end_time = get_unix_timestamp(args.analysis_end_time)
+    parameter_sets = list(itertools.product(args.time_window, args.growth_percent, args.drop_percent))
+    max_window_time = max(args.time_window) * HOUR_TIME
+
+    loaded_start_time = start_time - max_window_time
+    klines = load_klines(args.coin_symbol, args.interval, loaded_start_time, end_time)
+    logger.info(f"Loaded {len(klines)} klines, {len(parameter_sets)} parameter sets")
+
+    run_start_time = time.perf_counter()
+    with RobustnessEngine(
+        klines, args.interval, parameter_sets, args.processes, (loaded_start_time, end_time)
+    ) as engine:
+        full_range_results = engine.run_full_range(start_time, end_time)
+        walk_forward = engine.walk_forward(start_time, end_time, args.train_months, args.test_months)
+        bootstrap = engine.bootstrap(args.samples, args.block_hours, args.seed)
+
+    for result in full_range_results:
+        result["order_shuffle"] = shuffle_orders(result.pop("profits"), args.shuffles, args.seed)
+    walk_forward["order_shuffle"] = shuffle_orders(walk_forward.pop("out_of_sample_profits"), args.shuffles, args.seed)
+
+    results = {
+        "symbol": args.coin_symbol,
+        "interval": args.interval,
+        "start_time": start_time,
+        "end_time": end_time,
+        "duration_seconds": time.perf_counter() - run_start_time,
+        "full_range": full_range_results,
+        "walk_forward": walk_forward,
+        "bootstrap": bootstrap,
+    }
+
+    if not os.path.exists(OUTPUT_DIRECTORY):
+        os.makedirs(OUTPUT_DIRECTORY)
+    output_file = (
+        f"{OUTPUT_DIRECTORY}/robustness_{args.coin_symbol}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+    )
+    with open(output_file, "w") as file:
+        json.dump(results, file, indent=4)
+    logger.info(f"Robustness results saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
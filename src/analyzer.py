@@ -1,6 +1,11 @@
-from bot import TIME_STEP, DEVIATION, get_min_price
+from src.core import TIME_STEP, DEVIATION, get_min_price
+from src.metrics import metrics
 from utils import log_high_kline, log_low_kline, log_middle_kline, log_sideway
 
+HIGH_EVENTS_COUNTER = metrics.counter("analyzer_events_total", "Klines marked by the analyzer", status="high")
+LOW_EVENTS_COUNTER = metrics.counter("analyzer_events_total", "Klines marked by the analyzer", status="low")
+MID_EVENTS_COUNTER = metrics.counter("analyzer_events_total", "Klines marked by the analyzer", status="mid")
+
 
 class PriceAnalyzer:
     def __init__(
@@ -8,6 +13,7 @@ class PriceAnalyzer:
         time_window,
         target_price_growth_percent,
         target_price_drop_percent,
+        time_step=TIME_STEP,
     ):
         self.time_window = time_window * 60 * 60 * 1000  # Convert hours to milliseconds
         self.target_price_growth_percent = target_price_growth_percent
@@ -16,7 +22,11 @@ class PriceAnalyzer:
         self.mid_kline = None
         self.low_kline = None
         self.mid_price = None
-        self.snapshot_klines_count = int(self.time_window / TIME_STEP)
+        # percents of the last checked kline, kept here: the klines are shared by the strategies
+        self.growth_percent = None
+        self.drop_percent = None
+        self.time_step = time_step
+        self.snapshot_klines_count = int(self.time_window / time_step)
 
     def _is_highest_kline(self, kline):
         return self.high_kline is None or (self.high_kline["high"] < kline["high"])
@@ -34,6 +44,7 @@ class PriceAnalyzer:
         self.mid_kline = None
 
     def is_new_high_kline(self, kline, min_price):
+        self.growth_percent = None
         kline_is_higher_than_existing = self.high_kline and not self.low_kline and self._is_highest_kline(kline)
         if kline_is_higher_than_existing:
             return True
@@ -43,7 +54,7 @@ class PriceAnalyzer:
                 current_kline_growth_percent >= self.target_price_growth_percent and self._is_highest_kline(kline)
         )
         if new_impulse_is_higher_than_previous:
-            kline["target_price_growth_percent"] = current_kline_growth_percent
+            self.growth_percent = current_kline_growth_percent
             return True
 
         return False
@@ -53,13 +64,36 @@ class PriceAnalyzer:
             calculated_target_price_drop_percent = (
                 (self.high_kline["high"] - kline["low"]) / self.high_kline["high"]
             ) * 100
-            kline["target_price_drop_percent"] = calculated_target_price_drop_percent
+            self.drop_percent = calculated_target_price_drop_percent
 
             return calculated_target_price_drop_percent >= self.target_price_drop_percent and self._is_lowest_kline(kline)
 
     def is_new_middle_kline(self, kline):
         return (self.high_kline and self.low_kline) and kline["high"] >= self.mid_price
 
+    def get_candidate_blocks_from_aggregates(self, block_highs, block_lows, block_klines_counts):
+        """
+        First pass of the two-pass analysis over the max high, min low and klines count of each block,
+        which KlineManager.find_bucket_rows computes on the server.
+        A block is a candidate if its max high reaches the growth percent from the min low of the blocks
+        covering the windows of its klines. This min low is not higher than any window min price,
+        so no kline outside the candidate blocks can start a new impulse.
+        """
+        candidate_blocks = []
+        window_start_block = 0
+        window_klines_count = 0  # klines of the blocks from window_start_block to the current one
+        for block_index, block_high in enumerate(block_highs):
+            # the blocks after window_start_block hold the window of the first kline of the block,
+            # the blocks of a gap are short, so the window is counted in klines, not in blocks
+            while window_klines_count - block_klines_counts[window_start_block] >= self.snapshot_klines_count:
+                window_klines_count -= block_klines_counts[window_start_block]
+                window_start_block += 1
+            min_price = min(block_lows[window_start_block:block_index + 1])
+            max_growth_percent = ((block_high - min_price) / min_price) * 100
+            candidate_blocks.append(max_growth_percent >= self.target_price_growth_percent)
+            window_klines_count += block_klines_counts[block_index]
+        return candidate_blocks
+
     def _analyze_kline(self, kline, min_price):
         analyzed_kline = {  # save only data needed for plotting
             "status": "",  # one of: low, high, mid or none
@@ -72,7 +106,8 @@ class PriceAnalyzer:
             analyzed_kline["status"] = "high"
             analyzed_kline["price"] = kline["high"] # save the high price as y coordinate to show the kline
             self.high_kline = kline
-            log_high_kline(kline)
+            log_high_kline(kline, self.growth_percent)
+            HIGH_EVENTS_COUNTER.inc()
             return analyzed_kline
 
         if self.is_new_low_kline(kline):
@@ -80,7 +115,8 @@ class PriceAnalyzer:
             analyzed_kline["status"] = "low"
             analyzed_kline["price"] = kline["low"]
             self.mid_price = self.calculate_middle_price()
-            log_low_kline(kline)
+            log_low_kline(kline, self.drop_percent)
+            LOW_EVENTS_COUNTER.inc()
             return analyzed_kline
 
         if self.is_new_middle_kline(kline):
@@ -89,6 +125,7 @@ class PriceAnalyzer:
             self.mid_kline = kline
             log_middle_kline(kline)
             log_sideway(self.high_kline, self.low_kline, self.mid_kline, self.mid_price)
+            MID_EVENTS_COUNTER.inc()
             return analyzed_kline
 
         analyzed_kline["price"] = kline["close"]
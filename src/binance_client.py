@@ -1,22 +1,36 @@
-import requests
+import time
+from src.clients import get_http_session
+from src.metrics import metrics
 from utils import convert_unix_full_date_str, logger
 
 BINANCE_API_URL = "https://api.binance.com/api/v3/klines"
 INTERVAL = "1m"
 LIMIT = 1000
+KLINES_REQUEST_WEIGHT = 2  # request weight of the klines endpoint in the binance rate limits
 
+REQUESTS_COUNTER = metrics.counter("binance_requests_total", "Requests to the binance API")
+REQUESTS_WEIGHT_COUNTER = metrics.counter("binance_request_weight_total", "Request weight spent by the bot")
+USED_WEIGHT_GAUGE = metrics.gauge("binance_used_weight_1m", "Request weight used in the current minute, reported by binance")
+REQUEST_LATENCY = metrics.histogram("binance_request_seconds", "Latency of the binance API requests")
 
-def get_klines(start_time, end_time, symbol):
+
+def get_klines(start_time, end_time, symbol, interval=INTERVAL):
     """Get candlestick data from Binance API."""
     params = {
         "symbol": symbol,
-        "interval": INTERVAL,
+        "interval": interval,
         "startTime": start_time,
         "endTime": end_time,
         "limit": LIMIT,
     }
-    response = requests.get(BINANCE_API_URL, params=params)
+    request_start_time = time.perf_counter()
+    response = get_http_session().get(BINANCE_API_URL, params=params)
     klines = response.json()
+    REQUEST_LATENCY.observe(time.perf_counter() - request_start_time)
+    REQUESTS_COUNTER.inc()
+    REQUESTS_WEIGHT_COUNTER.inc(KLINES_REQUEST_WEIGHT)
+    if "x-mbx-used-weight-1m" in response.headers:
+        USED_WEIGHT_GAUGE.set(int(response.headers["x-mbx-used-weight-1m"]))
 
     if not klines:
         logger.error(
@@ -0,0 +1,84 @@
+import base64
+import html
+import io
+import json
+import os
+
+import matplotlib
+
+matplotlib.use("Agg")  # headless, before pyplot is imported by the graphic
+
+from src.graphic import Graphic, POINTS_PER_PAGE
+from utils import configure_logging, logger
+
+EXPORT_FORMATS = ("png", "svg", "html")
+EXPORT_DPI = 100
+
+
+def get_page_image(graphic, image_format):
+    image = io.BytesIO()
+    graphic.fig.savefig(image, format=image_format, dpi=EXPORT_DPI)
+    return image.getvalue()
+
+
+def get_html(title, page_images):
+    """Self-contained page: the PNG of every page is embedded in the file."""
+    images = "\n".join(
+        f'<h2>Page {page + 1}</h2>\n<img src="data:image/png;base64,{base64.b64encode(page_image).decode()}">'
+        for page, page_image in enumerate(page_images)
+    )
+    return (
+        f"<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n<title>{html.escape(title)}</title>\n</head>\n"
+        f"<body>\n<h1>{html.escape(title)}</h1>\n{images}\n</body>\n</html>\n"
+    )
+
+
+def export_chart(json_file, output_directory, formats=("png",), points_per_page=POINTS_PER_PAGE):
+    """
+    Draw the klines and orders of a results file page by page without a window.
+    PNG and SVG are written per page, HTML is one file with all the pages. Returns the written paths.
+    """
+    with open(json_file, "r") as file:
+        data = json.load(file)
+    klines = data.get("klines", [])
+    if not klines:
+        logger.info(f"No klines in {json_file}, skipped")
+        return []
+
+    name = os.path.splitext(os.path.basename(json_file))[0]
+    graphic = Graphic(interactive=False, points_per_page=points_per_page)
+    graphic.set_historical_data(klines, data.get("orders", []))
+    output_paths = []
+    html_images = []
+    try:
+        for page in range(graphic.pages_count):
+            graphic.draw_page(page)
+            for image_format in formats:
+                if image_format == "html":
+                    html_images.append(get_page_image(graphic, "png"))
+                    continue
+                output_path = os.path.join(output_directory, f"{name}_{page + 1:03d}.{image_format}")
+                graphic.fig.savefig(output_path, format=image_format, dpi=EXPORT_DPI)
+                output_paths.append(output_path)
+    finally:
+        graphic.close()
+
+    if html_images:
+        output_path = os.path.join(output_directory, f"{name}.html")
+        with open(output_path, "w") as file:
+            file.write(get_html(name, html_images))
+        output_paths.append(output_path)
+    return output_paths
+
+
+def init_worker():
+    configure_logging(log_to_file=False)
+
+
+def export_chart_task(task):
+    """Process pool task, the errors of one file don't stop the others."""
+    json_file, output_directory, formats, points_per_page = task
+    try:
+        return json_file, export_chart(json_file, output_directory, formats, points_per_page), None
+    except Exception as error:
+        return json_file, [], f"{type(error).__name__}: {error}"
@@ -0,0 +1,98 @@
+import atexit
+import os
+import threading
+
+from utils import logger
+
+MONGO_MAX_POOL_SIZE = 20  # connections per MongoDB server
+HTTP_POOL_SIZE = 10  # kept-alive connections to the binance API
+
+pool_sizes = {"mongo_max_pool_size": MONGO_MAX_POOL_SIZE, "http_pool_size": HTTP_POOL_SIZE}
+mongo_clients = {}  # mongo url -> MongoClient
+indexed_collections = set()  # (client id, database, collection, key)
+http_session = None
+clients_process_id = None
+lock = threading.Lock()
+
+
+def configure_clients(mongo_max_pool_size=None, http_pool_size=None):
+    """Set the pool sizes of the clients created after this call."""
+    if mongo_max_pool_size:
+        pool_sizes["mongo_max_pool_size"] = mongo_max_pool_size
+    if http_pool_size:
+        pool_sizes["http_pool_size"] = http_pool_size
+
+
+def check_process():
+    """
+    The clients are created per process: a forked worker must not use the sockets of the parent,
+    so the clients inherited from it are forgotten without closing them.
+    """
+    global http_session, clients_process_id
+
+    if clients_process_id != os.getpid():
+        if clients_process_id is None:
+            atexit.register(close_clients)
+        mongo_clients.clear()
+        indexed_collections.clear()
+        http_session = None
+        clients_process_id = os.getpid()
+
+
+def get_mongo_client(mongo_url):
+    """MongoClient shared by the kline managers of this process, created on the first call."""
+    with lock:
+        check_process()
+        if mongo_url not in mongo_clients:
+            from pymongo import MongoClient
+
+            mongo_clients[mongo_url] = MongoClient(mongo_url, maxPoolSize=pool_sizes["mongo_max_pool_size"])
+        return mongo_clients[mongo_url]
+
+
+def ensure_index(collection, key):
+    """Create the index once per collection in this process, key is a field name or a list of (field, direction)."""
+    index_key = (
+        id(collection.database.client),
+        collection.database.name,
+        collection.name,
+        key if isinstance(key, str) else tuple(map(tuple, key)),
+    )
+    if index_key in indexed_collections:
+        return
+    collection.create_index(key)
+    indexed_collections.add(index_key)
+
+
+def get_http_session():
+    """requests session keeping the connections to binance alive, created on the first call."""
+    global http_session
+
+    with lock:
+        check_process()
+        if http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            http_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_sizes["http_pool_size"])
+            http_session.mount("https://", adapter)
+            http_session.mount("http://", adapter)
+        return http_session
+
+
+def close_clients():
+    """Close the clients of this process, called at exit."""
+    global http_session
+
+    with lock:
+        if clients_process_id != os.getpid():
+            return
+        for mongo_client in mongo_clients.values():
+            mongo_client.close()
+        mongo_clients.clear()
+        indexed_collections.clear()
+        if http_session is not None:
+            http_session.close()
+            http_session = None
+    logger.debug("Mongo and HTTP clients are closed")
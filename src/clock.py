@@ -0,0 +1,31 @@
+import time
+from datetime import datetime
+
+
+class SystemClock:
+    """Wall clock used by the real time monitoring."""
+
+    def now(self):
+        return int(datetime.now().timestamp() * 1000)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class SimulatedClock:
+    """
+    Clock of a replay: sleeping moves the time forward.
+    With a speed the sleep also waits seconds / speed in real time, without it the replay is unthrottled.
+    """
+
+    def __init__(self, start_time, speed=None):
+        self.time = start_time
+        self.speed = speed
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.time += int(seconds * 1000)
+        if self.speed:
+            time.sleep(seconds / self.speed)
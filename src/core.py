@@ -0,0 +1,83 @@
+# Constants and helpers shared by the modules, only the standard library is imported here
+# to keep the import cheap for scripts and process pool workers.
+import os
+from collections import deque
+
+TIME_STEP = 1 * 60 * 1000  # one minute in unix
+INTERVAL_TIME_STEPS = {  # kline interval -> its duration in unix
+    "1s": 1000,
+    "1m": TIME_STEP,
+    "5m": 5 * TIME_STEP,
+    "15m": 15 * TIME_STEP,
+    "1h": 60 * TIME_STEP,
+}
+MONGO_URL = "mongodb://localhost:27017/"
+DB_NAME = "crypto_data"
+DEVIATION = 0.04
+OUTPUT_DIRECTORY = "analyzed_data"
+
+
+def get_mongo_url():
+    """MongoDB of the MONGO_URL environment variable, for the scripts run on several machines."""
+    return os.environ.get("MONGO_URL", MONGO_URL)
+
+
+def get_db_name():
+    return os.environ.get("DB_NAME", DB_NAME)
+
+
+def prepare_kline_plot_data(kline):
+    kline = {  # save only data needed for plotting
+            "status": "",
+            "time": kline["closeTime"],  # save the closeTime as x coordinate to show the kline
+            "price": kline["close"] # save close price as y coordinate
+        }
+    return kline
+
+
+def get_min_price(
+    klines, start_index, last_index
+):  # optimization of the search for the minimum value
+    min_price = klines[start_index]["low"]
+    for j in range(start_index + 1, last_index):
+        if klines[j]["low"] < min_price:
+            min_price = klines[j]["low"]
+    return min_price
+
+
+def get_kline_column(klines, name):
+    """The field of every kline as a list, shared klines give their column without building the kline documents."""
+    if hasattr(klines, "get_column"):
+        return klines.get_column(name)
+    return [kline[name] for kline in klines]
+
+
+def iter_rolling_min_prices(low_prices, window_klines_count, start_index):
+    """
+    Yields the min low price of the window_klines_count klines preceding each kline from start_index on,
+    the same value as get_min_price(klines, index - window_klines_count, index) in O(1) per kline.
+    low_prices are the low prices of the klines, as returned by get_kline_column,
+    the prices appended to the list while iterating are yielded too.
+    """
+    window = deque()  # indexes of the klines in the window, their low prices are increasing
+    index = start_index - window_klines_count + 1
+    while index < len(low_prices):
+        previous_low = low_prices[index - 1]
+        while window and low_prices[window[-1]] >= previous_low:
+            window.pop()
+        window.append(index - 1)
+        if window[0] < index - window_klines_count:
+            window.popleft()
+        if index >= start_index:
+            yield low_prices[window[0]]
+        index += 1
+
+
+def get_rolling_min_prices(low_prices, window_klines_count):
+    """
+    Window min prices for all klines computed in one pass.
+    Indexes without a full window before them are None.
+    """
+    min_prices = [None] * min(window_klines_count, len(low_prices))
+    min_prices.extend(iter_rolling_min_prices(low_prices, window_klines_count, window_klines_count))
+    return min_prices
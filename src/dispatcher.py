@@ -1,7 +1,106 @@
+import math
 import time
-from datetime import datetime
+from bisect import bisect_right
+from collections import deque
 
-from bot import prepare_kline_plot_data
+from src import kline_aggregates
+from src.clock import SystemClock
+from src.core import prepare_kline_plot_data, get_kline_column, get_rolling_min_prices, iter_rolling_min_prices
+from src.metrics import metrics
+from utils import logger
+
+SCREENING_BLOCK_TIME = 60 * 60 * 1000  # one hour in unix, the first pass of the two-pass analysis uses hourly blocks
+SCREENING_EXTENSION_BLOCKS = 24  # blocks loaded at once when an impulse or a sideway goes on after the candidate blocks
+REAL_TIME_CLOSE_DELAY = 1000  # the real time monitoring requests a kline one second after its close
+
+KLINES_PROCESSED_COUNTER = metrics.counter("klines_processed_total", "Klines passed to the analyzer or the trader")
+KLINES_PER_SECOND_GAUGE = metrics.gauge(
+    "klines_processed_per_second", "Klines processed per second by the last historical run"
+)
+HISTORICAL_RUN_LATENCY = metrics.histogram("historical_run_seconds", "Duration of the historical runs")
+REAL_TIME_ITERATION_LATENCY = metrics.histogram(
+    "real_time_iteration_seconds", "Duration of one real time iteration, without the sleep"
+)
+KLINE_DECISION_LATENCY = metrics.histogram(
+    "kline_decision_seconds", "Duration of the analyzer or trader decision on one real time kline"
+)
+
+
+def record_historical_run(klines_count, run_start_time):
+    duration = time.perf_counter() - run_start_time
+    KLINES_PROCESSED_COUNTER.inc(klines_count)
+    HISTORICAL_RUN_LATENCY.observe(duration)
+    if duration:
+        KLINES_PER_SECOND_GAUGE.set(klines_count / duration)
+
+
+class ScreeningBlocks:
+    """
+    Time blocks of the klines of a historical run for the two-pass analysis: the max high, min low and
+    klines count of each block, and the klines of a kline index range, loaded by blocks when they are needed.
+    """
+
+    def __init__(self, rows, load_klines, load_plot_klines):
+        self.highs = [row[2] for row in rows]
+        self.lows = [row[3] for row in rows]
+        self.klines_counts = [row[6] for row in rows]
+        self.first_indexes = [0]  # index of the first kline of each block, then the klines count
+        for klines_count in self.klines_counts:
+            self.first_indexes.append(self.first_indexes[-1] + klines_count)
+        self.klines_count = self.first_indexes[-1]
+        # functions of the first and the end block, returning the klines of these blocks
+        self.load_blocks_klines = load_klines
+        self.load_blocks_plot_klines = load_plot_klines
+
+    @classmethod
+    def from_kline_manager(cls, kline_manager, start_time, end_time, block_time):
+        """Blocks aggregated by the kline manager, only the klines of the blocks being analyzed are loaded."""
+        kline_manager.fetch_missing_klines(start_time, end_time)
+        rows = kline_manager.find_bucket_rows(start_time, end_time, block_time)
+
+        def get_time_range(first_block, end_block):
+            return max(rows[first_block][0], start_time), min(rows[end_block - 1][0] + block_time, end_time)
+
+        return cls(
+            rows,
+            lambda first_block, end_block: kline_manager.find_klines_in_range(*get_time_range(first_block, end_block)),
+            lambda first_block, end_block: kline_manager.find_plot_klines(*get_time_range(first_block, end_block)),
+        )
+
+    @classmethod
+    def from_klines(cls, klines, block_time):
+        """Blocks of already loaded klines, as the resampled klines that are not stored."""
+        blocks = None
+
+        def load_klines(first_block, end_block):
+            return klines[blocks.first_indexes[first_block]:blocks.first_indexes[end_block]]
+
+        blocks = cls(kline_aggregates.get_bucket_rows(klines, block_time), load_klines, load_klines)
+        return blocks
+
+    def get_block_index(self, kline_index):
+        return bisect_right(self.first_indexes, kline_index) - 1
+
+    def get_load_end_index(self, block_index, candidate_blocks, blocks_count=1):
+        """Index after the last kline of blocks_count blocks from block_index and the candidate blocks following them."""
+        end_block = min(block_index + blocks_count, len(candidate_blocks))
+        while end_block < len(candidate_blocks) and candidate_blocks[end_block]:
+            end_block += 1
+        return self.first_indexes[end_block]
+
+    def load(self, load_blocks, start_index, end_index):
+        first_block = self.get_block_index(start_index)
+        end_block = self.get_block_index(end_index - 1) + 1
+        klines = load_blocks(first_block, end_block)
+        offset = self.first_indexes[first_block]
+        return klines[start_index - offset:end_index - offset]
+
+    def load_klines(self, start_index, end_index):
+        return self.load(self.load_blocks_klines, start_index, end_index)
+
+    def load_plot_klines(self, start_index, end_index):
+        """Klines of the index range with at least the fields of their plot points."""
+        return self.load(self.load_blocks_plot_klines, start_index, end_index)
 
 
 class Dispatcher:
@@ -14,71 +113,281 @@ class Dispatcher:
         self.analysis_start_time = analysis_start_time
         self.analysis_end_time = analysis_end_time
 
+    def process_kline(self, kline, min_price):
+        """
+        Pass the kline to the trader if it has an active sideway, otherwise to the analyzer.
+        Returns the point for plotting and the orders placed on this kline.
+        """
+        # the analyzer does not work while the trader is working
+        if self.trader.has_active_sideway():
+            self.trader.update_orders(kline)
+            return prepare_kline_plot_data(kline), ()
+        return self.analyze_kline(kline, min_price)
+
+    def analyze_kline(self, kline, min_price):
+        """Pass the kline to the analyzer and add a sideway to the trader when the analyzer finds one."""
+        analyzed_kline = self.analyzer._analyze_kline(kline, min_price)
+        sideway_orders = ()
+        if analyzed_kline["status"] == "mid":
+            sideway_orders = self.trader.add_sideway(
+                self.analyzer.high_kline["high"],
+                self.analyzer.low_kline["low"]
+            )
+            self.analyzer.reset_klines()
+
+        return analyzed_kline, sideway_orders
+
     def run_for_historical_data(self):
+        run_start_time = time.perf_counter()
         # Fetch all klines for the analysis period
         klines = self.kline_manager.find_or_fetch_klines_in_range(
             self.analysis_start_time - self.analyzer.time_window,  # Start time with buffer for analysis
             self.analysis_end_time,
         )
+        min_prices = get_rolling_min_prices(get_kline_column(klines, "low"), self.analyzer.snapshot_klines_count)
         analyzed_klines = []
         orders = []
 
-        # Process klines using a generator
         for index in range(self.analyzer.snapshot_klines_count, len(klines)):
-            current_kline = klines[index]
+            analyzed_kline, sideway_orders = self.process_kline(klines[index], min_prices[index])
+            orders.extend(sideway_orders)
+            analyzed_klines.append(analyzed_kline)
+        record_historical_run(len(analyzed_klines), run_start_time)
+        self.summarize_trader_results()
+        return analyzed_klines, orders
+
+    def get_screening_blocks(self):
+        start_time = self.analysis_start_time - self.analyzer.time_window  # Start time with buffer for analysis
+        # blocks of whole klines: an hour, or one kline of a longer interval
+        block_time = math.lcm(SCREENING_BLOCK_TIME, self.analyzer.time_step)
+        if self.kline_manager.resampler is None:
+            return ScreeningBlocks.from_kline_manager(
+                self.kline_manager, start_time, self.analysis_end_time, block_time
+            )
+        # resampled klines are not stored, they are aggregated after they are loaded
+        klines = self.kline_manager.find_or_fetch_klines_in_range(start_time, self.analysis_end_time)
+        return ScreeningBlocks.from_klines(klines, block_time)
+
+    def run_two_pass_for_historical_data(self):
+        """
+        Same results as run_for_historical_data, but the klines are screened by hourly blocks first,
+        with the max high and min low of the blocks aggregated by the kline manager.
+        The analyzer runs only in the blocks where a new impulse is possible and until its impulse
+        and the following sideway are over, only the klines of these blocks and of their windows are loaded.
+        Other klines are saved for plotting without analysis, only their close is loaded.
+        """
+        run_start_time = time.perf_counter()
+        blocks = self.get_screening_blocks()
+        candidate_blocks = self.analyzer.get_candidate_blocks_from_aggregates(
+            blocks.highs, blocks.lows, blocks.klines_counts
+        )
+        window_klines_count = self.analyzer.snapshot_klines_count
+        analyzed_klines = []
+        orders = []
+
+        klines = []  # loaded klines of the analysis runs, the first one is the kline at klines_start
+        klines_start = 0
+        low_prices = []
+        plot_start = None  # index of the first skipped kline whose plot point is not saved yet
+        min_prices = None  # window min prices of the klines analyzed one by one
 
-            # the analyzer does not work while the trader is working
-            if self.trader.has_active_sideway():
-                self.trader.update_orders(current_kline)
-                kline = prepare_kline_plot_data(current_kline)
-                analyzed_klines.append(kline)
+        def save_plot_points(end_index):
+            # the first skipped klines are often loaded by the last analysis run
+            loaded_end = max(plot_start, min(klines_start + len(klines), end_index))
+            plot_klines = klines[plot_start - klines_start:loaded_end - klines_start]
+            if loaded_end < end_index:
+                plot_klines += blocks.load_plot_klines(loaded_end, end_index)
+            analyzed_klines.extend(prepare_kline_plot_data(kline) for kline in plot_klines)
+
+        index = window_klines_count
+        while index < blocks.klines_count:
+            block_index = blocks.get_block_index(index)
+            is_waiting_for_impulse = self.analyzer.high_kline is None and not self.trader.has_active_sideway()
+            if is_waiting_for_impulse and not candidate_blocks[block_index]:
+                if plot_start is None:
+                    plot_start = index
+                index = blocks.first_indexes[block_index + 1]
+                min_prices = None
                 continue
 
-            analyzed_kline = self.analyzer._analyze_snapshot(klines, index)
-            if analyzed_kline["status"] == "mid":
-                sideway_orders = self.trader.add_sideway(
-                    self.analyzer.high_kline["high"],
-                    self.analyzer.low_kline["low"]
-                )
-                orders.extend(sideway_orders)
-                self.analyzer.reset_klines()
+            if min_prices is None:
+                if plot_start is not None:
+                    save_plot_points(index)
+                    plot_start = None
+                if index - window_klines_count < klines_start or index >= klines_start + len(klines):
+                    klines_start = index - window_klines_count
+                    end_index = blocks.get_load_end_index(block_index, candidate_blocks)
+                    klines = list(blocks.load_klines(klines_start, end_index))
+                    low_prices = get_kline_column(klines, "low")
+                min_prices = iter_rolling_min_prices(low_prices, window_klines_count, index - klines_start)
+            elif index >= klines_start + len(klines):
+                # the impulse or the sideway goes on after the loaded blocks, the rolling min follows the appended lows
+                end_index = blocks.get_load_end_index(block_index, candidate_blocks, SCREENING_EXTENSION_BLOCKS)
+                new_klines = blocks.load_klines(index, end_index)
+                klines.extend(new_klines)
+                low_prices.extend(get_kline_column(new_klines, "low"))
 
+            analyzed_kline, sideway_orders = self.process_kline(klines[index - klines_start], next(min_prices))
+            orders.extend(sideway_orders)
             analyzed_klines.append(analyzed_kline)
+            index += 1
+        if plot_start is not None:
+            save_plot_points(blocks.klines_count)
+        record_historical_run(len(analyzed_klines), run_start_time)
         self.summarize_trader_results()
         return analyzed_klines, orders
 
     def summarize_trader_results(self):
         self.trader.log_order_summary()
 
-    def real_time_monitoring(self):
+    def real_time_monitoring(self, clock=None, stop_time=None):
+        """
+        Process every kline as soon as it is closed, until stop_time if it is set.
+        A kline is processed with the min price of the window before it, as in the historical run,
+        the klines closed during a long iteration are processed in order on the next one.
+        Returns the analyzed klines and the orders, as run_for_historical_data.
+        """
+        clock = clock or SystemClock()
+        time_step = self.kline_manager.time_step
+        snapshot_klines_count = self.analyzer.snapshot_klines_count
+        last_close_time = None  # close time of the last kline read, processed or added to the window
+        # the klines before the first kline not read yet, kept across the iterations
+        window = deque(maxlen=snapshot_klines_count)
+        analyzed_klines = []
+        orders = []
+
         while True:
-            current_time = int(datetime.now().timestamp() * 1000)
-            start_time = (
-                current_time - self.analyzer.time_window
-            )  # get data starting from now - Yhr
-            klines = self.kline_manager.find_or_fetch_klines_in_range(
-                start_time, current_time
-            )
+            iteration_start_time = time.perf_counter()
+            current_time = clock.now()
+            closed_until = current_time - current_time % time_step  # start time of the current, not closed kline
+            if stop_time is not None:
+                closed_until = min(closed_until, stop_time)
 
-            # the analyzer does not work while the trader is working
-            if self.trader.has_active_sideway():
-                self.trader.update_orders(klines[-1])
-                continue
+            # the window is read once, on the first iteration the last closed kline is processed after it
+            is_first_read = last_close_time is None
+            if is_first_read:
+                read_start_time = closed_until - time_step - self.analyzer.time_window
+            else:
+                read_start_time = last_close_time + 1
+            new_klines = self.kline_manager.find_or_fetch_klines_in_range(read_start_time, closed_until)
+            klines = list(window) + list(new_klines)
 
-            analyzed_kline = self.analyzer._analyze_snapshot(klines, len(klines) - 1)
-            if analyzed_kline["status"] == "mid":
-                self.trader.new_orders_in_sideway = True
-                self.trader.place_short_order(
-                    self.analyzer.high_kline["high"],
-                    self.analyzer.low_kline["low"],
-                    self.analyzer.mid_kline["high"],
+            # as in the historical run, a kline is processed once snapshot_klines_count klines precede it,
+            # the window shortened by a gap of binance is filled by the next klines
+            first_index = max(len(window), snapshot_klines_count)
+            if first_index < len(klines):
+                low_prices = get_kline_column(klines, "low")
+                min_prices = iter_rolling_min_prices(low_prices, snapshot_klines_count, first_index)
+                for kline in klines[first_index:]:
+                    decision_start_time = time.perf_counter()
+                    analyzed_kline, sideway_orders = self.process_kline(kline, next(min_prices))
+                    KLINE_DECISION_LATENCY.observe(time.perf_counter() - decision_start_time)
+                    orders.extend(sideway_orders)
+                    analyzed_klines.append(analyzed_kline)
+                KLINES_PROCESSED_COUNTER.inc(len(klines) - first_index)
+            elif is_first_read and new_klines:
+                logger.warning(
+                    f"Only {len(klines)} of the {snapshot_klines_count} window klines and the last closed kline "
+                    "are available, the klines are processed once the window is filled"
                 )
-                self.trader.place_long_order(
-                    self.analyzer.high_kline["high"],
-                    self.analyzer.low_kline["low"],
-                    self.analyzer.mid_kline["high"],
-                )
-                # reset high and low points after finding the middle
-                self.analyzer.reset_klines()
+            if new_klines:
+                window.extend(new_klines)
+                last_close_time = new_klines[-1]["closeTime"]
+
+            REAL_TIME_ITERATION_LATENCY.observe(time.perf_counter() - iteration_start_time)
+            if stop_time is not None and closed_until >= stop_time:
+                return analyzed_klines, orders
+            # wait for the close of the current kline
+            current_time = clock.now()
+            clock.sleep((time_step - current_time % time_step + REAL_TIME_CLOSE_DELAY) / 1000)
+
+
+class MultiStrategyDispatcher:
+    """
+    Runs several analyzer/trader pairs over one kline stream of the same symbol.
+    Klines are read once, and the window min prices are computed once per distinct time window.
+    With an order book the orders of all strategies are evaluated together, the traders must be its BookTraders.
+    """
+
+    def __init__(self, dispatchers, kline_manager, order_book=None):
+        self.dispatchers = dispatchers
+        self.kline_manager = kline_manager
+        self.order_book = order_book
+
+    @classmethod
+    def from_strategies(cls, strategies, kline_manager, order_book=None):
+        """Build the dispatcher from (analyzer, trader) pairs."""
+        dispatchers = [Dispatcher(analyzer, trader, kline_manager) for analyzer, trader in strategies]
+        return cls(dispatchers, kline_manager, order_book)
+
+    def set_time_interval(self, analysis_start_time, analysis_end_time):
+        self.analysis_start_time = analysis_start_time
+        self.analysis_end_time = analysis_end_time
+        for dispatcher in self.dispatchers:
+            dispatcher.set_time_interval(analysis_start_time, analysis_end_time)
+
+    def run_for_historical_data(self):
+        """Returns a list of (analyzed_klines, orders) in the order of the dispatchers."""
+        run_start_time = time.perf_counter()
+        max_time_window = max(dispatcher.analyzer.time_window for dispatcher in self.dispatchers)
+        klines = self.kline_manager.find_or_fetch_klines_in_range(
+            self.analysis_start_time - max_time_window,  # Start time with buffer for the longest analysis window
+            self.analysis_end_time,
+        )
 
-            time.sleep(60)
+        # the shared series: one list of window min prices per distinct window size
+        low_prices = get_kline_column(klines, "low")
+        min_prices_by_window = {}
+        for dispatcher in self.dispatchers:
+            snapshot_klines_count = dispatcher.analyzer.snapshot_klines_count
+            if snapshot_klines_count not in min_prices_by_window:
+                min_prices_by_window[snapshot_klines_count] = get_rolling_min_prices(low_prices, snapshot_klines_count)
+
+        strategies = [
+            (dispatcher, min_prices_by_window[dispatcher.analyzer.snapshot_klines_count], [], [])
+            for dispatcher in self.dispatchers
+        ]
+        # every strategy starts from the first kline of the analysis period
+        first_index = max(min_prices_by_window)
+
+        if self.order_book:
+            self.run_with_order_book(klines, first_index, strategies)
+        else:
+            for index in range(first_index, len(klines)):
+                kline = klines[index]
+                for dispatcher, min_prices, analyzed_klines, orders in strategies:
+                    analyzed_kline, sideway_orders = dispatcher.process_kline(kline, min_prices[index])
+                    orders.extend(sideway_orders)
+                    analyzed_klines.append(analyzed_kline)
+
+        record_historical_run((len(klines) - first_index) * len(strategies), run_start_time)
+        results = []
+        for dispatcher, _, analyzed_klines, orders in strategies:
+            dispatcher.summarize_trader_results()
+            results.append((analyzed_klines, orders))
+        return results
+
+    def run_with_order_book(self, klines, first_index, strategies):
+        """The order book is updated once per kline before the analyzers of the strategies without active orders."""
+        index = first_index
+        while index < len(klines):
+            is_trading = [dispatcher.trader.has_active_sideway() for dispatcher in self.dispatchers]
+
+            if all(is_trading):
+                # no analyzer works until some sideway ends, the book skips the klines not changing orders
+                next_index = self.order_book.update_orders_block(klines, index)
+                for _, _, analyzed_klines, _ in strategies:
+                    analyzed_klines.extend(prepare_kline_plot_data(kline) for kline in klines[index:next_index])
+                index = next_index
+                continue
+
+            kline = klines[index]
+            self.order_book.update_orders(kline)
+            for (dispatcher, min_prices, analyzed_klines, orders), is_strategy_trading in zip(strategies, is_trading):
+                if is_strategy_trading:
+                    analyzed_klines.append(prepare_kline_plot_data(kline))
+                    continue
+                analyzed_kline, sideway_orders = dispatcher.analyze_kline(kline, min_prices[index])
+                orders.extend(sideway_orders)
+                analyzed_klines.append(analyzed_kline)
+            index += 1
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+
+from src.metrics import metrics
+from src.trader import OrderStatus, OrderType
+from utils import logger
+
+DRILL_DOWN_BLOCK_TIME = 15 * 60 * 1000  # 1s klines are loaded by 15 minute blocks, 900 klines per binance request
+DRILL_DOWN_CACHE_SIZE = 64  # blocks kept in memory
+
+DRILL_DOWN_CANDLES_COUNTER = metrics.counter(
+    "drill_down_candles_total", "Ambiguous candles replayed with 1s klines"
+)
+
+
+def is_ambiguous(order, kline):
+    """
+    The kline reaches two prices of the order and their order can't be known from it:
+    the take profit and the stop of a fulfilled order, or the entry and then an exit of an open order.
+    """
+    low_price = kline["low"]
+    high_price = kline["high"]
+    if order.type == OrderType.LONG:
+        reaches_take_profit = high_price >= order.take_profit_price
+        reaches_stop = low_price <= order.stop_price
+        reaches_entry = low_price <= order.entry_price
+    else:
+        reaches_take_profit = low_price <= order.take_profit_price
+        reaches_stop = high_price >= order.stop_price
+        reaches_entry = high_price >= order.entry_price
+
+    if order.status == OrderStatus.FULFILLED:
+        return reaches_take_profit and reaches_stop
+    if order.status == OrderStatus.OPEN:
+        return reaches_entry and (reaches_take_profit or reaches_stop)
+    return False
+
+
+class SecondKlineCache:
+    """1s klines loaded on demand by blocks through the 1s kline manager, the last blocks are kept in an LRU cache."""
+
+    def __init__(self, kline_manager, cache_size=DRILL_DOWN_CACHE_SIZE):
+        self.kline_manager = kline_manager  # of the 1s interval
+        self.cache_size = cache_size
+        self.blocks = OrderedDict()  # block start time -> 1s klines
+
+    def get_block(self, block_start_time):
+        if block_start_time in self.blocks:
+            self.blocks.move_to_end(block_start_time)
+            return self.blocks[block_start_time]
+        klines = self.kline_manager.find_or_fetch_klines_in_range(
+            block_start_time, block_start_time + DRILL_DOWN_BLOCK_TIME
+        )
+        self.blocks[block_start_time] = klines
+        if len(self.blocks) > self.cache_size:
+            self.blocks.popitem(last=False)
+        return klines
+
+    def get_second_klines(self, kline):
+        """1s klines inside the candle."""
+        start_time = kline["startTime"]
+        end_time = kline["closeTime"] + 1
+        second_klines = []
+        block_start_time = start_time - start_time % DRILL_DOWN_BLOCK_TIME
+        for block_start_time in range(block_start_time, end_time, DRILL_DOWN_BLOCK_TIME):
+            second_klines += [
+                second_kline for second_kline in self.get_block(block_start_time)
+                if start_time <= second_kline["startTime"] < end_time
+            ]
+        return second_klines
+
+
+class DrillDown:
+    """
+    Resolves the ambiguous candles of a trader with the 1s klines inside them: the order is evaluated against
+    every second instead of the candle, so its fill and close happen in their real sequence and at their real times.
+    Only the ambiguous candles are loaded, the strategies of a coin can share the cache of 1s klines.
+    """
+
+    def __init__(self, second_kline_cache):
+        self.second_kline_cache = second_kline_cache
+        self.candle_times = set()  # start times of the candles that required the drill-down
+        self.orders_count = 0
+
+    @property
+    def candles_count(self):
+        return len(self.candle_times)
+
+    def evaluate(self, order, kline):
+        """
+        Evaluate the order with the 1s klines of an ambiguous candle.
+        Returns False if the candle is not ambiguous or has no 1s klines, it is evaluated as a whole then.
+        """
+        if not is_ambiguous(order, kline):
+            return False
+        second_klines = self.second_kline_cache.get_second_klines(kline)
+        if not second_klines:
+            logger.warning(f"No 1s klines for the ambiguous candle at {kline['startTime']}")
+            return False
+
+        if kline["startTime"] not in self.candle_times:
+            self.candle_times.add(kline["startTime"])
+            DRILL_DOWN_CANDLES_COUNTER.inc()
+        self.orders_count += 1
+        for second_kline in second_klines:
+            order.evaluate(second_kline)
+            if order.status == OrderStatus.CLOSED:
+                break
+        return True
+
+    def to_dict(self):
+        return {"candles": self.candles_count, "orders": self.orders_count}
@@ -1,16 +1,20 @@
-import matplotlib
 import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Button, TextBox
 from datetime import datetime
-from binance_bot.src.trader import OrderStatus
-from utils import convert_unix_full_date_str
+from src.trader import OrderStatus
+from utils import convert_unix_full_date_str, prepare_plot_data
 
-matplotlib.use("TkAgg")
+# selected when an interactive graphic is created, not on import: an export selects Agg before importing pyplot
+INTERACTIVE_BACKEND = "TkAgg"
+POINTS_PER_PAGE = 1440 * 100  # ~ 100days
 
 
 class Graphic:
-    def __init__(self):
+    def __init__(self, interactive=True, points_per_page=POINTS_PER_PAGE):
+        self.interactive = interactive
+        if interactive:
+            plt.switch_backend(INTERACTIVE_BACKEND)
         self.fig, self.ax = plt.subplots(
             figsize=(12, 6)
         )  # axes encapsulates all the elements of an individual (sub-)plot in a figure
@@ -19,8 +23,9 @@ class Graphic:
             [], [], "darkgrey", label="All Prices", markersize=1
         )
         self.current_page = 0
-        self.points_per_page = 1440 * 100  # ~ 100days
-        self._create_pagination_controls()
+        self.points_per_page = points_per_page
+        if interactive:
+            self._create_pagination_controls()
 
     def _initialize_plot(self):
         self.ax.xaxis.set_major_formatter(mdates.DateFormatter("%Y-%m-%d %H:%M"))
@@ -68,22 +73,22 @@ class Graphic:
             self.current_page += 1
             self.paginate_plot()
 
-    def create_plot_for_historical_data(self, all_points, orders):
+    def set_historical_data(self, all_points, orders):
         self.all_points = all_points
         self.orders = orders
-        self.x_data = []
-        self.y_data = []
-
-        for point in all_points:
-            point["time"] = datetime.strptime(
-                convert_unix_full_date_str(point["time"]), "%Y-%m-%d %H:%M:%S"
-            )
-            # Add the time and price to respective x and y data lists for plotting
-            self.x_data.append(point["time"])
-            self.y_data.append(point["price"])
+        self.x_data, self.y_data = prepare_plot_data(all_points)
 
+    def create_plot_for_historical_data(self, all_points, orders):
+        self.set_historical_data(all_points, orders)
         self.paginate_plot()
 
+    @property
+    def pages_count(self):
+        return -(-len(self.x_data) // self.points_per_page)  # rounded up
+
+    def close(self):
+        plt.close(self.fig)
+
     def _clear_old_labels(self):
         for child in self.ax.get_children():
             if isinstance(child, plt.Text):
@@ -119,16 +124,24 @@ class Graphic:
             self._plot_last_point(new_point, "orange", "Mid:")
 
         self.fig.canvas.draw_idle()
-        plt.show()
+        if self.interactive:
+            plt.show()
 
     def paginate_plot(self):
+        self.draw_page(self.current_page)
+
+        self.fig.canvas.draw_idle()
+        if self.interactive:
+            plt.show()
+
+    def draw_page(self, page):
         # clear graphic
         self.ax.clear()
         self._initialize_plot()
 
-        # Calculation of indices for the current page
-        start_idx = self.current_page * self.points_per_page
-        end_idx = min((self.current_page + 1) * self.points_per_page, len(self.x_data))
+        # Calculation of indices for the page
+        start_idx = page * self.points_per_page
+        end_idx = min((page + 1) * self.points_per_page, len(self.x_data))
 
         # Draw line
         self.ax.plot(
@@ -222,9 +235,6 @@ class Graphic:
         self.ax.autoscale_view()
         self.ax.legend()
 
-        self.fig.canvas.draw_idle()
-        plt.show()
-
     def plot_all_points(self, points, color):
         for point in points:
             self._plot_point(point, color=color)
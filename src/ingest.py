@@ -0,0 +1,172 @@
+import queue
+import threading
+import time
+from datetime import datetime
+
+from src.binance_client import get_klines
+from utils import get_unix_timestamp, logger
+
+QUEUE_SIZE = 4  # pages waiting between two stages, bounds the memory of a large ingest
+WRITE_BATCH_SIZE = 5000  # klines per insert
+PUT_TIMEOUT = 0.5  # seconds, how often a blocked stage checks that the pipeline is not stopped
+GAP_SAFETY_MARGIN = 10 * 60 * 1000  # ms, klines missing more recently than this may still be published by binance
+STAGES = ("fetch", "parse", "write")
+# put to a queue after the last page
+END = None
+
+
+class StageStats:
+    def __init__(self):
+        self.pages = 0
+        self.klines = 0
+        self.busy_seconds = 0
+
+    def to_dict(self):
+        return {
+            "pages": self.pages,
+            "klines": self.klines,
+            "busy_seconds": round(self.busy_seconds, 6),
+            "klines_per_second": round(self.klines / self.busy_seconds) if self.busy_seconds else None,
+        }
+
+
+class IngestPipeline:
+    """
+    Fetches klines from binance and saves them with the kline manager in three threads:
+    fetch requests the pages, parse converts them to documents and write inserts them in batches.
+    The stages are connected by bounded queues, so a slow stage blocks the previous one
+    instead of piling up pages in memory, and the network, the conversion and MongoDB work at the same time.
+    """
+
+    def __init__(self, kline_manager, queue_size=QUEUE_SIZE, write_batch_size=WRITE_BATCH_SIZE):
+        self.kline_manager = kline_manager
+        self.queue_size = queue_size
+        self.write_batch_size = write_batch_size
+
+    def run(self, start_time, end_time):
+        """Save the klines from start_time to end_time, returns the stats of the stages."""
+        self.stats = {stage: StageStats() for stage in STAGES}
+        self.gaps = []
+        self.errors = []
+        self.stopped = threading.Event()
+        fetched_pages = queue.Queue(self.queue_size)
+        parsed_pages = queue.Queue(self.queue_size)
+
+        pipeline_start_time = time.perf_counter()
+        threads = [
+            threading.Thread(target=self.run_stage, args=(self.fetch, start_time, end_time, fetched_pages)),
+            threading.Thread(target=self.run_stage, args=(self.parse, fetched_pages, parsed_pages)),
+            threading.Thread(target=self.run_stage, args=(self.write, parsed_pages)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+        # gaps are saved after the klines, the metadata is not shared between the threads
+        for gap_start, gap_end in self.get_permanent_gaps():
+            self.kline_manager.metadata.add_gap(gap_start, gap_end)
+
+        total_seconds = time.perf_counter() - pipeline_start_time
+        stats = {stage: stage_stats.to_dict() for stage, stage_stats in self.stats.items()}
+        stats["total_seconds"] = round(total_seconds, 6)
+        stats["klines_per_second"] = round(self.stats["write"].klines / total_seconds) if total_seconds else None
+        logger.info(f"Ingest of {self.kline_manager.symbol} klines: {stats}")
+        return stats
+
+    def get_permanent_gaps(self):
+        """
+        Parts of the gaps old enough to be permanent: binance can publish a closed kline a little late,
+        the recent missing klines are fetched again next time instead of being remembered as a gap.
+        """
+        last_gap_time = get_unix_timestamp(datetime.now()) - GAP_SAFETY_MARGIN - self.kline_manager.storage_time_step
+        return [
+            (gap_start, min(gap_end, last_gap_time)) for gap_start, gap_end in self.gaps if gap_start <= last_gap_time
+        ]
+
+    def run_stage(self, stage, *args):
+        try:
+            stage(*args)
+        except Exception as error:
+            self.errors.append(error)
+            self.stopped.set()
+
+    def put(self, pages, page):
+        while not self.stopped.is_set():
+            try:
+                pages.put(page, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    def get(self, pages):
+        while not self.stopped.is_set():
+            try:
+                return pages.get(timeout=PUT_TIMEOUT)
+            except queue.Empty:
+                pass
+        return END
+
+    def fetch(self, start_time, end_time, fetched_pages):
+        stats = self.stats["fetch"]
+        storage_time_step = self.kline_manager.storage_time_step
+        current_time = start_time
+
+        try:
+            while current_time < end_time and not self.stopped.is_set():
+                request_start_time = time.perf_counter()
+                klines = get_klines(current_time, end_time, self.kline_manager.symbol, self.kline_manager.storage_interval)
+                stats.busy_seconds += time.perf_counter() - request_start_time
+
+                if not klines:
+                    # only the part older than the safety margin is saved as a gap
+                    self.gaps.append((current_time, end_time))
+                    break
+
+                expected_time = current_time
+                for kline in klines:
+                    if kline[0] > expected_time:
+                        self.gaps.append((expected_time, kline[0] - storage_time_step))
+                    expected_time = kline[0] + storage_time_step
+
+                stats.pages += 1
+                stats.klines += len(klines)
+                self.put(fetched_pages, klines)
+                current_time = klines[-1][6] + 1  # closing time last kline
+        finally:
+            self.put(fetched_pages, END)
+
+    def parse(self, fetched_pages, parsed_pages):
+        from src.kline_manager import convert_kline
+
+        stats = self.stats["parse"]
+        try:
+            while (klines := self.get(fetched_pages)) is not END:
+                parse_start_time = time.perf_counter()
+                documents = [convert_kline(kline) for kline in klines]
+                stats.busy_seconds += time.perf_counter() - parse_start_time
+                stats.pages += 1
+                stats.klines += len(documents)
+                self.put(parsed_pages, documents)
+        finally:
+            self.put(parsed_pages, END)
+
+    def write(self, parsed_pages):
+        stats = self.stats["write"]
+        batch = []
+        while (documents := self.get(parsed_pages)) is not END:
+            batch += documents
+            if len(batch) >= self.write_batch_size:
+                self.write_batch(batch, stats)
+                batch = []
+        if batch and not self.stopped.is_set():
+            self.write_batch(batch, stats)
+
+    def write_batch(self, documents, stats):
+        write_start_time = time.perf_counter()
+        self.kline_manager.insert_kline_documents(documents)
+        stats.busy_seconds += time.perf_counter() - write_start_time
+        stats.pages += 1
+        stats.klines += len(documents)
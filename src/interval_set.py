@@ -0,0 +1,52 @@
+from bisect import bisect_left, bisect_right
+
+
+class IntervalSet:
+    """
+    Set of disjoint half-open [start, end) ranges, kept sorted and merged.
+    Lookups bisect the range starts and ends, so they don't depend on the length of the ranges.
+    """
+
+    def __init__(self, ranges=()):
+        self.starts = []
+        self.ends = []
+        for start, end in ranges:
+            self.add(start, end)
+
+    def to_list(self):
+        return [[start, end] for start, end in zip(self.starts, self.ends)]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start, end):
+        """Add [start, end), merging it with the overlapping and adjacent ranges."""
+        if start >= end:
+            return
+        # first range ending at or after start and first range starting after end
+        first_index = bisect_left(self.ends, start)
+        last_index = bisect_right(self.starts, end)
+        if first_index < last_index:
+            start = min(start, self.starts[first_index])
+            end = max(end, self.ends[last_index - 1])
+        self.starts[first_index:last_index] = [start]
+        self.ends[first_index:last_index] = [end]
+
+    def contains(self, start, end):
+        """The whole [start, end) range is in the set."""
+        index = bisect_right(self.starts, start) - 1
+        return index >= 0 and end <= self.ends[index]
+
+    def missing(self, start, end):
+        """Parts of [start, end) not in the set, as a list of (start, end) ranges."""
+        missing_ranges = []
+        index = max(bisect_right(self.starts, start) - 1, 0)
+        current = start
+        while current < end and index < len(self.starts) and self.starts[index] < end:
+            if self.starts[index] > current:
+                missing_ranges.append((current, self.starts[index]))
+            current = max(current, self.ends[index])
+            index += 1
+        if current < end:
+            missing_ranges.append((current, end))
+        return missing_ranges
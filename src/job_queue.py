@@ -0,0 +1,168 @@
+import hashlib
+import json
+import time
+from enum import Enum
+
+from src.clients import ensure_index, get_mongo_client
+from utils import logger
+
+JOBS_COLLECTION_NAME = "jobs"
+LEASE_TIME = 60 * 1000  # a running job is given to another worker if its heartbeat is older
+MAX_ATTEMPTS = 3
+
+
+class JobStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+def get_current_time():
+    return int(time.time() * 1000)
+
+
+def get_job_id(parameters):
+    """Jobs with the same parameters have the same id, so a job is queued and its result is saved once."""
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+
+class JobQueue:
+    """
+    Backtest jobs in a MongoDB collection, shared by any number of worker processes and machines.
+    A worker claims a pending job with an atomic update which gives it a lease, and extends the lease
+    with heartbeats while the job runs. The job of a worker which stopped sending heartbeats is claimed again
+    by another worker, up to max_attempts. Only the worker which holds the lease can save the result.
+    """
+
+    def __init__(self, mongo_uri, db_name, lease_time=LEASE_TIME, max_attempts=MAX_ATTEMPTS):
+        self.jobs = get_mongo_client(mongo_uri)[db_name][JOBS_COLLECTION_NAME]
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        # the claim query: pending jobs and expired leases, oldest first
+        ensure_index(self.jobs, [("status", 1), ("lease_expires_at", 1), ("created_at", 1)])
+
+    def submit(self, parameters):
+        """Queue a job, returns its id and whether it was new."""
+        from pymongo.errors import DuplicateKeyError
+
+        job_id = get_job_id(parameters)
+        try:
+            self.jobs.insert_one({
+                "_id": job_id,
+                "parameters": parameters,
+                "status": JobStatus.PENDING.value,
+                "attempts": 0,
+                "created_at": get_current_time(),
+                "lease_expires_at": None,
+                "worker_id": None,
+                "progress": None,
+                "result": None,
+                "error": None,
+            })
+        except DuplicateKeyError:
+            return job_id, False
+        return job_id, True
+
+    def submit_many(self, parameters_list):
+        """Queue the jobs, returns the number of new ones."""
+        return sum(self.submit(parameters)[1] for parameters in parameters_list)
+
+    def claim(self, worker_id):
+        """Take the oldest pending job or a job with an expired lease, returns the job or None."""
+        from pymongo import ReturnDocument
+
+        current_time = get_current_time()
+        self.fail_expired_jobs(current_time)
+        return self.jobs.find_one_and_update(
+            {
+                "$or": [
+                    {"status": JobStatus.PENDING.value},
+                    {"status": JobStatus.RUNNING.value, "lease_expires_at": {"$lt": current_time}},
+                ],
+                "attempts": {"$lt": self.max_attempts},
+            },
+            {
+                "$set": {
+                    "status": JobStatus.RUNNING.value,
+                    "worker_id": worker_id,
+                    "lease_expires_at": current_time + self.lease_time,
+                    "started_at": current_time,
+                    "progress": None,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self, job_id, worker_id, progress=None):
+        """Extend the lease of the job, returns False if the lease was lost and the job must be abandoned."""
+        update = {"lease_expires_at": get_current_time() + self.lease_time}
+        if progress is not None:
+            update["progress"] = progress
+        result = self.jobs.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": JobStatus.RUNNING.value},
+            {"$set": update},
+        )
+        return result.matched_count == 1
+
+    def complete(self, job_id, worker_id, result):
+        """Save the result, returns False if another worker holds the job and the result is dropped."""
+        update_result = self.jobs.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": JobStatus.RUNNING.value},
+            {"$set": {
+                "status": JobStatus.DONE.value,
+                "result": result,
+                "finished_at": get_current_time(),
+                "lease_expires_at": None,
+            }},
+        )
+        return update_result.matched_count == 1
+
+    def fail(self, job_id, worker_id, error):
+        """Give the job back to the queue, or fail it after max_attempts."""
+        job = self.jobs.find_one({"_id": job_id, "worker_id": worker_id, "status": JobStatus.RUNNING.value})
+        if job is None:
+            return
+        status = JobStatus.FAILED.value if job["attempts"] >= self.max_attempts else JobStatus.PENDING.value
+        self.jobs.update_one(
+            {"_id": job_id, "worker_id": worker_id, "status": JobStatus.RUNNING.value},
+            {"$set": {"status": status, "error": error, "lease_expires_at": None}},
+        )
+
+    def fail_expired_jobs(self, current_time):
+        """Jobs whose last attempt expired are not claimed anymore, they are marked as failed."""
+        self.jobs.update_many(
+            {
+                "status": JobStatus.RUNNING.value,
+                "lease_expires_at": {"$lt": current_time},
+                "attempts": {"$gte": self.max_attempts},
+            },
+            {"$set": {"status": JobStatus.FAILED.value, "error": "lease expired", "lease_expires_at": None}},
+        )
+
+    def get_progress(self):
+        """Number of jobs by status and the progress of the running jobs."""
+        counts = {status.value: 0 for status in JobStatus}
+        for status_count in self.jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[status_count["_id"]] = status_count["count"]
+        running_jobs = list(self.jobs.find(
+            {"status": JobStatus.RUNNING.value},
+            {"parameters": 1, "worker_id": 1, "progress": 1, "attempts": 1, "lease_expires_at": 1},
+        ))
+        return {"counts": counts, "running": running_jobs}
+
+    def get_results(self, symbol=None, limit=20):
+        """Finished jobs by their profit."""
+        query = {"status": JobStatus.DONE.value}
+        if symbol:
+            query["parameters.symbol"] = symbol
+        return list(self.jobs.find(query, {"parameters": 1, "result": 1}).sort("result.profit", -1).limit(limit))
+
+    def get_failed(self):
+        return list(self.jobs.find({"status": JobStatus.FAILED.value}, {"parameters": 1, "error": 1, "attempts": 1}))
+
+    def clear(self):
+        self.jobs.delete_many({})
+        logger.info("Job queue cleared")
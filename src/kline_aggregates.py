@@ -0,0 +1,108 @@
+from collections import deque
+
+from src.resampler import get_bucket_start
+
+# [bucket start, open, high, low, close, volume, klines count]
+BUCKET_ROW_FIELDS = ("startTime", "open", "high", "low", "close", "volume", "count")
+
+
+def get_range_match(start_time, end_time):
+    return {"$match": {"startTime": {"$gte": start_time, "$lt": end_time}}}
+
+
+def get_bucket_start_expression(bucket_time):
+    # startTime is stored as a unix time in ms, not a date, so the bucket is truncated with $mod
+    # instead of $dateTrunc
+    return {"$subtract": ["$startTime", {"$mod": ["$startTime", bucket_time]}]}
+
+
+def get_buckets_pipeline(start_time, end_time, bucket_time):
+    return [
+        get_range_match(start_time, end_time),
+        {"$sort": {"startTime": 1}},
+        {"$group": {
+            "_id": get_bucket_start_expression(bucket_time),
+            "open": {"$first": "$open"},
+            "high": {"$max": "$high"},
+            "low": {"$min": "$low"},
+            "close": {"$last": "$close"},
+            "volume": {"$sum": "$volume"},
+            "count": {"$sum": 1},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "row": ["$_id", "$open", "$high", "$low", "$close", "$volume", "$count"]}},
+    ]
+
+
+def get_coverage_pipeline(start_time, end_time, bucket_time):
+    return [
+        get_range_match(start_time, end_time),
+        {"$group": {"_id": get_bucket_start_expression(bucket_time), "count": {"$sum": 1}}},
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "row": ["$_id", "$count"]}},
+    ]
+
+
+def get_rolling_extremes_pipeline(start_time, end_time, window_klines_count, time_step):
+    """The window of a kline is the window_klines_count klines before it, as in the analyzer."""
+    window = {"documents": [-window_klines_count, -1]}
+    return [
+        # the klines before start_time fill the windows of the first ones
+        get_range_match(start_time - window_klines_count * time_step, end_time),
+        {"$setWindowFields": {
+            "sortBy": {"startTime": 1},
+            "output": {
+                "windowLow": {"$min": "$low", "window": window},
+                "windowHigh": {"$max": "$high", "window": window},
+            },
+        }},
+        {"$match": {"startTime": {"$gte": start_time}}},
+        {"$project": {"_id": 0, "row": ["$startTime", "$windowLow", "$windowHigh"]}},
+    ]
+
+
+def get_bucket_rows(klines, bucket_time):
+    """Client-side rows of get_buckets_pipeline from klines sorted by startTime."""
+    rows = []
+    for kline in klines:
+        bucket_start = get_bucket_start(kline["startTime"], bucket_time)
+        if rows and rows[-1][0] == bucket_start:
+            row = rows[-1]
+            row[2] = max(row[2], kline["high"])
+            row[3] = min(row[3], kline["low"])
+            row[4] = kline["close"]
+            row[5] += kline["volume"]
+            row[6] += 1
+        else:
+            rows.append([bucket_start, kline["open"], kline["high"], kline["low"], kline["close"], kline["volume"], 1])
+    return rows
+
+
+def get_coverage_rows(klines, bucket_time):
+    """Client-side rows of get_coverage_pipeline."""
+    return [[row[0], row[6]] for row in get_bucket_rows(klines, bucket_time)]
+
+
+def get_rolling_extremes_rows(klines, start_time, window_klines_count):
+    """Client-side rows of get_rolling_extremes_pipeline from klines sorted by startTime."""
+    rows = []
+    lows = deque()  # indexes of the window klines with increasing lows
+    highs = deque()  # indexes of the window klines with decreasing highs
+    for index, kline in enumerate(klines):
+        while lows and lows[0] < index - window_klines_count:
+            lows.popleft()
+        while highs and highs[0] < index - window_klines_count:
+            highs.popleft()
+        if kline["startTime"] >= start_time:
+            rows.append([
+                kline["startTime"],
+                klines[lows[0]]["low"] if lows else None,
+                klines[highs[0]]["high"] if highs else None,
+            ])
+        while lows and klines[lows[-1]]["low"] >= kline["low"]:
+            lows.pop()
+        lows.append(index)
+        while highs and klines[highs[-1]]["high"] <= kline["high"]:
+            highs.pop()
+        highs.append(index)
+    return rows
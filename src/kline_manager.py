@@ -1,11 +1,32 @@
 import time
-from pymongo import MongoClient
-from bot import TIME_STEP
-from binance_client import get_klines
-from utils import convert_unix_full_date_str, logger
+from bisect import bisect_left
+from datetime import datetime
+from src.core import TIME_STEP, INTERVAL_TIME_STEPS
+from src.binance_client import get_klines
+from src.clients import ensure_index, get_mongo_client
+from src import kline_aggregates
+from src.metrics import metrics
+from src.resampler import KlineResampler
+from src.single_flight import FETCH_LOCKS_COLLECTION_NAME, SingleFlight
+from src.symbol_metadata import METADATA_COLLECTION_NAME, SymbolMetadata
+from utils import convert_unix_full_date_str, get_unix_timestamp, logger
 
 
-def get_missing_intervals(missing_times):
+# intervals saved to the database, the others are resampled from 1m klines
+STORED_INTERVALS = ("1s", "1m")
+BINANCE_FOUNDATION_TIME = get_unix_timestamp(datetime(2017, 7, 1))
+
+KLINES_QUERY_LATENCY = metrics.histogram("mongo_query_seconds", "Latency of the MongoDB queries", query="find_klines")
+MISSING_KLINES_QUERY_LATENCY = metrics.histogram(
+    "mongo_query_seconds", "Latency of the MongoDB queries", query="find_missing_klines"
+)
+INSERT_LATENCY = metrics.histogram("mongo_query_seconds", "Latency of the MongoDB queries", query="insert_klines")
+AGGREGATE_LATENCY = metrics.histogram("mongo_query_seconds", "Latency of the MongoDB queries", query="aggregate_klines")
+KLINES_LOADED_COUNTER = metrics.counter("klines_loaded_total", "Klines read from the kline store")
+KLINES_SAVED_COUNTER = metrics.counter("klines_saved_total", "Klines saved to the kline store")
+
+
+def get_missing_intervals(missing_times, time_step=TIME_STEP):
     """Convert missing times into start and end intervals."""
     if not missing_times:
         return []
@@ -18,7 +39,7 @@ def get_missing_intervals(missing_times):
     end = missing_times[0]
 
     for current_time in missing_times[1:]:
-        if current_time <= end + TIME_STEP:
+        if current_time <= end + time_step:
             end = current_time
         else:
             # If there's a gap, close the previous interval
@@ -32,38 +53,87 @@ def get_missing_intervals(missing_times):
     return intervals
 
 
+def convert_kline(kline):
+    """Convert a kline from the binance API format to the database document."""
+    return {
+        "startTime": kline[0],
+        "open": float(kline[1]),
+        "high": float(kline[2]),
+        "low": float(kline[3]),
+        "close": float(kline[4]),
+        "volume": float(kline[5]),
+        "closeTime": kline[6],
+        "quoteAssetVolume": float(kline[7]),
+        "numberOfTrades": kline[8],
+        "takerBuyBaseAssetVolume": float(kline[9]),
+        "takerBuyQuoteAssetVolume": float(kline[10]),
+        "ignore": float(kline[11]),
+    }
+
+
+def get_collection_name(symbol, interval):
+    if interval == "1m":
+        return f"{symbol.lower()}_klines"
+    return f"{symbol.lower()}_{interval}_klines"
+
+
 class KlineManager:
-    def __init__(self, mongo_uri, db_name, symbol):
-        self.mongo_client = MongoClient(mongo_uri)
+    def __init__(self, mongo_uri, db_name, symbol, interval="1m"):
+        self.mongo_client = get_mongo_client(mongo_uri)
         self.db = self.mongo_client[db_name]
-        self.symbol = symbol
-        collection_name = f"{symbol.lower()}_klines"
+        self.set_symbol(symbol, interval)
+        collection_name = get_collection_name(symbol, self.storage_interval)
         self.collection = self.db[collection_name]
-        self.collection.create_index("startTime")
-
-    def get_and_save_all_klines(self, start_time, end_time):
-        """Get all candlestick data for a year by requesting in chunks of 1000."""
-        current_time = start_time
-
-        while current_time < end_time:
+        ensure_index(self.collection, "startTime")
+        self.metadata = SymbolMetadata(symbol, self.storage_interval, self.db[METADATA_COLLECTION_NAME])
+        # concurrent fetches of the same missing klines by the processes sharing the database are coalesced
+        self.fetches = SingleFlight(
+            (db_name, collection_name), self.storage_time_step, self.db[FETCH_LOCKS_COLLECTION_NAME]
+        )
 
-            klines = get_klines(current_time, end_time, self.symbol)
+    def set_symbol(self, symbol, interval):
+        self.symbol = symbol
+        self.interval = interval
+        self.time_step = INTERVAL_TIME_STEPS[interval]
+        # klines of not stored intervals are resampled from the stored 1m klines
+        self.storage_interval = interval if interval in STORED_INTERVALS else "1m"
+        self.storage_time_step = INTERVAL_TIME_STEPS[self.storage_interval]
+        self.resampler = None
+        if self.storage_interval != interval:
+            self.resampler = KlineResampler(self.time_step, self.storage_time_step)
 
+    def get_listing_time(self):
+        """Start time of the first kline of the symbol in binance, requested once and kept in the metadata."""
+        if self.metadata.listing_time is None:
+            klines = get_klines(
+                BINANCE_FOUNDATION_TIME, get_unix_timestamp(datetime.now()), self.symbol, self.storage_interval
+            )
             if not klines:
-                break
+                raise Exception(f"No klines found in binance for {self.symbol}")
+            self.metadata.set_listing_time(klines[0][0])
+        return self.metadata.listing_time
+
+    def get_and_save_all_klines(self, start_time, end_time):
+        """
+        Get all candlestick data for the range by requesting in chunks of 1000,
+        fetching, converting and saving run in a pipeline. Returns the stats of the pipeline stages.
+        """
+        # imported here, the ingest module uses convert_kline of this module
+        from src.ingest import IngestPipeline
 
-            self.save_klines(klines)
-            current_time = klines[-1][6] + 1  # closing time last kline
+        return IngestPipeline(self).run(start_time, end_time)
 
     def find_missing_klines_time(self, start_time, end_time):
-        expected_times = set(range(start_time, end_time, TIME_STEP))
+        expected_times = set(range(start_time, end_time, self.storage_time_step))
 
         # Get all available timestamps from the database
+        query_start_time = time.perf_counter()
         available_klines = list(
             self.collection.find(
                 {"startTime": {"$gte": start_time, "$lt": end_time}}, {"startTime": 1}
             )
         )
+        MISSING_KLINES_QUERY_LATENCY.observe(time.perf_counter() - query_start_time)
         available_times = set([kline["startTime"] for kline in available_klines])
 
         # Determine missing timestamps
@@ -72,69 +142,222 @@ class KlineManager:
         return sorted(list(missing_times))
 
     def save_klines(self, klines):
-        documents = []
         insert_klines_start_time = time.time()
-        for kline in klines:
-            document = {
-                "startTime": kline[0],
-                "open": float(kline[1]),
-                "high": float(kline[2]),
-                "low": float(kline[3]),
-                "close": float(kline[4]),
-                "volume": float(kline[5]),
-                "closeTime": kline[6],
-                "quoteAssetVolume": float(kline[7]),
-                "numberOfTrades": kline[8],
-                "takerBuyBaseAssetVolume": float(kline[9]),
-                "takerBuyQuoteAssetVolume": float(kline[10]),
-                "ignore": float(kline[11]),
-            }
-
-            documents.append(document)
-
-        self.collection.insert_many(documents)
+        self.insert_kline_documents([convert_kline(kline) for kline in klines])
         insert_klines_end_time = time.time()
         logger.debug(
             f"Time klines insertion after one request to binance: {insert_klines_end_time - insert_klines_start_time} s"
         )
 
+    def insert_kline_documents(self, documents):
+        if not documents:
+            return
+        self.write_kline_documents(documents)
+        KLINES_SAVED_COUNTER.inc(len(documents))
+        self.metadata.add_stored_klines([document["startTime"] for document in documents])
+
+    def write_kline_documents(self, documents):
+        query_start_time = time.perf_counter()
+        # unordered, the server doesn't stop on the first error and can apply the batch in parallel
+        self.collection.insert_many(documents, ordered=False)
+        INSERT_LATENCY.observe(time.perf_counter() - query_start_time)
+
     def find_klines_in_range(self, start_time, end_time):
-        return list(
+        query_start_time = time.perf_counter()
+        klines = list(
             self.collection.find(
                 {"startTime": {"$gte": start_time, "$lt": end_time}}, {"_id": 0}
             )
         )
+        KLINES_QUERY_LATENCY.observe(time.perf_counter() - query_start_time)
+        KLINES_LOADED_COUNTER.inc(len(klines))
+        return klines
+
+    def find_plot_klines(self, start_time, end_time):
+        """Klines of the range with only the fields of their plot points, closeTime and close."""
+        query_start_time = time.perf_counter()
+        klines = list(
+            self.collection.find(
+                {"startTime": {"$gte": start_time, "$lt": end_time}}, {"_id": 0, "closeTime": 1, "close": 1}
+            )
+        )
+        KLINES_QUERY_LATENCY.observe(time.perf_counter() - query_start_time)
+        KLINES_LOADED_COUNTER.inc(len(klines))
+        return klines
+
+    def aggregate_rows(self, pipeline):
+        query_start_time = time.perf_counter()
+        rows = [document["row"] for document in self.collection.aggregate(pipeline)]
+        AGGREGATE_LATENCY.observe(time.perf_counter() - query_start_time)
+        return rows
+
+    def find_bucket_rows(self, start_time, end_time, bucket_time):
+        """
+        Stored klines of the range aggregated by bucket_time on the server,
+        [bucket start, open, high, low, close, volume, klines count] per bucket with klines.
+        """
+        return self.aggregate_rows(kline_aggregates.get_buckets_pipeline(start_time, end_time, bucket_time))
+
+    def find_coverage_rows(self, start_time, end_time, bucket_time):
+        """[bucket start, stored klines count] per bucket with klines, counted on the server."""
+        return self.aggregate_rows(kline_aggregates.get_coverage_pipeline(start_time, end_time, bucket_time))
+
+    def find_rolling_extremes_rows(self, start_time, end_time, window_klines_count):
+        """
+        [startTime, min low, max high] of the window_klines_count stored klines before each kline of the range,
+        computed on the server with $setWindowFields (MongoDB 5.0+).
+        """
+        return self.aggregate_rows(kline_aggregates.get_rolling_extremes_pipeline(
+            start_time, end_time, window_klines_count, self.storage_time_step
+        ))
+
+    def fetch_missing_range(self, start_time, end_time):
+        # binance includes the kline starting at the end time
+        self.get_and_save_all_klines(start_time, end_time - self.storage_time_step)
+
+    def find_missing_ranges(self, start_time, end_time):
+        """[start, end) ranges of the klines still missing after the fetch of another process, except the gaps."""
+        self.metadata.reload()
+        missing_times = [
+            missing_time for missing_time in self.find_missing_klines_time(start_time, end_time)
+            if not self.metadata.is_known_missing(missing_time)
+        ]
+        return [
+            (interval_start, interval_end + self.storage_time_step)
+            for interval_start, interval_end in get_missing_intervals(missing_times, self.storage_time_step)
+        ]
 
     def find_or_fetch_klines_in_range(self, start_time, end_time):
+        if self.resampler:
+            return self.resampler.get_klines_in_range(start_time, end_time, self.find_or_fetch_stored_klines_in_range)
+        return self.find_or_fetch_stored_klines_in_range(start_time, end_time)
+
+    def find_or_fetch_stored_klines_in_range(self, start_time, end_time):
         klines = self.find_klines_in_range(start_time, end_time)
+        missing_klines = []
+        for interval_start, interval_end in self.fetch_missing_klines(start_time, end_time):
+            missing_klines += self.find_klines_in_range(interval_start, interval_end)
+
+        if missing_klines:
+            # Add new data to existing ones, the klines of a shared kline manager are a read-only view
+            klines = list(klines) + missing_klines
+            klines.sort(key=lambda kline: kline["startTime"])
+
+        return klines
+
+    def fetch_missing_klines(self, start_time, end_time):
+        """
+        Fetch and save the klines of the range missing in the database, except the known gaps,
+        without loading the stored ones. Returns the fetched [start, end) ranges.
+        """
+        # Only the ranges not covered by the metadata are checked kline by kline
+        missing_times = []
+        for range_start, range_end in self.metadata.get_uncovered_ranges(start_time, end_time):
+            range_missing_times = self.find_missing_klines_time(range_start, range_end)
+            if not range_missing_times:
+                # klines saved before the coverage was kept
+                self.metadata.add_coverage(range_start, range_end)
+            # Load missing data from API and save it to the database, except the klines binance doesn't have
+            missing_times += [
+                missing_time for missing_time in range_missing_times
+                if not self.metadata.is_known_missing(missing_time)
+            ]
 
-        # Load missing data from API and save it to the database
-        missing_times = self.find_missing_klines_time(start_time, end_time)
         if missing_times:
             logger.warning(
                 f"Data for the range {convert_unix_full_date_str(start_time)} - {convert_unix_full_date_str(end_time)} is incomplete."
             )
-            missing_intervals = get_missing_intervals(missing_times)
+            missing_intervals = get_missing_intervals(missing_times, self.storage_time_step)
 
             # Fetch and save missing data for each interval
-            missing_klines = []
+            fetched_ranges = []
             get_and_save_start_time = time.time()
 
             for interval_start, interval_end in missing_intervals:
                 logger.warning(
                     f"No klines found in the database on the interval: {convert_unix_full_date_str(interval_start)} - {convert_unix_full_date_str(interval_end)}. Fetching missing data..."
                 )
-                self.get_and_save_all_klines(interval_start, interval_end)
-                missing_klines += self.find_klines_in_range(
-                    interval_start, interval_end
+                self.fetches.fetch(
+                    interval_start,
+                    interval_end + self.storage_time_step,
+                    self.fetch_missing_range,
+                    self.find_missing_ranges,
                 )
+                fetched_ranges.append((interval_start, interval_end + self.storage_time_step))
 
             get_and_save_end_time = time.time()
             logger.info(
                 f"Time to get and save all missing klines: {get_and_save_end_time - get_and_save_start_time}s"
             )
+            return fetched_ranges
+        return []
 
-            # Add new data to existing ones
-            klines += missing_klines
 
-        return klines
+class InMemoryKlineManager(KlineManager):
+    """
+    KlineManager keeping the klines in memory instead of MongoDB.
+    Used for benchmarks and offline runs over klines saved with save_klines.
+    """
+
+    def __init__(self, symbol, interval="1m"):
+        self.set_symbol(symbol, interval)
+        self.klines = []  # sorted by startTime
+        self.start_times = []
+        self.metadata = SymbolMetadata(symbol, self.storage_interval)
+        self.fetches = SingleFlight(("memory", id(self)), self.storage_time_step)
+
+    @classmethod
+    def from_klines(cls, symbol, klines, interval="1m"):
+        """Kline manager over already loaded klines of the storage interval, sorted by startTime, without copying them."""
+        kline_manager = cls(symbol, interval)
+        kline_manager.klines = klines
+        kline_manager.start_times = [kline["startTime"] for kline in klines]
+        if klines:
+            # nothing is fetched: there are no klines before the first one
+            kline_manager.metadata.set_listing_time(klines[0]["startTime"])
+            kline_manager.metadata.add_stored_klines(kline_manager.start_times)
+        return kline_manager
+
+    def write_kline_documents(self, documents):
+        start_times = [document["startTime"] for document in documents]
+        is_appended_in_order = (
+            start_times == sorted(set(start_times))
+            and (not self.start_times or self.start_times[-1] < start_times[0])
+        )
+        if is_appended_in_order:
+            self.klines.extend(documents)
+            self.start_times.extend(start_times)
+            return
+
+        klines_by_start_time = {kline["startTime"]: kline for kline in self.klines}
+        for document in documents:
+            klines_by_start_time[document["startTime"]] = document
+        self.klines = sorted(klines_by_start_time.values(), key=lambda kline: kline["startTime"])
+        self.start_times = [kline["startTime"] for kline in self.klines]
+
+    def find_klines_in_range(self, start_time, end_time):
+        start_index = bisect_left(self.start_times, start_time)
+        end_index = bisect_left(self.start_times, end_time)
+        KLINES_LOADED_COUNTER.inc(end_index - start_index)
+        # copies, as documents read from the database, the analyzer adds fields to the klines
+        return [dict(kline) for kline in self.klines[start_index:end_index]]
+
+    def find_plot_klines(self, start_time, end_time):
+        return self.find_klines_in_range(start_time, end_time)
+
+    def find_bucket_rows(self, start_time, end_time, bucket_time):
+        return kline_aggregates.get_bucket_rows(self.find_klines_in_range(start_time, end_time), bucket_time)
+
+    def find_coverage_rows(self, start_time, end_time, bucket_time):
+        return kline_aggregates.get_coverage_rows(self.find_klines_in_range(start_time, end_time), bucket_time)
+
+    def find_rolling_extremes_rows(self, start_time, end_time, window_klines_count):
+        klines = self.find_klines_in_range(start_time - window_klines_count * self.storage_time_step, end_time)
+        return kline_aggregates.get_rolling_extremes_rows(klines, start_time, window_klines_count)
+
+    def find_missing_klines_time(self, start_time, end_time):
+        expected_times = set(range(start_time, end_time, self.storage_time_step))
+        start_index = bisect_left(self.start_times, start_time)
+        end_index = bisect_left(self.start_times, end_time)
+        available_times = set(self.start_times[start_index:end_index])
+        return sorted(list(expected_times - available_times))
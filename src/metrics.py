@@ -0,0 +1,160 @@
+import threading
+
+from utils import logger
+
+# upper bounds of the latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self):
+        self.value = 0
+
+    def reset(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+    def to_dict(self):
+        return self.value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.reset()
+
+    def reset(self):
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[index] += 1
+                break
+
+    def samples(self, name, labels):
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip(self.buckets, self.bucket_counts):
+            cumulative_count += bucket_count
+            yield f"{name}_bucket", labels + (("le", upper_bound),), cumulative_count
+        yield f"{name}_bucket", labels + (("le", "+Inf"),), self.count
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, self.count
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count else None,
+            "buckets": dict(zip(self.buckets, self.bucket_counts)),
+        }
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms of the bot components.
+    A metric is created on the first call and the same object is returned for the same name and labels,
+    so hot paths keep the metric object and only pay for an addition.
+    """
+
+    def __init__(self):
+        self.metrics = {}  # (name, labels) -> metric
+        self.help = {}  # name -> description
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, help, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(key, metric_class(**kwargs))
+                self.help.setdefault(name, help)
+        return metric
+
+    def counter(self, name, help="", **labels):
+        return self._get_or_create(Counter, name, help, labels)
+
+    def gauge(self, name, help="", **labels):
+        return self._get_or_create(Gauge, name, help, labels)
+
+    def histogram(self, name, help="", buckets=DEFAULT_BUCKETS, **labels):
+        return self._get_or_create(Histogram, name, help, labels, buckets=buckets)
+
+    def reset(self):
+        """Reset the values, the metric objects kept by the components stay registered."""
+        for metric in self.metrics.values():
+            metric.reset()
+
+    def render_prometheus(self):
+        """Metrics in the Prometheus text exposition format."""
+        lines = []
+        described_names = set()
+        for (name, labels), metric in sorted(self.metrics.items(), key=lambda item: item[0]):
+            if name not in described_names:
+                described_names.add(name)
+                lines.append(f"# HELP {name} {self.help.get(name, '')}")
+                lines.append(f"# TYPE {name} {metric.type}")
+            for sample_name, sample_labels, value in metric.samples(name, labels):
+                lines.append(f"{sample_name}{format_labels(sample_labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        summary = {}
+        for (name, labels), metric in sorted(self.metrics.items(), key=lambda item: item[0]):
+            summary[f"{name}{format_labels(labels)}"] = metric.to_dict()
+        return summary
+
+
+metrics = MetricsRegistry()
+
+
+def start_metrics_server(port):
+    """Serve the metrics at http://localhost:<port>/metrics from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"Metrics request: {format % args}")
+
+    server = ThreadingHTTPServer(("", port), MetricsRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Metrics are available at http://localhost:{port}/metrics")
+    return server
@@ -0,0 +1,191 @@
+import numpy as np
+
+from src.core import get_kline_column
+from src.trader import ORDERS_EVALUATED_COUNTER, OrderStatus, OrderType, Trader
+
+INITIAL_CAPACITY = 1024
+BLOCK_KLINES_COUNT = 240  # klines compared with all orders at once by update_orders_block
+
+OPEN = 0
+FULFILLED = 1
+CLOSED = 2
+CANCELED = 3
+STATUS_CODES = {
+    OrderStatus.OPEN: OPEN,
+    OrderStatus.FULFILLED: FULFILLED,
+    OrderStatus.CLOSED: CLOSED,
+    OrderStatus.CANCELED: CANCELED,
+}
+
+
+class OrderBook:
+    """
+    Orders of many traders evaluated together: the prices and statuses of the orders are kept in arrays
+    and compared with the kline low and high for all active orders at once.
+    The few orders that change on a kline are then updated with the Order methods and the sideway rules
+    of their trader are applied, so fills, closes, re-placements and cancels are the same as with Trader.
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.orders = []
+        self.traders = []
+        self.order_traders = np.zeros(capacity, dtype=np.int64)  # index of the trader of each order
+        self.is_long = np.zeros(capacity, dtype=bool)
+        self.entry_prices = np.zeros(capacity)
+        self.stop_prices = np.zeros(capacity)
+        self.take_profit_prices = np.zeros(capacity)
+        self.statuses = np.zeros(capacity, dtype=np.int8)
+        self.active = np.zeros(0, dtype=np.int64)  # indexes of the open and fulfilled orders
+        self.new_orders = []  # placed since the last update, evaluated from the next kline
+        self.traders_to_check = set()  # their sideway rules changed orders on the last kline
+
+    def add_trader(self, trader):
+        self.traders.append(trader)
+        return len(self.traders) - 1
+
+    def add_order(self, trader_index, order):
+        index = len(self.orders)
+        if index == len(self.statuses):
+            self._grow()
+        self.orders.append(order)
+        self.order_traders[index] = trader_index
+        self.is_long[index] = order.type == OrderType.LONG
+        self.entry_prices[index] = order.entry_price
+        self.stop_prices[index] = order.stop_price
+        self.take_profit_prices[index] = order.take_profit_price
+        self.statuses[index] = STATUS_CODES[order.status]
+        self.new_orders.append(index)
+
+    def _grow(self):
+        for name in ("order_traders", "is_long", "entry_prices", "stop_prices", "take_profit_prices", "statuses"):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+
+    def _add_new_orders(self):
+        if self.new_orders:
+            self.active = np.concatenate([self.active, np.array(self.new_orders, dtype=np.int64)])
+            self.new_orders = []
+
+    def update_orders(self, kline):
+        """Evaluate all active orders against the kline. Returns the traders whose orders changed."""
+        self._add_new_orders()
+        changed_traders = set()
+        if len(self.active):
+            ORDERS_EVALUATED_COUNTER.inc(len(self.active))
+            low_price = kline["low"]
+            high_price = kline["high"]
+            is_long = self.is_long[self.active]
+            is_open = self.statuses[self.active] == OPEN
+
+            entry_prices = self.entry_prices[self.active]
+            fills = is_open & np.where(is_long, low_price <= entry_prices, high_price >= entry_prices)
+            # take profit is checked first, an order fulfilled on this kline is closed from the next one
+            take_profit_prices = self.take_profit_prices[self.active]
+            take_profits = ~is_open & np.where(
+                is_long, high_price >= take_profit_prices, low_price <= take_profit_prices
+            )
+            stop_prices = self.stop_prices[self.active]
+            stops = ~is_open & ~take_profits & np.where(is_long, low_price <= stop_prices, high_price >= stop_prices)
+
+            for position in np.flatnonzero(fills | take_profits | stops):
+                # evaluating the order object applies the same change and writes the log
+                index = self.active[position]
+                order = self.orders[index]
+                trader_index = int(self.order_traders[index])
+                self.traders[trader_index].evaluate_order(order, kline)
+                self.statuses[index] = STATUS_CODES[order.status]
+                changed_traders.add(trader_index)
+
+        # the rules are applied again while they change orders, as Trader does on every kline
+        for trader_index in changed_traders | self.traders_to_check:
+            trader = self.traders[trader_index]
+            if trader_index not in changed_traders and not trader.has_active_sideway():
+                self.traders_to_check.discard(trader_index)
+            elif trader.apply_sideway_rules():
+                self.traders_to_check.add(trader_index)
+                for order in trader.current_sideway_orders:
+                    self.statuses[trader.order_indexes[order]] = STATUS_CODES[order.status]
+                changed_traders.add(trader_index)
+            else:
+                self.traders_to_check.discard(trader_index)
+
+        if changed_traders:
+            statuses = self.statuses[self.active]
+            self.active = self.active[(statuses == OPEN) | (statuses == FULFILLED)]
+        self._add_new_orders()
+        return changed_traders
+
+    def find_next_change(self, lows, highs):
+        """Index of the first kline of the block changing an active order, None if no order changes."""
+        if not len(self.active):
+            return None
+        is_long = self.is_long[self.active][:, None]
+        is_open = (self.statuses[self.active] == OPEN)[:, None]
+        entry_prices = self.entry_prices[self.active][:, None]
+        take_profit_prices = self.take_profit_prices[self.active][:, None]
+        stop_prices = self.stop_prices[self.active][:, None]
+        long_changes = np.where(
+            is_open, lows <= entry_prices, (highs >= take_profit_prices) | (lows <= stop_prices)
+        )
+        short_changes = np.where(
+            is_open, highs >= entry_prices, (lows <= take_profit_prices) | (highs >= stop_prices)
+        )
+        changed_klines = np.flatnonzero(np.where(is_long, long_changes, short_changes).any(axis=0))
+        return int(changed_klines[0]) if len(changed_klines) else None
+
+    def update_orders_block(self, klines, start_index=0):
+        """
+        Evaluate the active orders against klines[start_index:], skipping the klines on which no order changes.
+        Stops after the kline on which a trader has no active orders anymore, as its analyzer runs from the next kline.
+        Returns the index of the first kline not processed.
+        """
+        self._add_new_orders()
+        index = start_index
+        while index < len(klines):
+            if self.traders_to_check:
+                next_change = index
+            else:
+                block = klines[index:index + BLOCK_KLINES_COUNT]
+                lows = np.array(get_kline_column(block, "low"))
+                highs = np.array(get_kline_column(block, "high"))
+                block_change = self.find_next_change(lows, highs)
+                if block_change is None:
+                    ORDERS_EVALUATED_COUNTER.inc(len(self.active) * len(block))
+                    index += len(block)
+                    continue
+                ORDERS_EVALUATED_COUNTER.inc(len(self.active) * block_change)
+                next_change = index + block_change
+
+            changed_traders = self.update_orders(klines[next_change])
+            index = next_change + 1
+            if any(not self.traders[trader_index].has_active_sideway() for trader_index in changed_traders):
+                break
+        return index
+
+
+class BookTrader(Trader):
+    """Trader whose orders are evaluated by a shared OrderBook."""
+
+    def __init__(self, order_book, drill_down=None, performance=None):
+        super().__init__(drill_down, performance)
+        self.order_book = order_book
+        self.trader_index = order_book.add_trader(self)
+        self.order_indexes = {}  # order -> index in the book
+
+    def place_short_order(self):
+        order = super().place_short_order()
+        self._add_to_book(order)
+        return order
+
+    def place_long_order(self):
+        order = super().place_long_order()
+        self._add_to_book(order)
+        return order
+
+    def _add_to_book(self, order):
+        self.order_indexes[order] = len(self.order_book.orders)
+        self.order_book.add_order(self.trader_index, order)
+
+    def update_orders(self, kline):
+        # the book evaluates the orders of all its traders, the dispatcher updates it once per kline
+        self.order_book.update_orders(kline)
@@ -0,0 +1,124 @@
+from src.metrics import metrics
+from src.trader import OrderStatus
+
+EQUITY_RESOLUTION = 60 * 60 * 1000  # one point of the equity curve per hour
+
+
+class PerformanceTracker:
+    """
+    Performance of a trader updated on every order fill and close, in O(1) per event:
+    the equity curve of the closed orders at `resolution`, its max drawdown, win rate, profit factor,
+    average holding time, exposure and the profit of every sideway.
+    The equity, drawdown and win rate are also gauges, served live in real time mode.
+    """
+
+    def __init__(self, resolution=EQUITY_RESOLUTION, **labels):
+        self.resolution = resolution
+        self.equity = 0
+        self.peak_equity = 0
+        self.max_drawdown = 0
+        self.equity_curve = []  # [time, equity] at the end of each resolution period with a closed order
+        self.closed_orders_count = 0
+        self.winning_orders_count = 0
+        self.gross_profit = 0
+        self.gross_loss = 0
+        self.holding_time = 0  # sum over the closed orders
+        self.sideway_profits = {}  # sideway index -> [profit, closed orders]
+        self.open_positions_count = 0
+        self.exposure_start_time = None  # time since which some position is open
+        self.exposure_time = 0
+        self.first_time = None
+        self.last_time = None
+
+        self.equity_gauge = metrics.gauge("trader_equity", "Profit of the closed orders", **labels)
+        self.drawdown_gauge = metrics.gauge("trader_max_drawdown", "Max drawdown of the equity", **labels)
+        self.win_rate_gauge = metrics.gauge("trader_win_rate", "Share of the closed orders with a profit", **labels)
+
+    def _update_time(self, time):
+        if self.first_time is None:
+            self.first_time = time
+        self.last_time = time
+
+    def on_order_changed(self, order, previous_status, sideway_index):
+        """Called by the trader after an evaluation changed the status of the order."""
+        if previous_status == OrderStatus.OPEN:
+            self.on_order_fulfilled(order)
+        if order.status == OrderStatus.CLOSED:
+            self.on_order_closed(order, sideway_index)
+
+    def on_order_fulfilled(self, order):
+        self._update_time(order.entry_time)
+        if self.open_positions_count == 0:
+            self.exposure_start_time = order.entry_time
+        self.open_positions_count += 1
+
+    def on_order_closed(self, order, sideway_index):
+        close_time = order.close_time
+        profit = order.profit
+        self._update_time(close_time)
+
+        self.open_positions_count -= 1
+        if self.open_positions_count == 0:
+            self.exposure_time += close_time - self.exposure_start_time
+            self.exposure_start_time = None
+
+        self.closed_orders_count += 1
+        if profit > 0:
+            self.winning_orders_count += 1
+            self.gross_profit += profit
+        else:
+            self.gross_loss -= profit
+        self.holding_time += close_time - order.entry_time
+        sideway_profit = self.sideway_profits.setdefault(sideway_index, [0, 0])
+        sideway_profit[0] += profit
+        sideway_profit[1] += 1
+
+        self.equity += profit
+        self.peak_equity = max(self.peak_equity, self.equity)
+        self.max_drawdown = max(self.max_drawdown, self.peak_equity - self.equity)
+        point_time = close_time - close_time % self.resolution + self.resolution
+        if self.equity_curve and self.equity_curve[-1][0] == point_time:
+            self.equity_curve[-1][1] = self.equity
+        else:
+            self.equity_curve.append([point_time, self.equity])
+
+        self.equity_gauge.set(self.equity)
+        self.drawdown_gauge.set(self.max_drawdown)
+        self.win_rate_gauge.set(self.win_rate)
+
+    @property
+    def win_rate(self):
+        return self.winning_orders_count / self.closed_orders_count if self.closed_orders_count else None
+
+    @property
+    def profit_factor(self):
+        return self.gross_profit / self.gross_loss if self.gross_loss else None
+
+    def get_exposure(self):
+        """Share of the time between the first and the last event with an open position."""
+        if self.first_time is None or self.last_time == self.first_time:
+            return None
+        exposure_time = self.exposure_time
+        if self.exposure_start_time is not None:
+            exposure_time += self.last_time - self.exposure_start_time
+        return exposure_time / (self.last_time - self.first_time)
+
+    def to_dict(self):
+        return {
+            "equity": self.equity,
+            "max_drawdown": self.max_drawdown,
+            "closed_orders": self.closed_orders_count,
+            "win_rate": self.win_rate,
+            "profit_factor": self.profit_factor,
+            "average_holding_time": (
+                self.holding_time / self.closed_orders_count if self.closed_orders_count else None
+            ),
+            "exposure": self.get_exposure(),
+            "open_positions": self.open_positions_count,
+            "sideways": [
+                {"sideway": sideway_index, "profit": profit, "closed_orders": closed_orders_count}
+                for sideway_index, (profit, closed_orders_count) in self.sideway_profits.items()
+            ],
+            "equity_curve_resolution": self.resolution,
+            "equity_curve": self.equity_curve,
+        }
@@ -0,0 +1,92 @@
+import json
+import time
+
+from src.analyzer import PriceAnalyzer
+from src.clock import SimulatedClock
+from src.dispatcher import KLINE_DECISION_LATENCY, REAL_TIME_CLOSE_DELAY, Dispatcher
+from src.kline_manager import InMemoryKlineManager
+from src.trader import Trader
+from utils import logger, serialize_object
+
+
+class ReplayKlineManager:
+    """
+    Stored klines seen through a simulated clock: only the klines closed at the clock time are returned,
+    so the real time path can't look ahead, and nothing is fetched from binance.
+    """
+
+    def __init__(self, kline_manager, clock):
+        self.kline_manager = kline_manager
+        self.clock = clock
+        self.time_step = kline_manager.time_step
+
+    def find_or_fetch_klines_in_range(self, start_time, end_time):
+        klines = self.kline_manager.find_or_fetch_klines_in_range(start_time, min(end_time, self.clock.now()))
+        current_time = self.clock.now()
+        return [kline for kline in klines if kline["closeTime"] < current_time]
+
+
+def load_replay_klines(kline_manager, start_time, end_time):
+    """Kline manager over the stored klines of the range, read once from the database."""
+    klines = kline_manager.find_or_fetch_stored_klines_in_range(start_time, end_time)
+    return InMemoryKlineManager.from_klines(kline_manager.symbol, klines, kline_manager.interval)
+
+
+def replay(dispatcher, kline_manager, start_time, end_time, speed=None):
+    """
+    Run the real time monitoring of the dispatcher over the stored klines from start_time to end_time
+    with a simulated clock, `speed` times faster than real time or unthrottled without it.
+    Returns the analyzed klines, the orders and the replay stats.
+    """
+    # the first replayed kline is the first one starting from start_time, the clock starts after its close
+    first_kline_start_time = start_time + (-start_time % kline_manager.time_step)
+    clock = SimulatedClock(first_kline_start_time + kline_manager.time_step + REAL_TIME_CLOSE_DELAY, speed)
+    dispatcher.kline_manager = ReplayKlineManager(kline_manager, clock)
+
+    KLINE_DECISION_LATENCY.reset()
+    replay_start_time = time.perf_counter()
+    analyzed_klines, orders = dispatcher.real_time_monitoring(clock, stop_time=end_time)
+    duration = time.perf_counter() - replay_start_time
+    dispatcher.kline_manager = kline_manager
+
+    stats = {
+        "klines": len(analyzed_klines),
+        "duration_seconds": duration,
+        "klines_per_second": len(analyzed_klines) / duration if duration else None,
+        "decision_latency": KLINE_DECISION_LATENCY.to_dict(),
+    }
+    logger.info(f"Replay of {len(analyzed_klines)} klines: {stats['klines_per_second']} klines/s")
+    return analyzed_klines, orders, stats
+
+
+def check_replay(config, kline_manager, start_time, end_time, speed=None):
+    """
+    Replay the range through the real time path and compare its decisions
+    with run_for_historical_data of a new analyzer and trader on the same klines.
+    """
+    def create_dispatcher():
+        analyzer = PriceAnalyzer(
+            config.get('time_window'),
+            config.get('growth_percent'),
+            config.get('drop_percent'),
+            kline_manager.time_step,
+        )
+        dispatcher = Dispatcher(analyzer, Trader(), kline_manager)
+        dispatcher.set_time_interval(start_time, end_time)
+        return dispatcher
+
+    replay_klines, replay_orders, stats = replay(create_dispatcher(), kline_manager, start_time, end_time, speed)
+    historical_klines, historical_orders = create_dispatcher().run_for_historical_data()
+
+    # compared as saved to the results file
+    replay_results = json.dumps({"klines": replay_klines, "orders": replay_orders}, default=serialize_object)
+    historical_results = json.dumps({"klines": historical_klines, "orders": historical_orders}, default=serialize_object)
+    stats["matches_historical"] = replay_results == historical_results
+    if stats["matches_historical"]:
+        logger.info("Replay decisions match the historical run")
+    else:
+        logger.error(
+            f"Replay decisions differ from the historical run: {len(replay_klines)} replayed klines and "
+            f"{len(replay_orders)} orders, {len(historical_klines)} historical klines and {len(historical_orders)} orders"
+        )
+    return replay_klines, replay_orders, stats
@@ -0,0 +1,91 @@
+from src.core import TIME_STEP
+
+SUM_FIELDS = (
+    "volume",
+    "quoteAssetVolume",
+    "numberOfTrades",
+    "takerBuyBaseAssetVolume",
+    "takerBuyQuoteAssetVolume",
+)
+
+
+def get_bucket_start(time, time_step):
+    return time - time % time_step
+
+
+def aggregate_klines(klines, bucket_start, time_step):
+    """Merge the klines of one bucket (sorted by startTime) into a single kline."""
+    kline = {
+        "startTime": bucket_start,
+        "open": klines[0]["open"],
+        "high": max(kline["high"] for kline in klines),
+        "low": min(kline["low"] for kline in klines),
+        "close": klines[-1]["close"],
+        "closeTime": bucket_start + time_step - 1,
+    }
+    for field in SUM_FIELDS:
+        kline[field] = sum(base_kline.get(field, 0) for base_kline in klines)
+    return kline
+
+
+def resample_klines(klines, time_step):
+    """Aggregate klines sorted by startTime into klines of a bigger time_step."""
+    resampled_klines = []
+    bucket_klines = []
+    bucket_start = None
+    for kline in klines:
+        kline_bucket_start = get_bucket_start(kline["startTime"], time_step)
+        if kline_bucket_start != bucket_start and bucket_klines:
+            resampled_klines.append(aggregate_klines(bucket_klines, bucket_start, time_step))
+            bucket_klines = []
+        bucket_start = kline_bucket_start
+        bucket_klines.append(kline)
+
+    if bucket_klines:
+        resampled_klines.append(aggregate_klines(bucket_klines, bucket_start, time_step))
+    return resampled_klines
+
+
+class KlineResampler:
+    """
+    Builds klines of a bigger timeframe from stored klines and caches them by bucket start time.
+    Only complete buckets are returned, so the analyzer never sees a candle that is still forming.
+    """
+
+    def __init__(self, time_step, base_time_step=TIME_STEP):
+        self.time_step = time_step
+        self.base_time_step = base_time_step
+        self.cache = {}  # bucket start time -> kline, None for buckets without stored klines
+
+    def get_missing_bucket_ranges(self, first_bucket, end_bucket):
+        ranges = []
+        for bucket_start in range(first_bucket, end_bucket, self.time_step):
+            if bucket_start in self.cache:
+                continue
+            if ranges and ranges[-1][1] == bucket_start:
+                ranges[-1][1] = bucket_start + self.time_step
+            else:
+                ranges.append([bucket_start, bucket_start + self.time_step])
+        return ranges
+
+    def get_klines_in_range(self, start_time, end_time, find_base_klines_in_range):
+        """
+        Returns the resampled klines with startTime in [start_time, end_time).
+        find_base_klines_in_range(start_time, end_time) is called only for buckets missing in the cache.
+        """
+        first_bucket = get_bucket_start(start_time + self.time_step - 1, self.time_step)
+        end_bucket = get_bucket_start(end_time, self.time_step)
+
+        for range_start, range_end in self.get_missing_bucket_ranges(first_bucket, end_bucket):
+            base_klines = sorted(find_base_klines_in_range(range_start, range_end), key=lambda kline: kline["startTime"])
+            for bucket_start in range(range_start, range_end, self.time_step):
+                self.cache[bucket_start] = None
+            for kline in resample_klines(base_klines, self.time_step):
+                self.cache[kline["startTime"]] = kline
+
+        klines = []
+        for bucket_start in range(first_bucket, end_bucket, self.time_step):
+            kline = self.cache[bucket_start]
+            if kline is not None:
+                klines.append(kline)
+        return klines
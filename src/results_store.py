@@ -0,0 +1,145 @@
+from datetime import datetime
+
+from src.clients import ensure_index, get_mongo_client
+from src.trader import OrderStatus
+from utils import logger
+
+RUNS_COLLECTION_NAME = "runs"
+ORDERS_COLLECTION_NAME = "run_orders"
+EVENTS_COLLECTION_NAME = "run_events"
+COUNTERS_COLLECTION_NAME = "counters"
+
+
+class ResultsStore:
+    """
+    Results of the historical runs in MongoDB: a document per run with its symbol, parameters,
+    time range and profit, and the orders and analyzer events of the run in their own collections.
+    Run ids are taken from a counter document incremented atomically, so parallel runs get different ids.
+    """
+
+    def __init__(self, mongo_uri, db_name):
+        self.db = get_mongo_client(mongo_uri)[db_name]
+        self.runs = self.db[RUNS_COLLECTION_NAME]
+        self.orders = self.db[ORDERS_COLLECTION_NAME]
+        self.events = self.db[EVENTS_COLLECTION_NAME]
+        self.counters = self.db[COUNTERS_COLLECTION_NAME]
+        # equality on symbol, then the sort on profit, then the range on time, as the top runs query
+        ensure_index(self.runs, [("symbol", 1), ("profit", -1), ("start_time", 1)])
+        ensure_index(self.runs, [
+            ("symbol", 1), ("parameters.time_window", 1), ("parameters.growth_percent", 1),
+            ("parameters.drop_percent", 1), ("start_time", 1),
+        ])
+        ensure_index(self.runs, [("created_at", -1)])
+        ensure_index(self.orders, [("run_id", 1), ("entry_time", 1)])
+        ensure_index(self.events, [("run_id", 1), ("time", 1)])
+
+    def get_next_run_id(self):
+        from pymongo import ReturnDocument
+
+        counter = self.counters.find_one_and_update(
+            {"_id": RUNS_COLLECTION_NAME},
+            {"$inc": {"value": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["value"]
+
+    def save_run(self, symbol, interval, parameters, start_time, end_time, trader, analyzed_klines):
+        """Save the run, its orders and analyzer events, returns the run id."""
+        run_id = self.get_next_run_id()
+        orders = trader.flat_orders
+        closed_orders = [order for order in orders if order.status == OrderStatus.CLOSED]
+
+        if orders:
+            self.orders.insert_many([
+                {
+                    "run_id": run_id,
+                    "type": order.type.value,
+                    "status": order.status.value,
+                    "entry_price": order.entry_price,
+                    "stop_price": order.stop_price,
+                    "take_profit_price": order.take_profit_price,
+                    "entry_time": order.entry_time,
+                    "close_time": order.close_time,
+                    "close_price": order.close_price,
+                    "profit": order.profit,
+                }
+                for order in orders
+            ], ordered=False)
+        events = [
+            {"run_id": run_id, "status": kline["status"], "time": kline["time"], "price": kline["price"]}
+            for kline in analyzed_klines
+            if kline.get("status")
+        ]
+        if events:
+            self.events.insert_many(events, ordered=False)
+
+        # the run document is written last, a run found by the queries has its orders and events
+        self.runs.insert_one({
+            "_id": run_id,
+            "symbol": symbol,
+            "interval": interval,
+            "parameters": parameters,
+            "start_time": start_time,
+            "end_time": end_time,
+            "created_at": datetime.now(),
+            "profit": trader.total_profit,
+            "orders_count": len(orders),
+            "closed_orders_count": len(closed_orders),
+            "successful_orders_count": trader.successful_orders_count,
+            "failed_orders_count": trader.failed_orders_count,
+            "sideways_count": len(trader.sideways_orders),
+            **self.get_performance_fields(trader),
+        })
+        logger.info(f"Run {run_id} saved to the results store")
+        return run_id
+
+    def get_performance_fields(self, trader):
+        if trader.performance is None:
+            return {}
+        return {
+            "max_drawdown": trader.performance.max_drawdown,
+            "win_rate": trader.performance.win_rate,
+            "profit_factor": trader.performance.profit_factor,
+        }
+
+    def get_run(self, run_id):
+        """The run with its orders and events."""
+        run = self.runs.find_one({"_id": run_id})
+        if run is None:
+            return None
+        run["orders"] = list(self.orders.find({"run_id": run_id}, {"_id": 0, "run_id": 0}).sort("entry_time", 1))
+        run["events"] = list(self.events.find({"run_id": run_id}, {"_id": 0, "run_id": 0}).sort("time", 1))
+        return run
+
+    def top_runs(self, symbol, start_time=None, end_time=None, limit=20):
+        """Most profitable runs of the symbol inside the time range."""
+        return list(
+            self.runs.find(self.get_runs_filter(symbol, start_time, end_time))
+            .sort("profit", -1)
+            .limit(limit)
+        )
+
+    def top_configs(self, symbol, start_time=None, end_time=None, limit=20):
+        """Parameter sets of the symbol by their most profitable run inside the time range."""
+        return list(self.runs.aggregate([
+            {"$match": self.get_runs_filter(symbol, start_time, end_time)},
+            {"$sort": {"profit": -1}},
+            {"$group": {
+                "_id": "$parameters",
+                "run_id": {"$first": "$_id"},
+                "profit": {"$first": "$profit"},
+                "runs_count": {"$sum": 1},
+                "average_profit": {"$avg": "$profit"},
+            }},
+            {"$sort": {"profit": -1}},
+            {"$limit": limit},
+        ]))
+
+    def get_runs_filter(self, symbol, start_time, end_time):
+        runs_filter = {"symbol": symbol}
+        if start_time is not None:
+            runs_filter["start_time"] = {"$gte": start_time}
+        if end_time is not None:
+            runs_filter["end_time"] = {"$lte": end_time}
+        return runs_filter
@@ -0,0 +1,267 @@
+import logging
+import random
+import statistics
+from multiprocessing import Pool
+
+import numpy as np
+
+from src.analyzer import PriceAnalyzer
+from src.dispatcher import Dispatcher
+from src.kline_manager import InMemoryKlineManager
+from src.shared_klines import ColumnKlines, SharedKlineManager, SharedKlines
+from src.trader import OrderStatus, Trader
+from utils import configure_logging
+
+MONTH_TIME = 30 * 24 * 60 * 60 * 1000  # walk-forward windows use 30 day months
+HOUR_TIME = 60 * 60 * 1000
+PERCENTILES = (5, 25, 50, 75, 95)
+SYMBOL = "ROBUSTNESS"
+
+# set in every worker process by init_worker, attached to the klines published by the engine
+worker_kline_manager = None
+
+
+def init_worker(descriptor, interval):
+    global worker_kline_manager
+
+    worker_kline_manager = SharedKlineManager.attach(SYMBOL, descriptor, interval)
+    # the order logs of thousands of runs are not needed, the results are aggregated; the queue handler
+    # inherited from the parent is replaced, its listener thread doesn't run in the forked worker
+    configure_logging(level=logging.WARNING, log_to_file=False)
+
+
+def get_max_drawdown(profits):
+    """Largest drop of the cumulative profit from its previous peak."""
+    cumulative_profit = 0
+    peak = 0
+    max_drawdown = 0
+    for profit in profits:
+        cumulative_profit += profit
+        peak = max(peak, cumulative_profit)
+        max_drawdown = max(max_drawdown, peak - cumulative_profit)
+    return max_drawdown
+
+
+def summarize(values):
+    """Distribution of the values: mean, standard deviation, min, max and percentiles."""
+    if not values:
+        return None
+    summary = {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "std": statistics.pstdev(values),
+        "min": min(values),
+        "max": max(values),
+    }
+    if len(values) > 1:
+        quantiles = statistics.quantiles(values, n=100, method="inclusive")
+        summary.update({f"p{percentile}": quantiles[percentile - 1] for percentile in PERCENTILES})
+    return summary
+
+
+def run_strategy(kline_manager, parameters, start_time, end_time):
+    """Historical run of one parameter set, returns its profit, drawdown and closed order profits."""
+    time_window, growth_percent, drop_percent = parameters
+    trader = Trader()
+    dispatcher = Dispatcher(
+        PriceAnalyzer(time_window, growth_percent, drop_percent, kline_manager.time_step),
+        trader,
+        kline_manager,
+    )
+    dispatcher.set_time_interval(start_time, end_time)
+    dispatcher.run_two_pass_for_historical_data()
+
+    closed_orders = sorted(
+        (order for order in trader.flat_orders if order.status == OrderStatus.CLOSED),
+        key=lambda order: order.close_time,
+    )
+    profits = [order.profit for order in closed_orders]
+    return {
+        "parameters": parameters,
+        "profit": sum(profits),
+        "max_drawdown": get_max_drawdown(profits),
+        "orders": len(profits),
+        "profits": profits,
+    }
+
+
+def bootstrap_klines(columns, block_klines_count, random_generator, time_step):
+    """
+    Kline columns of the same length built from random blocks of the kline columns.
+    The prices of a block are scaled to start at the close of the previous block,
+    and the times are continuous from the start time of the klines.
+    Only the block starts are drawn here, the columns are gathered by index.
+    """
+    klines_count = len(columns["startTime"])
+    open_prices = columns["open"]
+    close_prices = columns["close"]
+    block_indexes = []
+    block_scales = []
+    sample_count = 0
+    close_price = float(open_prices[0])
+    while sample_count < klines_count:
+        block_start = random_generator.randrange(max(1, klines_count - block_klines_count + 1))
+        block_end = min(block_start + block_klines_count, klines_count, block_start + klines_count - sample_count)
+        scale = close_price / float(open_prices[block_start])
+        block_indexes.append(np.arange(block_start, block_end))
+        block_scales.append(np.full(block_end - block_start, scale))
+        sample_count += block_end - block_start
+        close_price = float(close_prices[block_end - 1]) * scale
+
+    indexes = np.concatenate(block_indexes)
+    scales = np.concatenate(block_scales)
+    sample = {name: column[indexes] for name, column in columns.items()}
+    for name in ("open", "high", "low", "close"):
+        sample[name] = sample[name] * scales
+    start_time = int(columns["startTime"][0])
+    sample["startTime"] = start_time + np.arange(klines_count, dtype=np.int64) * time_step
+    sample["closeTime"] = sample["startTime"] + (time_step - 1)
+    return sample
+
+
+def run_range_task(task):
+    parameters, start_time, end_time = task
+    return run_strategy(worker_kline_manager, parameters, start_time, end_time)
+
+
+def run_bootstrap_task(task):
+    parameters_sets, seed, block_klines_count, analysis_start_offset = task
+    time_step = worker_kline_manager.storage_time_step
+    sample = bootstrap_klines(
+        worker_kline_manager.shared_klines.columns, block_klines_count, random.Random(seed), time_step
+    )
+    sample_kline_manager = SharedKlineManager(SYMBOL, ColumnKlines(sample), worker_kline_manager.interval)
+    start_time = int(sample["startTime"][0]) + analysis_start_offset
+    end_time = int(sample["startTime"][-1]) + time_step
+    results = []
+    for parameters in parameters_sets:
+        result = run_strategy(sample_kline_manager, parameters, start_time, end_time)
+        result["seed"] = seed
+        results.append(result)
+    return results
+
+
+class RobustnessEngine:
+    """
+    Walk-forward and Monte Carlo evaluation of parameter sets (time_window, growth_percent, drop_percent)
+    over the klines of one symbol. The runs are spread over a process pool, the klines are published once
+    to shared memory and the workers read them without copies.
+    covered_range is the (start_time, end_time) the klines were loaded for, the workers don't fetch
+    the klines missing inside it, as the gaps binance has no klines for.
+    """
+
+    def __init__(self, klines, interval, parameter_sets, processes=None, covered_range=None):
+        self.klines = klines
+        self.covered_range = covered_range
+        self.interval = interval
+        self.time_step = InMemoryKlineManager(SYMBOL, interval).storage_time_step
+        self.parameter_sets = [tuple(parameters) for parameters in parameter_sets]
+        self.max_window_time = max(parameters[0] for parameters in self.parameter_sets) * HOUR_TIME
+        self.processes = processes
+
+    def __enter__(self):
+        self.shared_klines = SharedKlines.publish(self.klines, self.covered_range)
+        self.pool = Pool(
+            self.processes, initializer=init_worker, initargs=(self.shared_klines.descriptor, self.interval)
+        )
+        return self
+
+    def __exit__(self, *args):
+        self.pool.close()
+        self.pool.join()
+        self.shared_klines.close()
+
+    def get_walk_forward_windows(self, start_time, end_time, train_months, test_months):
+        """(train_start, test_start, test_end) of the windows, moved forward by the test period."""
+        windows = []
+        train_start = start_time
+        while True:
+            test_start = train_start + train_months * MONTH_TIME
+            test_end = test_start + test_months * MONTH_TIME
+            if test_end > end_time:
+                break
+            windows.append((train_start, test_start, test_end))
+            train_start += test_months * MONTH_TIME
+        return windows
+
+    def walk_forward(self, start_time, end_time, train_months, test_months):
+        """
+        Optimize on train_months by profit and test the best parameters on the following test_months.
+        Returns the windows and the distribution of the out-of-sample profit.
+        """
+        windows = self.get_walk_forward_windows(start_time, end_time, train_months, test_months)
+        train_tasks = [
+            (parameters, train_start, test_start)
+            for train_start, test_start, _ in windows
+            for parameters in self.parameter_sets
+        ]
+        train_results = self.pool.map(run_range_task, train_tasks)
+
+        best_results = []
+        for window_index in range(len(windows)):
+            window_results = train_results[window_index * len(self.parameter_sets):(window_index + 1) * len(self.parameter_sets)]
+            best_results.append(max(window_results, key=lambda result: result["profit"]))
+        test_tasks = [
+            (best_result["parameters"], test_start, test_end)
+            for best_result, (_, test_start, test_end) in zip(best_results, windows)
+        ]
+        test_results = self.pool.map(run_range_task, test_tasks)
+
+        out_of_sample_profits = []
+        window_summaries = []
+        for (train_start, test_start, test_end), best_result, test_result in zip(windows, best_results, test_results):
+            out_of_sample_profits += test_result["profits"]
+            window_summaries.append({
+                "train_start": train_start,
+                "test_start": test_start,
+                "test_end": test_end,
+                "parameters": best_result["parameters"],
+                "train_profit": best_result["profit"],
+                "test_profit": test_result["profit"],
+                "test_max_drawdown": test_result["max_drawdown"],
+                "test_orders": test_result["orders"],
+            })
+        return {
+            "windows": window_summaries,
+            "test_profit": summarize([window["test_profit"] for window in window_summaries]),
+            "test_max_drawdown": summarize([window["test_max_drawdown"] for window in window_summaries]),
+            "out_of_sample_profit": sum(out_of_sample_profits),
+            "out_of_sample_max_drawdown": get_max_drawdown(out_of_sample_profits),
+            "out_of_sample_profits": out_of_sample_profits,
+        }
+
+    def bootstrap(self, samples, block_hours, seed=0):
+        """Run every parameter set on block-bootstrapped klines, returns the profit and drawdown distributions."""
+        block_klines_count = max(1, block_hours * HOUR_TIME // self.time_step)
+        tasks = [
+            (self.parameter_sets, seed + sample_index, block_klines_count, self.max_window_time)
+            for sample_index in range(samples)
+        ]
+        results_by_parameters = {parameters: [] for parameters in self.parameter_sets}
+        for sample_results in self.pool.imap_unordered(run_bootstrap_task, tasks):
+            for result in sample_results:
+                results_by_parameters[result["parameters"]].append(result)
+        return [
+            {
+                "parameters": parameters,
+                "profit": summarize([result["profit"] for result in results]),
+                "max_drawdown": summarize([result["max_drawdown"] for result in results]),
+                "orders": summarize([result["orders"] for result in results]),
+            }
+            for parameters, results in results_by_parameters.items()
+        ]
+
+    def run_full_range(self, start_time, end_time):
+        tasks = [(parameters, start_time, end_time) for parameters in self.parameter_sets]
+        return self.pool.map(run_range_task, tasks)
+
+
+def shuffle_orders(profits, shuffles, seed=0):
+    """Distribution of the max drawdown over random orders of the same closed order profits."""
+    random_generator = random.Random(seed)
+    profits = list(profits)
+    drawdowns = []
+    for _ in range(shuffles):
+        random_generator.shuffle(profits)
+        drawdowns.append(get_max_drawdown(profits))
+    return {"max_drawdown": summarize(drawdowns), "profit": sum(profits)}
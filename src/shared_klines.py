@@ -0,0 +1,212 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src.kline_manager import KLINES_LOADED_COUNTER, InMemoryKlineManager
+
+# kline document fields and the dtypes of their columns
+COLUMNS = (
+    ("startTime", np.int64),
+    ("open", np.float64),
+    ("high", np.float64),
+    ("low", np.float64),
+    ("close", np.float64),
+    ("volume", np.float64),
+    ("closeTime", np.int64),
+    ("quoteAssetVolume", np.float64),
+    ("numberOfTrades", np.int64),
+    ("takerBuyBaseAssetVolume", np.float64),
+    ("takerBuyQuoteAssetVolume", np.float64),
+    ("ignore", np.float64),
+)
+COLUMN_NAMES = tuple(name for name, _ in COLUMNS)
+CHUNK_KLINES = 1000  # kline documents built from the columns at once, only the last chunk is kept
+
+
+def open_shared_memory(name):
+    """
+    Attach to an existing block without registering it in the resource tracker, only the publisher unlinks it.
+    Before python 3.13 the registration can't be skipped, the pool workers share the resource tracker
+    of the publisher and registering the same block again has no effect.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+class KlineColumnsView:
+    """
+    Read-only sequence of the klines of an index range of kline columns. The kline documents are built
+    by chunks when they are accessed, so a run over the whole range doesn't hold a copy of every kline,
+    and get_column gives a field of all the klines without building the documents.
+    """
+
+    def __init__(self, columns, start_index, end_index):
+        self.columns = columns
+        self.start_index = start_index
+        self.end_index = end_index
+        self.chunk_start = None
+        self.chunk = []
+
+    def __len__(self):
+        return self.end_index - self.start_index
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[item_index] for item_index in range(start, stop, step)]
+            return KlineColumnsView(self.columns, self.start_index + start, self.start_index + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("kline index out of range")
+        chunk_start = index - index % CHUNK_KLINES
+        if chunk_start != self.chunk_start:
+            self.chunk = self.get_chunk(chunk_start)
+            self.chunk_start = chunk_start
+        return self.chunk[index - chunk_start]
+
+    def get_chunk(self, chunk_start):
+        start_index = self.start_index + chunk_start
+        end_index = min(start_index + CHUNK_KLINES, self.end_index)
+        rows = zip(*(self.columns[name][start_index:end_index].tolist() for name in COLUMN_NAMES))
+        return [dict(zip(COLUMN_NAMES, row)) for row in rows]
+
+    def __iter__(self):
+        for chunk_start in range(0, len(self), CHUNK_KLINES):
+            yield from self.get_chunk(chunk_start)
+
+    def get_column(self, name):
+        return self.columns[name][self.start_index:self.end_index].tolist()
+
+
+class ColumnKlines:
+    """Kline columns of one symbol in NumPy arrays of this process, as the bootstrap samples."""
+
+    def __init__(self, columns, descriptor=None):
+        self.columns = columns
+        self.descriptor = descriptor or {"count": len(columns["startTime"])}
+
+    def __len__(self):
+        return self.descriptor["count"]
+
+    def get_klines(self, start_index, end_index):
+        """Klines of the index range, their documents are built on access."""
+        return KlineColumnsView(self.columns, start_index, end_index)
+
+    def close(self):
+        self.columns = {}
+
+
+class SharedKlines(ColumnKlines):
+    """
+    Kline columns of one symbol in a shared memory block: the publishing process writes them once,
+    the workers attach with the descriptor and read them as read-only NumPy views, without copies.
+    The publisher unlinks the block with close() when the workers are done.
+    """
+
+    def __init__(self, block, descriptor, is_owner):
+        self.block = block
+        self.descriptor = descriptor
+        self.is_owner = is_owner
+        self.columns = {}
+        count = descriptor["count"]
+        offset = 0
+        for name, dtype in COLUMNS:
+            column = np.ndarray(count, dtype=dtype, buffer=block.buf, offset=offset)
+            if not is_owner:
+                column.flags.writeable = False
+            self.columns[name] = column
+            offset += count * np.dtype(dtype).itemsize
+
+    @classmethod
+    def publish(cls, klines, covered_range=None):
+        """
+        Copy the klines, sorted by startTime, to a new shared memory block.
+        covered_range is the (start_time, end_time) the klines were fully loaded for,
+        the workers don't look for klines missing inside it.
+        """
+        size = max(1, len(klines) * sum(np.dtype(dtype).itemsize for _, dtype in COLUMNS))
+        block = shared_memory.SharedMemory(create=True, size=size)
+        descriptor = {"name": block.name, "count": len(klines), "covered_range": covered_range}
+        shared_klines = cls(block, descriptor, is_owner=True)
+        for name, column in shared_klines.columns.items():
+            column[:] = [kline[name] for kline in klines]
+        return shared_klines
+
+    @classmethod
+    def attach(cls, descriptor):
+        return cls(open_shared_memory(descriptor["name"]), descriptor, is_owner=False)
+
+    def close(self):
+        # the views must be released before the block is closed
+        self.columns = {}
+        self.block.close()
+        if self.is_owner:
+            self.block.unlink()
+
+
+class SharedKlineManager(InMemoryKlineManager):
+    """
+    Kline manager of a worker over published shared klines, or over the ColumnKlines of this process.
+    Nothing is read from MongoDB or binance, the requested ranges are views over the columns
+    and the kline documents are built when they are accessed.
+    """
+
+    def __init__(self, symbol, shared_klines, interval="1m"):
+        super().__init__(symbol, interval)
+        self.shared_klines = shared_klines
+        self.start_times = shared_klines.columns["startTime"]
+        if len(shared_klines):
+            start_times = self.start_times.tolist()
+            # nothing is fetched: there are no klines before the first one
+            self.metadata.set_listing_time(start_times[0])
+            self.metadata.add_stored_klines(start_times)
+        if shared_klines.descriptor.get("covered_range"):
+            self.metadata.add_coverage(*shared_klines.descriptor["covered_range"])
+
+    @classmethod
+    def attach(cls, symbol, descriptor, interval="1m"):
+        return cls(symbol, SharedKlines.attach(descriptor), interval)
+
+    def close(self):
+        self.start_times = None
+        self.shared_klines.close()
+
+    def write_kline_documents(self, documents):
+        raise Exception("Shared klines are read-only")
+
+    def find_klines_in_range(self, start_time, end_time):
+        start_index = int(np.searchsorted(self.start_times, start_time))
+        end_index = int(np.searchsorted(self.start_times, end_time))
+        KLINES_LOADED_COUNTER.inc(end_index - start_index)
+        return self.shared_klines.get_klines(start_index, end_index)
+
+    def find_bucket_rows(self, start_time, end_time, bucket_time):
+        """Rows of kline_aggregates.get_bucket_rows computed over the columns with NumPy."""
+        start_index = int(np.searchsorted(self.start_times, start_time))
+        end_index = int(np.searchsorted(self.start_times, end_time))
+        if start_index == end_index:
+            return []
+        columns = {name: column[start_index:end_index] for name, column in self.shared_klines.columns.items()}
+        bucket_starts = columns["startTime"] - columns["startTime"] % bucket_time
+        first_indexes = np.flatnonzero(np.concatenate(([True], bucket_starts[1:] != bucket_starts[:-1])))
+        end_indexes = np.append(first_indexes[1:], end_index - start_index)
+        rows = zip(
+            bucket_starts[first_indexes].tolist(),
+            columns["open"][first_indexes].tolist(),
+            np.maximum.reduceat(columns["high"], first_indexes).tolist(),
+            np.minimum.reduceat(columns["low"], first_indexes).tolist(),
+            columns["close"][end_indexes - 1].tolist(),
+            np.add.reduceat(columns["volume"], first_indexes).tolist(),
+            (end_indexes - first_indexes).tolist(),
+        )
+        return [list(row) for row in rows]
+
+    def find_missing_klines_time(self, start_time, end_time):
+        start_index = int(np.searchsorted(self.start_times, start_time))
+        end_index = int(np.searchsorted(self.start_times, end_time))
+        available_times = set(self.start_times[start_index:end_index].tolist())
+        return sorted(set(range(start_time, end_time, self.storage_time_step)) - available_times)
@@ -0,0 +1,238 @@
+import os
+import socket
+import threading
+import time
+from uuid import uuid4
+
+from src.interval_set import IntervalSet
+from src.metrics import metrics
+from utils import convert_unix_full_date_str, logger
+
+FETCH_LOCKS_COLLECTION_NAME = "fetch_locks"
+FETCH_LOCK_SECONDS = 60  # a lock of a process that stopped is ignored after it, a fetching process extends it
+FETCH_LOCK_CHUNK_KLINES = 10 * 1000  # klines locked across processes at once, 10 binance requests
+FETCH_WAIT_SECONDS = 0.5  # polling of the locks of the other processes
+FETCH_ROUNDS = 3  # the parts left missing by the fetches of others are claimed again
+
+COALESCED_FETCHES_COUNTER = metrics.counter(
+    "coalesced_fetches_total", "Missing kline ranges served by the fetch of another thread or process"
+)
+
+flights = {}  # key -> flights of this process
+flights_process_id = None
+flights_lock = threading.Lock()
+
+
+class Flight:
+    """A range being fetched by a thread of this process."""
+
+    def __init__(self, start_time, end_time):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.done = threading.Event()
+
+
+def get_key_flights(key):
+    """Flights of the key, the flights inherited by a forked process are forgotten, their threads are not in it."""
+    global flights_process_id
+
+    if flights_process_id != os.getpid():
+        flights.clear()
+        flights_process_id = os.getpid()
+    return flights.setdefault(key, [])
+
+
+class FetchLock:
+    """
+    Ranges being fetched by the processes sharing the database, as [start, end) ranges with an owner
+    and an expiration in one document per kline collection. A range is added only if it overlaps
+    no other active one, in a single update.
+    """
+
+    def __init__(self, collection, key, lock_seconds=FETCH_LOCK_SECONDS):
+        self.collection = collection
+        self.key = key
+        self.lock_seconds = lock_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+    def get_overlap_filter(self, start_time, end_time, now):
+        return {"$elemMatch": {"start": {"$lt": end_time}, "end": {"$gt": start_time}, "expires_at": {"$gte": now}}}
+
+    def acquire(self, start_time, end_time):
+        """Lock the parts of [start_time, end_time) not locked by another process, returns them."""
+        from pymongo.errors import DuplicateKeyError
+
+        now = time.time()
+        self.collection.update_one({"_id": self.key}, {"$pull": {"ranges": {"expires_at": {"$lt": now}}}})
+        document = self.collection.find_one({"_id": self.key}) or {}
+        locked_ranges = IntervalSet(
+            (locked_range["start"], locked_range["end"]) for locked_range in document.get("ranges", [])
+        )
+        acquired_ranges = []
+        for part_start_time, part_end_time in locked_ranges.missing(start_time, end_time):
+            try:
+                # the document doesn't match if the range overlaps an active one, the upsert then fails on the _id
+                self.collection.update_one(
+                    {"_id": self.key, "ranges": {"$not": self.get_overlap_filter(part_start_time, part_end_time, now)}},
+                    {"$push": {"ranges": {
+                        "start": part_start_time,
+                        "end": part_end_time,
+                        "owner": self.owner,
+                        "expires_at": now + self.lock_seconds,
+                    }}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                continue  # locked by another process meanwhile
+            acquired_ranges.append((part_start_time, part_end_time))
+        return acquired_ranges
+
+    def extend(self, start_time, end_time):
+        """Push back the expiration of a range locked by this process, returns False if the lock expired."""
+        now = time.time()
+        result = self.collection.update_one(
+            {"_id": self.key, "ranges": {"$elemMatch": {
+                "owner": self.owner, "start": start_time, "end": end_time, "expires_at": {"$gte": now},
+            }}},
+            {"$set": {"ranges.$.expires_at": now + self.lock_seconds}},
+        )
+        return result.matched_count == 1
+
+    def release(self, start_time, end_time):
+        self.collection.update_one(
+            {"_id": self.key},
+            {"$pull": {"ranges": {"owner": self.owner, "start": start_time, "end": end_time}}},
+        )
+
+    def is_locked(self, start_time, end_time):
+        overlap_filter = self.get_overlap_filter(start_time, end_time, time.time())
+        return self.collection.count_documents({"_id": self.key, "ranges": overlap_filter}, limit=1) > 0
+
+    def wait(self, start_time, end_time):
+        while self.is_locked(start_time, end_time):
+            time.sleep(FETCH_WAIT_SECONDS)
+
+
+class FetchLockHeartbeat:
+    """Extends a range of the fetch lock from a background thread while it is fetched, three times per lock."""
+
+    def __init__(self, fetch_lock, start_time, end_time):
+        self.fetch_lock = fetch_lock
+        self.start_time = start_time
+        self.end_time = end_time
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.fetch_lock.lock_seconds / 3):
+            if not self.fetch_lock.extend(self.start_time, self.end_time):
+                logger.warning(
+                    f"Lock of the klines of {self.fetch_lock.key} from {convert_unix_full_date_str(self.start_time)} "
+                    f"to {convert_unix_full_date_str(self.end_time)} expired, another process can fetch them too"
+                )
+                return
+
+
+class SingleFlight:
+    """
+    Coalesces the fetches of the missing klines of one collection: a missing range is fetched once,
+    the threads of this process and the processes sharing the lock collection that need an overlapping
+    range wait for that fetch and read its klines from the database instead of requesting them again.
+    """
+
+    def __init__(self, key, time_step, lock_collection=None):
+        self.key = key
+        self.chunk_time = FETCH_LOCK_CHUNK_KLINES * time_step
+        self.fetch_lock = None
+        if lock_collection is not None:
+            self.fetch_lock = FetchLock(lock_collection, "_".join(map(str, key)))
+
+    def claim(self, start_time, end_time):
+        """Register the parts of [start_time, end_time) not fetched in this process, returns them and the flights to wait for."""
+        with flights_lock:
+            key_flights = get_key_flights(self.key)
+            fetched_ranges = IntervalSet((flight.start_time, flight.end_time) for flight in key_flights)
+            waited_flights = [
+                flight for flight in key_flights if flight.start_time < end_time and flight.end_time > start_time
+            ]
+            claimed_flights = [
+                Flight(part_start_time, part_end_time)
+                for part_start_time, part_end_time in fetched_ranges.missing(start_time, end_time)
+            ]
+            key_flights.extend(claimed_flights)
+        return claimed_flights, waited_flights
+
+    def finish(self, flight):
+        with flights_lock:
+            get_key_flights(self.key).remove(flight)
+        flight.done.set()
+
+    def fetch_flight(self, flight, fetch_range):
+        """Fetch the parts of the flight not locked by another process, returns the parts fetched by others."""
+        if self.fetch_lock is None:
+            fetch_range(flight.start_time, flight.end_time)
+            return []
+
+        waited_ranges = IntervalSet()
+        chunk_start_time = flight.start_time
+        while chunk_start_time < flight.end_time:
+            chunk_end_time = min(chunk_start_time + self.chunk_time, flight.end_time)
+            acquired_ranges = self.fetch_lock.acquire(chunk_start_time, chunk_end_time)
+            for part_start_time, part_end_time in acquired_ranges:
+                try:
+                    with FetchLockHeartbeat(self.fetch_lock, part_start_time, part_end_time):
+                        fetch_range(part_start_time, part_end_time)
+                finally:
+                    self.fetch_lock.release(part_start_time, part_end_time)
+            for part in IntervalSet(acquired_ranges).missing(chunk_start_time, chunk_end_time):
+                waited_ranges.add(*part)
+            chunk_start_time = chunk_end_time
+
+        for part_start_time, part_end_time in waited_ranges.to_list():
+            logger.info(
+                f"Waiting for another process fetching the klines of {self.key} "
+                f"from {convert_unix_full_date_str(part_start_time)} to {convert_unix_full_date_str(part_end_time)}"
+            )
+            self.fetch_lock.wait(part_start_time, part_end_time)
+        return waited_ranges.to_list()
+
+    def fetch(self, start_time, end_time, fetch_range, find_missing_ranges):
+        """
+        Fetch the missing [start_time, end_time) range with fetch_range(start, end), except the parts another
+        thread or process is fetching: they are waited for, and the parts they left missing, according to
+        find_missing_ranges(start, end), are claimed again.
+        """
+        pending_ranges = [(start_time, end_time)]
+        for _ in range(FETCH_ROUNDS):
+            waited_ranges = IntervalSet()
+            for pending_start_time, pending_end_time in pending_ranges:
+                claimed_flights, waited_flights = self.claim(pending_start_time, pending_end_time)
+                for flight in claimed_flights:
+                    try:
+                        for waited_range in self.fetch_flight(flight, fetch_range):
+                            waited_ranges.add(*waited_range)
+                    finally:
+                        self.finish(flight)
+                for flight in waited_flights:
+                    flight.done.wait()
+                    waited_ranges.add(
+                        max(flight.start_time, pending_start_time), min(flight.end_time, pending_end_time)
+                    )
+            if not waited_ranges:
+                return
+            COALESCED_FETCHES_COUNTER.inc(len(waited_ranges))
+
+            # the fetch of another caller can fail, its missing klines are fetched again
+            pending_ranges = []
+            for waited_start_time, waited_end_time in waited_ranges.to_list():
+                pending_ranges += find_missing_ranges(waited_start_time, waited_end_time)
+            if not pending_ranges:
+                return
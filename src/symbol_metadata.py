@@ -0,0 +1,168 @@
+from bisect import bisect_right
+
+from src.core import INTERVAL_TIME_STEPS
+from src.interval_set import IntervalSet
+
+METADATA_COLLECTION_NAME = "symbols_metadata"
+COMPACT_MIN_RANGES = 64  # the ranges pushed to a document are merged when there are more and twice the merged ones
+
+
+def merge_ranges(ranges):
+    """Merge overlapping or adjacent [start, end] ranges, returns them sorted."""
+    merged_ranges = []
+    for start, end in sorted(ranges):
+        if merged_ranges and start <= merged_ranges[-1][1] + 1:
+            merged_ranges[-1][1] = max(merged_ranges[-1][1], end)
+        else:
+            merged_ranges.append([start, end])
+    return merged_ranges
+
+
+class SymbolMetadata:
+    """
+    Metadata of the stored klines of one symbol and interval: listing time, earliest and latest
+    stored kline, the ranges binance has no klines for (gaps, as [start, end] kline start times)
+    and the coverage, [start, end) ranges in which every kline is stored or is in a gap.
+    The document is read once, lookups are local and changes are written through to MongoDB.
+    Several processes can store klines of the same symbol: the gaps and coverage ranges are pushed
+    to the document, never overwritten, and merged when they are read.
+    Without a collection the metadata is kept in memory only.
+    """
+
+    def __init__(self, symbol, interval, collection=None):
+        self.collection = collection
+        self.document_id = f"{symbol.lower()}_{interval}"
+        self.time_step = INTERVAL_TIME_STEPS[interval]
+        self.document = {"symbol": symbol, "interval": interval}
+        self.load()
+
+    def load(self):
+        stored_document = {}
+        if self.collection is not None:
+            stored_document = self.collection.find_one({"_id": self.document_id}) or {}
+        self.document = {"symbol": self.document["symbol"], "interval": self.document["interval"], **stored_document}
+        # number of ranges in the stored arrays, with the ones pushed by this process
+        self.stored_ranges_counts = {
+            "gaps": len(self.document.get("gaps", [])),
+            "coverage": len(self.document.get("coverage", [])),
+        }
+        self.document["gaps"] = merge_ranges(self.document.get("gaps", []))
+        self.gap_starts = [gap[0] for gap in self.document["gaps"]]
+        self.coverage = IntervalSet(self.document.get("coverage", []))
+
+    def reload(self):
+        """Read the document again, after another process changed it."""
+        if self.collection is not None:
+            self.load()
+
+    def _update(self, update):
+        if self.collection is not None:
+            self.collection.update_one({"_id": self.document_id}, update, upsert=True)
+
+    def _push_ranges(self, ranges_by_field, update=None):
+        """Append ranges to the stored arrays in one update with `update`, the ranges of other processes are kept."""
+        if self.collection is None:
+            return
+        self._update({
+            **(update or {}),
+            "$push": {field: {"$each": ranges} for field, ranges in ranges_by_field.items()},
+        })
+        for field, ranges in ranges_by_field.items():
+            self.stored_ranges_counts[field] += len(ranges)
+            merged_ranges_count = len(self.gaps) if field == "gaps" else len(self.coverage)
+            if self.stored_ranges_counts[field] > max(COMPACT_MIN_RANGES, 2 * merged_ranges_count):
+                self._compact(field)
+
+    def _compact(self, field):
+        """
+        Replace the stored array by its merged ranges. The array is replaced only if it didn't change
+        since it was read, a range pushed meanwhile by another process is merged by the next compaction.
+        """
+        stored_ranges = (self.collection.find_one({"_id": self.document_id}, {field: 1}) or {}).get(field, [])
+        if field == "gaps":
+            merged_ranges = merge_ranges(stored_ranges)
+        else:
+            merged_ranges = IntervalSet(stored_ranges).to_list()
+        self.collection.update_one({"_id": self.document_id, field: stored_ranges}, {"$set": {field: merged_ranges}})
+        self.stored_ranges_counts[field] = len(merged_ranges)
+
+    @property
+    def listing_time(self):
+        return self.document.get("listing_time")
+
+    @property
+    def earliest_kline_time(self):
+        return self.document.get("earliest_kline_time")
+
+    @property
+    def latest_kline_time(self):
+        return self.document.get("latest_kline_time")
+
+    @property
+    def gaps(self):
+        return self.document["gaps"]
+
+    def clear(self):
+        self.document = {"symbol": self.document["symbol"], "interval": self.document["interval"], "gaps": []}
+        self.gap_starts = []
+        self.coverage = IntervalSet()
+        self.stored_ranges_counts = {"gaps": 0, "coverage": 0}
+        if self.collection is not None:
+            self.collection.delete_one({"_id": self.document_id})
+
+    def set_listing_time(self, listing_time):
+        self.document["listing_time"] = listing_time
+        self._update({"$set": {"listing_time": listing_time}})
+
+    def add_stored_klines(self, start_times):
+        """Update the stored range and the coverage with the start times of saved klines."""
+        start_times = sorted(start_times)
+        first_kline_time = start_times[0]
+        last_kline_time = start_times[-1]
+        if self.earliest_kline_time is None or first_kline_time < self.earliest_kline_time:
+            self.document["earliest_kline_time"] = first_kline_time
+        if self.latest_kline_time is None or last_kline_time > self.latest_kline_time:
+            self.document["latest_kline_time"] = last_kline_time
+
+        # every run of consecutive klines is a covered range
+        covered_ranges = []
+        run_start_time = first_kline_time
+        for previous_time, kline_time in zip(start_times, start_times[1:]):
+            if kline_time - previous_time > self.time_step:
+                covered_ranges.append([run_start_time, previous_time + self.time_step])
+                run_start_time = kline_time
+        covered_ranges.append([run_start_time, last_kline_time + self.time_step])
+        for covered_range in covered_ranges:
+            self.coverage.add(*covered_range)
+
+        self._push_ranges(
+            {"coverage": covered_ranges},
+            {"$min": {"earliest_kline_time": first_kline_time}, "$max": {"latest_kline_time": last_kline_time}},
+        )
+
+    def add_coverage(self, start_time, end_time):
+        """Mark [start_time, end_time) as checked: every kline in it is stored or is in a gap."""
+        if self.coverage.contains(start_time, end_time):
+            return
+        self.coverage.add(start_time, end_time)
+        self._push_ranges({"coverage": [[start_time, end_time]]})
+
+    def get_uncovered_ranges(self, start_time, end_time):
+        """Parts of [start_time, end_time) after the listing that are not covered."""
+        if self.listing_time is not None:
+            start_time = max(start_time, self.listing_time)
+        return self.coverage.missing(start_time, end_time)
+
+    def add_gap(self, start_time, end_time):
+        """Remember that binance has no klines starting in [start_time, end_time]."""
+        self.document["gaps"] = merge_ranges(self.gaps + [[start_time, end_time]])
+        self.gap_starts = [gap[0] for gap in self.gaps]
+        self.coverage.add(start_time, end_time + self.time_step)
+        self._push_ranges({"gaps": [[start_time, end_time]], "coverage": [[start_time, end_time + self.time_step]]})
+
+    def is_known_missing(self, kline_time):
+        """Binance has no kline starting at this time: it is before the listing or in a known gap."""
+        if self.listing_time is not None and kline_time < self.listing_time:
+            return True
+        gap_index = bisect_right(self.gap_starts, kline_time) - 1
+        return gap_index >= 0 and kline_time <= self.gaps[gap_index][1]
@@ -0,0 +1,107 @@
+import random
+from math import exp, log
+
+from src.core import TIME_STEP
+
+HOUR = 60 * 60 * 1000  # one hour in unix
+DAY = 24 * HOUR
+PATTERNS = ("pump", "dump", "sideway")
+
+
+class SyntheticKlineGenerator:
+    """
+    Deterministic random walk klines in the binance API format, with injected patterns:
+    pump (fast growth), dump (fast drop) and sideway (price oscillating around one level).
+    The same seed always gives the same klines.
+    """
+
+    def __init__(
+        self,
+        seed=0,
+        start_price=100.0,
+        volatility=0.001,
+        patterns_per_day=0.2,
+        time_step=TIME_STEP,
+    ):
+        self.random = random.Random(seed)
+        self.price = start_price
+        self.volatility = volatility  # standard deviation of one kline log return
+        self.pattern_probability = patterns_per_day * time_step / DAY
+        self.time_step = time_step
+        self.pattern = None
+        self.pattern_klines_left = 0
+        self.pattern_drift = 0
+        self.sideway_price = None
+
+    def start_pattern(self):
+        self.pattern = self.random.choice(PATTERNS)
+        hour_klines_count = max(1, HOUR // self.time_step)
+        self.pattern_klines_left = hour_klines_count * self.random.randint(2, 12)
+        if self.pattern == "pump":
+            self.pattern_drift = log(1 + self.random.uniform(0.2, 0.6)) / self.pattern_klines_left
+        elif self.pattern == "dump":
+            self.pattern_drift = log(1 - self.random.uniform(0.1, 0.3)) / self.pattern_klines_left
+        else:
+            self.sideway_price = self.price
+
+    def next_log_return(self):
+        if self.pattern_klines_left == 0:
+            self.pattern = None
+            if self.random.random() < self.pattern_probability:
+                self.start_pattern()
+
+        log_return = self.random.gauss(0, self.volatility)
+        if self.pattern:
+            self.pattern_klines_left -= 1
+            if self.pattern == "sideway":
+                # pull the price back to the sideway level
+                log_return = log_return / 2 - 0.05 * log(self.price / self.sideway_price)
+            else:
+                log_return += self.pattern_drift
+        return log_return
+
+    def generate(self, start_time, klines_count):
+        klines = []
+        for index in range(klines_count):
+            open_price = self.price
+            close_price = open_price * exp(self.next_log_return())
+            high_price = max(open_price, close_price) * (1 + abs(self.random.gauss(0, self.volatility / 2)))
+            low_price = min(open_price, close_price) * (1 - abs(self.random.gauss(0, self.volatility / 2)))
+            volume = self.random.uniform(1, 100)
+            kline_start_time = start_time + index * self.time_step
+            klines.append([
+                kline_start_time,
+                f"{open_price:.8f}",
+                f"{high_price:.8f}",
+                f"{low_price:.8f}",
+                f"{close_price:.8f}",
+                f"{volume:.8f}",
+                kline_start_time + self.time_step - 1,
+                f"{volume * close_price:.8f}",
+                self.random.randint(10, 1000),
+                f"{volume / 2:.8f}",
+                f"{volume * close_price / 2:.8f}",
+                "0",
+            ])
+            self.price = close_price
+        return klines
+
+
+def generate_klines(start_time, klines_count, seed=0, **kwargs):
+    """Synthetic klines in the binance API format, see SyntheticKlineGenerator."""
+    return SyntheticKlineGenerator(seed=seed, **kwargs).generate(start_time, klines_count)
+
+
+def generate_trades(start_time, trades_count, seed=0, trade_interval=200, **kwargs):
+    """
+    Synthetic (time, price) trades: the random walk of SyntheticKlineGenerator with a step per trade
+    and exponentially distributed gaps of trade_interval ms on average.
+    """
+    generator = SyntheticKlineGenerator(seed=seed, time_step=trade_interval, **kwargs)
+    trades = []
+    trade_time = start_time
+    for _ in range(trades_count):
+        trade_time += max(1, int(generator.random.expovariate(1 / trade_interval)))
+        generator.price *= exp(generator.next_log_return())
+        trades.append((trade_time, generator.price))
+    return trades
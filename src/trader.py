@@ -1,10 +1,16 @@
+import logging
 from itertools import chain
 from math import sqrt
 from enum import Enum
-from utils import logger, convert_unix_full_date_str
+from src.metrics import metrics
+from utils import logger, convert_unix_full_date_str, log_event
 
 DEVIATION_PERCENTAGE = 0.05
 
+ORDERS_EVALUATED_COUNTER = metrics.counter("orders_evaluated_total", "Order evaluations against a kline")
+ORDERS_PLACED_COUNTER = metrics.counter("orders_placed_total", "Orders placed by the trader")
+SIDEWAYS_COUNTER = metrics.counter("sideways_total", "Sideways traded by the trader")
+
 
 class OrderStatus(Enum):
     OPEN = "open"
@@ -18,6 +24,28 @@ class OrderType(Enum):
     SHORT = "short"
 
 
+def get_sideway_height_deviation(high, low):
+    sideway_height = (high / low) - 1
+    deviation = DEVIATION_PERCENTAGE * sideway_height
+    return deviation, sideway_height
+
+
+def get_short_order_params(high, low):
+    deviation, sideway_height = get_sideway_height_deviation(high, low)
+    short_entry = high * (1 + deviation)
+    short_stop = high * (1 + sideway_height / 2)
+    short_take_profit = sqrt(low * high) - (DEVIATION_PERCENTAGE * sideway_height)
+    return short_entry, short_stop, short_take_profit
+
+
+def get_long_order_params(high, low):
+    deviation, sideway_height = get_sideway_height_deviation(high, low)
+    long_entry = low * (1 - deviation)
+    long_stop = low * (1 - sideway_height / 2)
+    long_take_profit = sqrt(low * high) - (DEVIATION_PERCENTAGE * sideway_height)
+    return long_entry, long_stop, long_take_profit
+
+
 class Order:
     def __init__(self, type, entry_price, stop_price, take_profit_price):
         self.type = type  # 'short' or 'long'
@@ -32,7 +60,7 @@ class Order:
     @property
     def profit(self):
         order_investment = 1000  # USDT
-        if self.status == OrderStatus.CANCELED or self.status == OrderStatus.OPEN:
+        if self.status != OrderStatus.CLOSED:  # fulfilled orders still open at the end of the analysis have no profit yet
             return 0
         if self.type == OrderType.LONG:
             return (self.close_price - self.entry_price) / self.entry_price * order_investment
@@ -95,6 +123,9 @@ class Order:
         return f"(entry: {self.entry_price}, stop: {self.stop_price}, take: {self.take_profit_price})"
 
     def log_order_fulfilled(self):
+        log_event("order_fulfilled", type=self.type.value, entry_price=self.entry_price, entry_time=self.entry_time)
+        if not logger.isEnabledFor(logging.INFO):
+            return
         order_info = self.get_info()
         logger.info(
             f"Order fulfilled: {order_info}, Entry Time: {convert_unix_full_date_str(self.entry_time)}"
@@ -109,8 +140,19 @@ class Order:
         return convert_unix_full_date_str(self.entry_time) if self.entry_time else "N/A"
 
     def log_order_closed(self):
-        order_info = self.get_info()
         status = "closed" if self.close_time and self.entry_time else "canceled"
+        log_event(
+            f"order_{status}",
+            type=self.type.value,
+            entry_price=self.entry_price,
+            close_price=self.close_price,
+            entry_time=self.entry_time,
+            close_time=self.close_time,
+            profit=self.profit,
+        )
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        order_info = self.get_info()
         logger.info(
             f"{self.type.value.capitalize()} order {status}: Profit: {self.profit}, {order_info}, Entry Time: {self.entry_time_str}, "
             f"Close Time: {self.close_time_str}"
@@ -118,10 +160,12 @@ class Order:
 
 
 class Trader:
-    def __init__(self):
+    def __init__(self, drill_down=None, performance=None):
         self.sideways_orders = []
         self.high = None
         self.low = None
+        self.drill_down = drill_down  # resolves the ambiguous candles with 1s klines
+        self.performance = performance  # PerformanceTracker updated by the orders
 
     @property
     def flat_orders(self):
@@ -153,6 +197,7 @@ class Trader:
     
     def add_sideway(self, high, low):
         self.sideways_orders.append([])
+        SIDEWAYS_COUNTER.inc()
 
         self.high = high
         self.low = low
@@ -162,23 +207,13 @@ class Trader:
         return short_order, long_order
 
     def get_sideway_height_deviation(self):
-        sideway_height = (self.high / self.low) - 1
-        deviation = DEVIATION_PERCENTAGE * sideway_height
-        return deviation, sideway_height
+        return get_sideway_height_deviation(self.high, self.low)
 
     def get_short_order_params(self):
-        deviation, sideway_height = self.get_sideway_height_deviation()
-        short_entry = self.high * (1 + deviation)
-        short_stop = self.high * (1 + sideway_height / 2)
-        short_take_profit = sqrt(self.low * self.high) - (DEVIATION_PERCENTAGE * sideway_height)
-        return short_entry, short_stop, short_take_profit
+        return get_short_order_params(self.high, self.low)
 
     def get_long_order_params(self):
-        deviation, sideway_height = self.get_sideway_height_deviation()
-        long_entry = self.low * (1 - deviation)
-        long_stop = self.low * (1 - sideway_height / 2)
-        long_take_profit = sqrt(self.low * self.high) - (DEVIATION_PERCENTAGE * sideway_height)
-        return long_entry, long_stop, long_take_profit
+        return get_long_order_params(self.high, self.low)
 
     def place_short_order(self):
         entry_price, stop_price, take_profit_price = (
@@ -186,6 +221,7 @@ class Trader:
         )
         order = Order(OrderType.SHORT, entry_price, stop_price, take_profit_price)
         self.current_sideway_orders.append(order)
+        ORDERS_PLACED_COUNTER.inc()
         return order
 
     def place_long_order(self):
@@ -194,6 +230,7 @@ class Trader:
         )
         order = Order(OrderType.LONG, entry_price, stop_price, take_profit_price)
         self.current_sideway_orders.append(order)
+        ORDERS_PLACED_COUNTER.inc()
         return order
 
     @property
@@ -210,15 +247,35 @@ class Trader:
         return any([order for order in self.current_sideway_orders if order.closed_by_stop])
 
     def cancel_opened_orders_in_sideway(self):
+        """Returns True if some order was canceled."""
+        canceled = False
         for order in self.current_sideway_orders:
             if order.status == OrderStatus.OPEN:
                 order.cancel()
                 order.log_order_closed()
+                canceled = True
+        return canceled
 
     def update_orders(self, kline):
+        ORDERS_EVALUATED_COUNTER.inc(len(self.current_sideway_orders))
         for order in self.current_sideway_orders:
-            order.evaluate(kline)
+            self.evaluate_order(order, kline)
+
+        self.apply_sideway_rules()
 
+    def evaluate_order(self, order, kline):
+        previous_status = order.status
+        if self.drill_down is None or not self.drill_down.evaluate(order, kline):
+            order.evaluate(kline)
+        if self.performance is not None and order.status != previous_status:
+            self.performance.on_order_changed(order, previous_status, len(self.sideways_orders) - 1)
+
+    def apply_sideway_rules(self):
+        """
+        Place again the orders closed by take profit, cancel the open orders after a stop or two closed orders.
+        Returns True if an order was placed or canceled.
+        """
+        orders_count = len(self.current_sideway_orders)
         for order in self.current_sideway_orders:
             if order.closed_by_take_profit and len(self.get_current_closed_orders) < 2 and len(self.current_open_or_fulfilled_orders) < 2:
                 if order.type == OrderType.LONG:
@@ -227,8 +284,10 @@ class Trader:
                     self.place_short_order()
         
         cancel_orders_condition = self.is_some_current_order_closed_by_stop() or len(self.get_current_closed_orders) >= 2
+        canceled = False
         if cancel_orders_condition:
-            self.cancel_opened_orders_in_sideway()
+            canceled = self.cancel_opened_orders_in_sideway()
+        return canceled or len(self.current_sideway_orders) > orders_count
 
     def log_order_summary(self):
         logger.info(
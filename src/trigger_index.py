@@ -0,0 +1,260 @@
+import heapq
+import time
+from collections import deque
+from itertools import count
+
+from src.core import prepare_kline_plot_data
+from src.metrics import metrics
+from src.trader import OrderStatus, OrderType
+from utils import logger
+
+ABOVE = "above"  # fires on a trade price at or above the level
+BELOW = "below"  # fires on a trade price at or below the level
+COMPACT_MIN_DEAD_TRIGGERS = 64  # the heaps are rebuilt when more than half of their triggers are removed
+
+TRADES_COUNTER = metrics.counter("trades_processed_total", "Trades checked against the trigger index")
+TRIGGERS_FIRED_COUNTER = metrics.counter("triggers_fired_total", "Order and analyzer triggers crossed by a trade")
+TRIGGER_LATENCY = metrics.histogram(
+    "trigger_action_seconds", "Duration from the crossing trade to the order change it causes"
+)
+
+
+class Trigger:
+    __slots__ = ("price", "direction", "kind", "order", "active")
+
+    def __init__(self, price, direction, kind, order=None):
+        self.price = price
+        self.direction = direction
+        self.kind = kind  # entry, take_profit, stop, high or mid
+        self.order = order
+        self.active = True
+
+
+class TriggerIndex:
+    """
+    Price levels of one symbol in two heaps: the lowest level above the price and the highest one below it
+    are on top, so a trade is compared with one level per direction unless it crosses some.
+    Removed triggers are only marked inactive and dropped when they reach the top.
+    """
+
+    def __init__(self):
+        self.above = []  # (price, sequence, trigger), min-heap
+        self.below = []  # (-price, sequence, trigger), max-heap by price
+        self.sequence = count()  # triggers with the same price fire in the order they were added
+        self.dead_count = 0
+
+    def __len__(self):
+        return len(self.above) + len(self.below) - self.dead_count
+
+    def add(self, price, direction, kind, order=None):
+        trigger = Trigger(price, direction, kind, order)
+        if direction == ABOVE:
+            heapq.heappush(self.above, (price, next(self.sequence), trigger))
+        else:
+            heapq.heappush(self.below, (-price, next(self.sequence), trigger))
+        return trigger
+
+    def remove(self, trigger):
+        if trigger.active:
+            trigger.active = False
+            self.dead_count += 1
+            if self.dead_count > COMPACT_MIN_DEAD_TRIGGERS and self.dead_count * 2 > len(self.above) + len(self.below):
+                self.compact()
+
+    def compact(self):
+        self.above = [item for item in self.above if item[2].active]
+        self.below = [item for item in self.below if item[2].active]
+        heapq.heapify(self.above)
+        heapq.heapify(self.below)
+        self.dead_count = 0
+
+    def pop_triggered(self, price):
+        """Remove and return the active triggers crossed by the trade price."""
+        triggered = []
+        while self.above and self.above[0][0] <= price:
+            trigger = heapq.heappop(self.above)[2]
+            self._collect(trigger, triggered)
+        while self.below and -self.below[0][0] >= price:
+            trigger = heapq.heappop(self.below)[2]
+            self._collect(trigger, triggered)
+        return triggered
+
+    def _collect(self, trigger, triggered):
+        if trigger.active:
+            trigger.active = False
+            triggered.append(trigger)
+        else:
+            self.dead_count -= 1
+
+
+def get_order_triggers(order):
+    """(price, direction, kind) of the levels the order waits for in its status."""
+    is_long = order.type == OrderType.LONG
+    if order.status == OrderStatus.OPEN:
+        return [(order.entry_price, BELOW if is_long else ABOVE, "entry")]
+    if order.status == OrderStatus.FULFILLED:
+        return [
+            (order.take_profit_price, ABOVE if is_long else BELOW, "take_profit"),
+            (order.stop_price, BELOW if is_long else ABOVE, "stop"),
+        ]
+    return []
+
+
+class TickMonitor:
+    """
+    Real time monitoring of one symbol from its trades. The orders of the trader are filled and closed
+    on the trade crossing their levels instead of the close of the kline, the analyzer still decides
+    on closed klines, which are built from the trades. The analyzer thresholds of the current kline,
+    the new high and the mid price, are in the index too: crossing them is reported to on_alert
+    before the kline close confirms the event.
+    """
+
+    def __init__(self, dispatcher, time_step, on_alert=None):
+        self.dispatcher = dispatcher
+        self.analyzer = dispatcher.analyzer
+        self.trader = dispatcher.trader
+        self.time_step = time_step
+        self.on_alert = on_alert
+        self.index = TriggerIndex()
+        self.order_triggers = {}  # order -> its active triggers
+        self.analyzer_trigger = None
+        self.window_lows = deque(maxlen=self.analyzer.snapshot_klines_count)
+        self.kline = None  # the kline of the current trades, not closed yet
+        self.is_trading_kline = False  # the trader had an active sideway during the current kline
+        self.analyzed_klines = []
+        self.orders = []
+
+    def add_history(self, klines):
+        """Closed klines before the first trade, they fill the window of the analyzer."""
+        for kline in klines:
+            self.window_lows.append(kline["low"])
+
+    def on_trade(self, trade_time, price):
+        """Process a trade, returns the triggers it fired."""
+        TRADES_COUNTER.inc()
+        if self.kline is None or trade_time >= self.kline["startTime"] + self.time_step:
+            if self.kline is not None:
+                self.close_kline()
+            self.open_kline(trade_time, price)
+        else:
+            kline = self.kline
+            if price > kline["high"]:
+                kline["high"] = price
+            elif price < kline["low"]:
+                kline["low"] = price
+            kline["close"] = price
+
+        # the common case: the price is between the nearest levels of both heaps
+        above = self.index.above
+        below = self.index.below
+        if (not above or price < above[0][0]) and (not below or price > -below[0][0]):
+            return []
+
+        action_start_time = time.perf_counter()
+        fired = []
+        triggered = self.index.pop_triggered(price)
+        while triggered:
+            for trigger in triggered:
+                self.fire(trigger, trade_time)
+            fired.extend(triggered)
+            # a fill adds the exit levels of the order, the same trade can cross them
+            self.sync_orders()
+            triggered = self.index.pop_triggered(price)
+        if fired:
+            TRIGGERS_FIRED_COUNTER.inc(len(fired))
+            TRIGGER_LATENCY.observe(time.perf_counter() - action_start_time)
+        return fired
+
+    def fire(self, trigger, trade_time):
+        order = trigger.order
+        if order is None:
+            self.analyzer_trigger = None
+            if self.on_alert:
+                self.on_alert(trigger.kind, trigger.price, trade_time)
+            return
+        previous_status = order.status
+        if previous_status == OrderStatus.OPEN and trigger.kind == "entry":
+            order.fullfill(trade_time)
+            order.log_order_fulfilled()
+        elif previous_status == OrderStatus.FULFILLED and trigger.kind in ("take_profit", "stop"):
+            order.close(trade_time, order.take_profit_price if trigger.kind == "take_profit" else order.stop_price)
+            order.log_order_closed()
+        if self.trader.performance is not None and order.status != previous_status:
+            self.trader.performance.on_order_changed(
+                order, previous_status, len(self.trader.sideways_orders) - 1
+            )
+        self.remove_order_triggers(order)
+        self.trader.apply_sideway_rules()
+
+    def sync_orders(self):
+        """Index the levels of the current sideway orders, remove the levels of the orders that don't wait for them."""
+        current_orders = set(self.trader.current_sideway_orders)
+        for order in list(self.order_triggers):
+            if order not in current_orders or order.status not in (OrderStatus.OPEN, OrderStatus.FULFILLED):
+                self.remove_order_triggers(order)
+        for order in self.trader.current_sideway_orders:
+            if order not in self.order_triggers and order.status in (OrderStatus.OPEN, OrderStatus.FULFILLED):
+                self.order_triggers[order] = [
+                    self.index.add(price, direction, kind, order)
+                    for price, direction, kind in get_order_triggers(order)
+                ]
+
+    def remove_order_triggers(self, order):
+        for trigger in self.order_triggers.pop(order, ()):
+            self.index.remove(trigger)
+
+    def open_kline(self, trade_time, price):
+        start_time = trade_time - trade_time % self.time_step
+        self.kline = {
+            "startTime": start_time,
+            "open": price,
+            "high": price,
+            "low": price,
+            "close": price,
+            "closeTime": start_time + self.time_step - 1,
+        }
+        self.is_trading_kline = self.trader.has_active_sideway()
+        self.set_analyzer_trigger()
+
+    def close_kline(self):
+        kline = self.kline
+        if len(self.window_lows) < self.window_lows.maxlen:
+            analyzed_kline, sideway_orders = prepare_kline_plot_data(kline), ()
+        elif self.is_trading_kline or self.trader.has_active_sideway():
+            # the orders were evaluated on the trades of the kline
+            analyzed_kline, sideway_orders = prepare_kline_plot_data(kline), ()
+        else:
+            analyzed_kline, sideway_orders = self.dispatcher.analyze_kline(kline, min(self.window_lows))
+        self.analyzed_klines.append(analyzed_kline)
+        self.orders.extend(sideway_orders)
+        self.window_lows.append(kline["low"])
+        self.sync_orders()
+
+    def set_analyzer_trigger(self):
+        """Index the price at which the current kline becomes a high or a mid kline."""
+        if self.analyzer_trigger is not None:
+            self.index.remove(self.analyzer_trigger)
+            self.analyzer_trigger = None
+        if self.is_trading_kline or len(self.window_lows) < self.window_lows.maxlen:
+            return
+        analyzer = self.analyzer
+        if analyzer.high_kline and analyzer.low_kline:
+            self.analyzer_trigger = self.index.add(analyzer.mid_price, ABOVE, "mid")
+        elif analyzer.high_kline:
+            self.analyzer_trigger = self.index.add(analyzer.high_kline["high"], ABOVE, "high")
+        else:
+            min_price = min(self.window_lows)
+            self.analyzer_trigger = self.index.add(
+                min_price * (1 + analyzer.target_price_growth_percent / 100), ABOVE, "high"
+            )
+
+    def run(self, trades):
+        """Process (time, price) trades in order, returns the analyzed klines and the orders."""
+        for trade_time, price in trades:
+            self.on_trade(trade_time, price)
+        if self.kline is not None:
+            self.close_kline()
+            self.kline = None
+        self.trader.log_order_summary()
+        logger.info(f"Tick monitoring: {len(self.analyzed_klines)} klines, {self.trader.total_orders_count} orders")
+        return self.analyzed_klines, self.orders
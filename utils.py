@@ -1,6 +1,10 @@
+import atexit
+import json
 import os
 import logging
+import queue
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 
 LOG_DIRECTORY = "logs"
 
@@ -20,28 +24,109 @@ def get_next_file_number(directory=".", format=".json"):
     return f"{next_number:04d}"  # Format as four-digit number
 
 
-# Configure the logging level and format
 logger = logging.getLogger("root")
-logger.setLevel(logging.INFO)
 log_formatter = logging.Formatter(
     "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
 )
 
-# File Handler
-if not os.path.exists(LOG_DIRECTORY):
-    os.makedirs(LOG_DIRECTORY)
+# Structured event log (JSON lines), disabled until configure_logging gets an event log path
+events_logger = logging.getLogger("events")
+events_logger.propagate = False
+events_logger.setLevel(logging.CRITICAL + 1)
 
-file_number = get_next_file_number(directory=LOG_DIRECTORY, format=".log")
-file_handler = logging.FileHandler(f"{LOG_DIRECTORY}/{file_number}_processed_klines.log", "w")
-file_handler.setFormatter(log_formatter)
+log_listener = None
 
-# Stream Handler
-stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(log_formatter)
 
-# Add handlers to the logger
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+class DeferredQueueHandler(QueueHandler):
+    """
+    Puts records to the queue without formatting them,
+    the message is built by the handlers of the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class EventFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({"event": record.msg, **record.fields})
+
+
+class UnixTime:
+    """Unix timestamp, converted to a date string only when the log message is built."""
+
+    __slots__ = ("unix_timestamp",)
+
+    def __init__(self, unix_timestamp):
+        self.unix_timestamp = unix_timestamp
+
+    def __str__(self):
+        return convert_unix_full_date_str(self.unix_timestamp)
+
+
+def configure_logging(level=logging.INFO, log_to_file=True, event_log_path=None):
+    """
+    Configure the logging level and handlers, called by the entry points.
+    Importing the modules does not touch the logs directory.
+    Records are written by a background listener thread, the logging call only puts them to a queue.
+    """
+    global log_listener
+
+    logger.setLevel(level)
+    # a forked worker configures its own logging, the listener of the parent doesn't run in it
+    for configured_logger in (logger, events_logger):
+        for handler in list(configured_logger.handlers):
+            configured_logger.removeHandler(handler)
+    handlers = []
+
+    # File Handler
+    if log_to_file:
+        if not os.path.exists(LOG_DIRECTORY):
+            os.makedirs(LOG_DIRECTORY)
+
+        file_number = get_next_file_number(directory=LOG_DIRECTORY, format=".log")
+        file_handler = logging.FileHandler(f"{LOG_DIRECTORY}/{file_number}_processed_klines.log", "w")
+        file_handler.setFormatter(log_formatter)
+        handlers.append(file_handler)
+
+    # Stream Handler
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(log_formatter)
+    handlers.append(stream_handler)
+
+    if event_log_path:
+        event_handler = logging.FileHandler(event_log_path, "w")
+        event_handler.setFormatter(EventFormatter())
+        event_handler.addFilter(lambda record: record.name == events_logger.name)
+        handlers.append(event_handler)
+        events_logger.setLevel(logging.INFO)
+        for handler in handlers[:-1]:
+            handler.addFilter(lambda record: record.name != events_logger.name)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    if event_log_path:
+        events_logger.addHandler(queue_handler)
+
+    log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write the records left in the queue and stop the listener thread."""
+    global log_listener
+
+    if log_listener:
+        log_listener.stop()
+        log_listener = None
+
+
+def log_event(event, **fields):
+    """Write an event to the structured event log, if it is enabled."""
+    if events_logger.isEnabledFor(logging.INFO):
+        events_logger.info(event, extra={"fields": fields})
 
 
 def parse_date(date_str):
@@ -53,12 +138,9 @@ def parse_date(date_str):
         return datetime.strptime(date_str, "%Y-%m-%d")
 
 
-def determine_analysis_start_time(analysis_end_time, time_window, coin):
-    from src.binance_client import get_klines
-
-    binance_foundation_date = get_unix_timestamp(datetime.strptime("2017-07-01", "%Y-%m-%d"))
-    klines = get_klines(binance_foundation_date, analysis_end_time, coin)
-    return int(klines[0][0]) + time_window * 60 * 60 * 1000
+def determine_analysis_start_time(kline_manager, time_window):
+    # the listing time is requested from binance once, then it is read from the symbol metadata
+    return kline_manager.get_listing_time() + time_window * 60 * 60 * 1000
 
 
 def serialize_object(obj):
@@ -76,30 +158,69 @@ def convert_unix_to_date_only_str(unix_timestamp):
     return datetime.fromtimestamp(unix_timestamp / 1000).strftime("%Y-%m-%d")
 
 
+def prepare_plot_data(points):
+    """Convert the time of the points to datetime, returns x and y data for plotting."""
+    x_data = []
+    y_data = []
+    for point in points:
+        point["time"] = datetime.strptime(
+            convert_unix_full_date_str(point["time"]), "%Y-%m-%d %H:%M:%S"
+        )
+        x_data.append(point["time"])
+        y_data.append(point["price"])
+    return x_data, y_data
+
+
 def get_kline_time(kline):
     return f"Start time: {convert_unix_full_date_str(kline['startTime'])}, Closing Time: {convert_unix_full_date_str(kline['closeTime'])}"
 
 
+# The kline log functions are called by the analyzer on every event, so they return before building
+# the message when the level is disabled, and the dates are formatted by the log listener thread.
+
 def log_middle_kline(kline):
-    logger.debug(f"Middle kline: {get_kline_time(kline)}, High price: {kline['high']}")
+    log_event("mid", time=kline["closeTime"], price=kline["high"])
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug(
+        "Middle kline: Start time: %s, Closing Time: %s, High price: %s",
+        UnixTime(kline["startTime"]), UnixTime(kline["closeTime"]), kline["high"],
+    )
 
 
-def log_high_kline(kline):
-    if 'target_price_growth_percent' in kline is not None:
+def log_high_kline(kline, growth_percent=None):
+    log_event("high", time=kline["closeTime"], price=kline["high"], growth_percent=growth_percent)
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if growth_percent is not None:
         logger.debug(
-            f"New impulse. High kline: (the price increased by {kline['target_price_growth_percent']}%) {get_kline_time(kline)}, High price: {kline['high']}"
+            "New impulse. High kline: (the price increased by %s%%) Start time: %s, Closing Time: %s, High price: %s",
+            growth_percent, UnixTime(kline["startTime"]), UnixTime(kline["closeTime"]), kline["high"],
         )
     else:
         logger.debug(
-            f"High kline: {get_kline_time(kline)}, High price: {kline['high']}"
+            "High kline: Start time: %s, Closing Time: %s, High price: %s",
+            UnixTime(kline["startTime"]), UnixTime(kline["closeTime"]), kline["high"],
         )
 
 
-def log_low_kline(kline):
+def log_low_kline(kline, drop_percent):
+    log_event("low", time=kline["closeTime"], price=kline["low"], drop_percent=drop_percent)
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
     logger.debug(
-        f"Low kline: (the price has dropped by {kline['target_price_drop_percent']}%) {get_kline_time(kline)}, Low price: {kline['low']}"
+        "Low kline: (the price has dropped by %s%%) Start time: %s, Closing Time: %s, Low price: %s",
+        drop_percent, UnixTime(kline["startTime"]), UnixTime(kline["closeTime"]), kline["low"],
     )
 
 
 def log_sideway(high_kline, low_kline, mid_kline, mid_price):
-    logger.info(f"Sideway, High price: {high_kline['high']}, Low price: {low_kline['low']}, Mid price: {mid_price}, Time: {convert_unix_full_date_str(mid_kline['closeTime'])}")
+    log_event(
+        "sideway", time=mid_kline["closeTime"], high=high_kline["high"], low=low_kline["low"], mid_price=mid_price
+    )
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(
+        "Sideway, High price: %s, Low price: %s, Mid price: %s, Time: %s",
+        high_kline["high"], low_kline["low"], mid_price, UnixTime(mid_kline["closeTime"]),
+    )
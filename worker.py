@@ -0,0 +1,163 @@
+import argparse
+import os
+import socket
+import threading
+import time
+import traceback
+from multiprocessing import Process
+
+from src.analyzer import PriceAnalyzer
+from src.core import get_db_name, get_mongo_url
+from src.dispatcher import Dispatcher
+from src.job_queue import LEASE_TIME, JobQueue
+from src.trader import Trader
+from utils import configure_logging, logger
+
+POLL_INTERVAL = 5  # seconds between claims when the queue is empty
+
+
+class Heartbeat:
+    """Extends the lease of a running job from a background thread, three times per lease."""
+
+    def __init__(self, job_queue, job_id, worker_id):
+        self.job_queue = job_queue
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.progress = {"stage": "started"}
+        self.lease_lost = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.job_queue.lease_time / 3000):
+            if not self.job_queue.heartbeat(self.job_id, self.worker_id, dict(self.progress)):
+                logger.warning(f"Lease of job {self.job_id} lost, its result will be dropped")
+                self.lease_lost = True
+                return
+
+    def set_stage(self, stage):
+        self.progress["stage"] = stage
+        self.job_queue.heartbeat(self.job_id, self.worker_id, dict(self.progress))
+
+
+def run_backtest(parameters, heartbeat, mongo_url, db_name):
+    """Historical run of the job parameters, returns its summary."""
+    from src.kline_manager import KlineManager
+
+    kline_manager = KlineManager(mongo_url, db_name, parameters["symbol"], parameters.get("interval") or "1m")
+    trader = Trader()
+    dispatcher = Dispatcher(
+        PriceAnalyzer(
+            parameters["time_window"],
+            parameters["growth_percent"],
+            parameters["drop_percent"],
+            kline_manager.time_step,
+        ),
+        trader,
+        kline_manager,
+    )
+    dispatcher.set_time_interval(parameters["start_time"], parameters["end_time"])
+
+    heartbeat.set_stage("analyzing")
+    if parameters.get("two_pass"):
+        analyzed_klines, orders = dispatcher.run_two_pass_for_historical_data()
+    else:
+        analyzed_klines, orders = dispatcher.run_for_historical_data()
+
+    return {
+        "profit": trader.total_profit,
+        "klines_count": len(analyzed_klines),
+        "orders_count": len(trader.flat_orders),
+        "successful_orders_count": trader.successful_orders_count,
+        "failed_orders_count": trader.failed_orders_count,
+        "sideways_count": len(trader.sideways_orders),
+    }
+
+
+def run_job(job_queue, job, worker_id, mongo_url, db_name, backtest=run_backtest):
+    job_id = job["_id"]
+    logger.info(f"Worker {worker_id} runs job {job_id}, attempt {job['attempts']}: {job['parameters']}")
+    start_time = time.perf_counter()
+    with Heartbeat(job_queue, job_id, worker_id) as heartbeat:
+        try:
+            result = backtest(job["parameters"], heartbeat, mongo_url, db_name)
+        except Exception:
+            logger.error(f"Job {job_id} failed: {traceback.format_exc()}")
+            job_queue.fail(job_id, worker_id, traceback.format_exc())
+            return
+    result["duration_seconds"] = time.perf_counter() - start_time
+    if job_queue.complete(job_id, worker_id, result):
+        logger.info(f"Job {job_id} done in {result['duration_seconds']:.1f}s, profit {result['profit']}")
+    else:
+        logger.warning(f"Job {job_id} is held by another worker, its result is dropped")
+
+
+def run_worker(
+    mongo_url, db_name, lease_time=LEASE_TIME, poll_interval=POLL_INTERVAL, exit_when_empty=False, backtest=run_backtest
+):
+    """
+    Claim and run jobs until the queue is empty with exit_when_empty, forever otherwise.
+    backtest(parameters, heartbeat, mongo_url, db_name) returns the result of a job.
+    """
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    job_queue = JobQueue(mongo_url, db_name, lease_time)
+    jobs_count = 0
+    while True:
+        job = job_queue.claim(worker_id)
+        if job is None:
+            if exit_when_empty:
+                logger.info(f"Worker {worker_id} ran {jobs_count} jobs, the queue is empty")
+                return
+            time.sleep(poll_interval)
+            continue
+        run_job(job_queue, job, worker_id, mongo_url, db_name, backtest)
+        jobs_count += 1
+
+
+def start_worker_process(*worker_args):
+    configure_logging(log_to_file=False)
+    run_worker(*worker_args)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the backtest jobs queued with jobs_script.py, on as many machines as needed."
+    )
+    parser.add_argument(
+        "--mongo-url",
+        type=str,
+        default=get_mongo_url(),
+        help="MongoDB of the queue and the klines, shared by the workers of all machines (MONGO_URL)",
+    )
+    parser.add_argument(
+        "--db-name", type=str, default=get_db_name(), help="Database of the queue and the klines (DB_NAME)"
+    )
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes on this machine")
+    parser.add_argument("--lease-seconds", type=int, default=LEASE_TIME // 1000, help="Lease of a claimed job")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="Seconds between claims when idle")
+    parser.add_argument("--exit-when-empty", action="store_true", help="Stop when there are no jobs to claim")
+    args = parser.parse_args()
+
+    worker_args = (args.mongo_url, args.db_name, args.lease_seconds * 1000, args.poll_interval, args.exit_when_empty)
+    if args.processes == 1:
+        configure_logging()
+        run_worker(*worker_args)
+        return
+
+    processes = [Process(target=start_worker_process, args=worker_args) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()